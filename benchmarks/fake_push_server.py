@@ -0,0 +1,95 @@
+# Local stand-in for the Expo push API, for exercising PushNotificationDispatcher
+# without sending real notifications. Point EXPO_PUSH_URL and EXPO_RECEIPTS_URL at
+# http://127.0.0.1:<port>/--/api/v2/push/send and .../getReceipts.
+# Tokens starting with "invalid" fail at send time and tokens starting with
+# "unregistered" fail in their receipt, both with DeviceNotRegistered.
+# Usage: python -m benchmarks.fake_push_server [--port 8081] [--error-rate 0.1]
+import argparse
+import asyncio
+import random
+import uuid
+
+from aiohttp import web
+
+SEND_PATH = "/--/api/v2/push/send"
+RECEIPTS_PATH = "/--/api/v2/push/getReceipts"
+
+NOT_REGISTERED = {
+    "status": "error",
+    "message": "The recipient device is not registered with FCM.",
+    "details": {"error": "DeviceNotRegistered"},
+}
+
+
+def create_app(latency: float = 0.0, error_rate: float = 0.0) -> web.Application:
+    app = web.Application()
+    app["latency"] = latency
+    app["error_rate"] = error_rate
+    # Ticket id -> push token
+    app["tickets"] = {}
+    app["requests"] = 0
+    app["messages"] = []
+    app.router.add_post(SEND_PATH, send)
+    app.router.add_post(RECEIPTS_PATH, get_receipts)
+    return app
+
+
+async def simulate(app: web.Application):
+    app["requests"] += 1
+    if app["latency"]:
+        await asyncio.sleep(app["latency"])
+    if random.random() < app["error_rate"]:
+        raise web.HTTPServiceUnavailable()
+
+
+async def send(request: web.Request) -> web.Response:
+    app = request.app
+    await simulate(app)
+
+    messages = await request.json()
+    if isinstance(messages, dict):
+        messages = [messages]
+    if len(messages) > 100:
+        return web.json_response(
+            {"errors": [{"code": "PUSH_TOO_MANY_NOTIFICATIONS"}]}, status=400
+        )
+
+    tickets = []
+    for message in messages:
+        app["messages"].append(message)
+        if message["to"].startswith("invalid"):
+            tickets.append(NOT_REGISTERED)
+            continue
+        ticket_id = str(uuid.uuid4())
+        app["tickets"][ticket_id] = message["to"]
+        tickets.append({"status": "ok", "id": ticket_id})
+    return web.json_response({"data": tickets})
+
+
+async def get_receipts(request: web.Request) -> web.Response:
+    app = request.app
+    await simulate(app)
+
+    receipts = {}
+    for ticket_id in (await request.json())["ids"]:
+        token = app["tickets"].get(ticket_id)
+        if token is None:
+            continue
+        receipts[ticket_id] = (
+            NOT_REGISTERED if token.startswith("unregistered") else {"status": "ok"}
+        )
+    return web.json_response({"data": receipts})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    web.run_app(create_app(args.latency, args.error_rate), port=args.port)
+
+
+if __name__ == "__main__":
+    main()
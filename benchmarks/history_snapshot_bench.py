@@ -0,0 +1,128 @@
+# Compare stored bytes and read latency of PatrolHistory snapshot formats on a
+# synthetic "chatty" product listing where a few prices and stock labels change
+# between snapshots.
+# Usage: python -m benchmarks.history_snapshot_bench [--snapshots 200] [--products 60]
+import argparse
+import random
+import time
+
+from src.util import snapshot_codec
+
+
+def make_snapshots(count: int, products: int, seed: int = 42):
+    rng = random.Random(seed)
+    state = [
+        {"price": rng.randint(10, 500), "stock": rng.choice(["In stock", "Sold out"])}
+        for _ in range(products)
+    ]
+
+    snapshots = []
+    for _ in range(count):
+        for product in rng.sample(state, k=max(1, products // 20)):
+            product["price"] = rng.randint(10, 500)
+            product["stock"] = rng.choice(["In stock", "Sold out", "Low stock"])
+        items = "".join(
+            f'<li class="product" data-id="{i}"><a href="https://example.com/p/{i}">'
+            f'<span class="name">Product {i} with a long descriptive title</span>'
+            f'<span class="price">&#163;{p["price"]}.99</span>'
+            f'<span class="stock">{p["stock"]}</span></a></li>'
+            for i, p in enumerate(state)
+        )
+        snapshots.append(f'<ul class="products">{items}</ul>')
+    return snapshots
+
+
+# Mirror PatrolHistoryManagement.encode_snapshot without table storage
+def encode_rows(snapshots, use_delta: bool, keyframe_interval: int):
+    rows = []
+    keyframe_index = None
+    for html in snapshots:
+        keyframe = snapshot_codec.encode_keyframe(html)
+        delta_index = rows[-1]["delta_index"] + 1 if rows else 0
+        if use_delta and rows and delta_index < keyframe_interval:
+            delta = snapshot_codec.encode_delta(snapshots[keyframe_index], html)
+            if len(delta) < len(keyframe):
+                rows.append(
+                    {
+                        "encoding": snapshot_codec.DELTA,
+                        "content": delta,
+                        "base": keyframe_index,
+                        "delta_index": delta_index,
+                    }
+                )
+                continue
+
+        keyframe_index = len(rows)
+        rows.append(
+            {"encoding": snapshot_codec.KEYFRAME, "content": keyframe, "delta_index": 0}
+        )
+    return rows
+
+
+# Decode the newest page_size rows the way get_patrol_history does
+def read_page(rows, page_size: int):
+    page = list(range(len(rows) - 1, max(-1, len(rows) - 1 - page_size), -1))
+    keyframes = {}
+
+    def keyframe_html(index):
+        if index not in keyframes:
+            keyframes[index] = snapshot_codec.decode(
+                rows[index]["content"], snapshot_codec.KEYFRAME
+            )
+        return keyframes[index]
+
+    return [
+        keyframe_html(index)
+        if rows[index]["encoding"] == snapshot_codec.KEYFRAME
+        else snapshot_codec.decode(
+            rows[index]["content"],
+            snapshot_codec.DELTA,
+            keyframe_html(rows[index]["base"]),
+        )
+        for index in page
+    ]
+
+
+def timed(func, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--snapshots", type=int, default=200)
+    parser.add_argument("--products", type=int, default=60)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--keyframe-interval", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    snapshots = make_snapshots(args.snapshots, args.products)
+    raw_bytes = sum(len(html.encode("utf-8")) for html in snapshots)
+    raw_page = snapshots[-args.page_size :]
+
+    print(
+        f"{args.snapshots} snapshots, {raw_bytes / len(snapshots):.0f} bytes each on average"
+    )
+    print(f"{'format':<20}{'stored bytes':>14}{'ratio':>8}{'read page (ms)':>16}")
+    print(
+        f"{'raw':<20}{raw_bytes:>14}{1:>8.2f}{timed(lambda: list(raw_page), args.repeat):>16.3f}"
+    )
+
+    for name, use_delta in (("zlib keyframes", False), ("zlib + deltas", True)):
+        start = time.perf_counter()
+        rows = encode_rows(snapshots, use_delta, args.keyframe_interval)
+        encode_ms = (time.perf_counter() - start) / len(snapshots) * 1000
+
+        assert read_page(rows, args.page_size) == snapshots[::-1][: args.page_size]
+        stored = sum(len(row["content"]) for row in rows)
+        read_ms = timed(lambda: read_page(rows, args.page_size), args.repeat)
+        print(
+            f"{name:<20}{stored:>14}{raw_bytes / stored:>8.2f}{read_ms:>16.3f}  (encode {encode_ms:.3f} ms/snapshot)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Compare the per-query cost of matching a search string against an XPath selected
+# element: the previous requests_html path (xpath string re-parsed on every call,
+# element.text plus .text of every descendant) against compiled, cached XPath and
+# a single pass over the element's text.
+# Usage: python -m benchmarks.html_matcher_bench [--products 1000] [--depth 40]
+import argparse
+import random
+import time
+
+from requests_html import HTML
+
+from src.util import html_matcher
+
+
+# A large product listing plus a deeply nested wrapper around the price block,
+# like the div soup of many shop front-ends
+def make_page(products: int, depth: int, seed: int = 42) -> str:
+    rng = random.Random(seed)
+    items = "".join(
+        f'<li class="product" data-id="{i}"><a href="/p/{i}">'
+        f'<span class="name">Product {i} with a long descriptive title</span>'
+        f'<span class="price">&#163;{rng.randint(10, 500)}.99</span>'
+        f'<span class="stock">{rng.choice(["In stock", "Sold out"])}</span>'
+        f'<span class="delivery">Free&nbsp;delivery</span></a></li>'
+        for i in range(products)
+    )
+    nested = "<div><span>wrapper text</span>" * depth
+    nested += '<p class="offer">Limited offer</p>' + "</div>" * depth
+    return (
+        f'<html><body><ul id="products">{items}</ul>'
+        f'<section id="nested">{nested}</section></body></html>'
+    )
+
+
+def match_previous(html: HTML, xpath: str, search_string: str) -> bool:
+    element = html.xpath(xpath)[0]
+    return search_string in element.text or any(
+        search_string in child.text for child in element.xpath(".//*")
+    )
+
+
+def match_current(root, xpath: str, search_string: str) -> bool:
+    element = html_matcher.compile_xpath(xpath)(root)[0]
+    return search_string in html_matcher.get_text_content(element)
+
+
+def timed(func, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    text = make_page(args.products, args.depth)
+    html = HTML(html=text)
+    root = html.lxml
+    queries = [
+        ("listing", "//ul[@id='products']", f"Product {args.products - 1} with"),
+        ("single item", "//li[@data-id='7']", "In stock"),
+        ("deep nesting", "//section[@id='nested']", "Limited offer"),
+        ("not found", "//section[@id='nested']", "Out of stock"),
+        # Text copied from a page keeps its non-breaking spaces
+        ("nbsp", "//li[@data-id='7']", "Free\xa0delivery"),
+    ]
+
+    print(f"page of {len(text)} bytes, {args.products} products, depth {args.depth}")
+    print(f"{'query':<16}{'previous (ms)':>16}{'current (ms)':>16}{'speedup':>10}")
+    for name, xpath, search_string in queries:
+        expected = match_previous(html, xpath, search_string)
+        assert match_current(root, xpath, search_string) == expected
+
+        previous_ms = timed(
+            lambda: match_previous(html, xpath, search_string), args.repeat
+        )
+        current_ms = timed(
+            lambda: match_current(root, xpath, search_string), args.repeat
+        )
+        print(
+            f"{name:<16}{previous_ms:>16.3f}{current_ms:>16.3f}{previous_ms / current_ms:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# Drop-in stand-in for TableStorage that keeps every table in process memory, so
+# benchmarks can drive the scrape pipeline without Azure Tables. Filters, select,
+# paging, ETag conditions and batches behave like the real service for the
+# queries this app issues.
+import itertools
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+)
+from azure.data.tables import TableEntity, TransactionOperation, UpdateMode
+
+from src.storage_backend import BatchResult, StorageBackend
+from src.util.odata_filter import compile_filter
+
+
+class InMemoryTable:
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        # (PartitionKey, RowKey) -> (etag, entity)
+        self.rows: Dict[Tuple[str, str], Tuple[str, Dict[str, Any]]] = {}
+
+    async def close(self):
+        pass
+
+
+class InMemoryTableStorage(StorageBackend):
+    def __init__(self):
+        self.page_patrol_table_client = InMemoryTable("PagePatrol")
+        self.patrol_history_table_client = InMemoryTable("PatrolHistory")
+        self.patrol_lease_table_client = InMemoryTable("PatrolLeases")
+        self.worker_status_table_client = InMemoryTable("WorkerStatus")
+        self.versions = itertools.count()
+        self.calls: Dict[str, int] = defaultdict(int)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def to_entity(self, etag: str, entity: Dict[str, Any], select=None) -> TableEntity:
+        if select:
+            entity = {key: entity[key] for key in select if key in entity}
+        result = TableEntity(entity)
+        result._metadata = {"etag": etag, "timestamp": datetime.now(timezone.utc)}
+        return result
+
+    def write(self, table: InMemoryTable, entity) -> Dict[str, Any]:
+        etag = f'W/"{next(self.versions)}"'
+        table.rows[(entity["PartitionKey"], entity["RowKey"])] = (etag, dict(entity))
+        return {"etag": etag}
+
+    def check_etag(self, table: InMemoryTable, key, etag, match_condition):
+        if key not in table.rows:
+            raise ResourceNotFoundError("The specified resource does not exist.")
+        stored_etag = table.rows[key][0]
+        if match_condition == MatchConditions.IfNotModified and etag != stored_etag:
+            raise ResourceModifiedError("The update condition was not satisfied.")
+
+    async def create_entity(self, table_client: InMemoryTable, entity, **kwargs):
+        self.calls["create"] += 1
+        if (entity["PartitionKey"], entity["RowKey"]) in table_client.rows:
+            raise ResourceExistsError("The specified entity already exists.")
+        return self.write(table_client, entity)
+
+    def query(
+        self, table_client: InMemoryTable, query_filter
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        predicate = compile_filter(query_filter or "")
+        return [
+            (etag, entity)
+            for _, (etag, entity) in sorted(table_client.rows.items())
+            if predicate(entity)
+        ]
+
+    async def query_entities(
+        self,
+        table_client: InMemoryTable,
+        query_filter,
+        select: Optional[List[str]] = None,
+        results_per_page: Optional[int] = None,
+    ):
+        self.calls["query"] += 1
+        return [
+            self.to_entity(etag, entity, select)
+            for etag, entity in self.query(table_client, query_filter)
+        ]
+
+    async def query_entities_page(
+        self,
+        table_client: InMemoryTable,
+        query_filter,
+        select: Optional[List[str]] = None,
+        results_per_page: Optional[int] = None,
+        continuation_token: Optional[Any] = None,
+    ) -> Tuple[List, Optional[Any]]:
+        self.calls["query_page"] += 1
+        rows = self.query(table_client, query_filter)
+        start = continuation_token or 0
+        end = start + (results_per_page or 1000)
+        page = [
+            self.to_entity(etag, entity, select) for etag, entity in rows[start:end]
+        ]
+        return page, end if end < len(rows) else None
+
+    async def get_entity(
+        self,
+        table_client: InMemoryTable,
+        partition_key,
+        row_key,
+        select: Optional[List[str]] = None,
+    ):
+        self.calls["get"] += 1
+        if (partition_key, row_key) not in table_client.rows:
+            raise ResourceNotFoundError("The specified resource does not exist.")
+        etag, entity = table_client.rows[(partition_key, row_key)]
+        return self.to_entity(etag, entity, select)
+
+    async def update_entity(
+        self,
+        table_client: InMemoryTable,
+        mode,
+        entity,
+        etag=None,
+        match_condition=None,
+        **kwargs,
+    ):
+        self.calls["update"] += 1
+        key = (entity["PartitionKey"], entity["RowKey"])
+        self.check_etag(table_client, key, etag, match_condition)
+        if mode == UpdateMode.MERGE:
+            entity = {**table_client.rows[key][1], **entity}
+        return self.write(table_client, entity)
+
+    async def upsert_entity(self, table_client: InMemoryTable, mode, entity):
+        self.calls["upsert"] += 1
+        key = (entity["PartitionKey"], entity["RowKey"])
+        if mode == UpdateMode.MERGE and key in table_client.rows:
+            entity = {**table_client.rows[key][1], **entity}
+        self.write(table_client, entity)
+
+    async def delete_entity(
+        self,
+        table_client: InMemoryTable,
+        partition_key,
+        row_key,
+        etag=None,
+        match_condition=None,
+        **kwargs,
+    ):
+        self.calls["delete"] += 1
+        key = (partition_key, row_key)
+        if key not in table_client.rows:
+            return
+        self.check_etag(table_client, key, etag, match_condition)
+        del table_client.rows[key]
+
+    async def submit_batch(
+        self, table_client: InMemoryTable, operations: List[Tuple]
+    ) -> List[BatchResult]:
+        self.calls["batch"] += 1
+        results = []
+        for operation in operations:
+            action, entity = operation[0], operation[1]
+            kwargs = operation[2] if len(operation) > 2 else {}
+            try:
+                if action == TransactionOperation.CREATE:
+                    await self.create_entity(table_client, entity)
+                elif action == TransactionOperation.UPDATE:
+                    await self.update_entity(
+                        table_client, kwargs.get("mode", UpdateMode.MERGE), entity
+                    )
+                elif action == TransactionOperation.UPSERT:
+                    await self.upsert_entity(
+                        table_client, kwargs.get("mode", UpdateMode.MERGE), entity
+                    )
+                else:
+                    await self.delete_entity(
+                        table_client, entity["PartitionKey"], entity["RowKey"]
+                    )
+            except Exception as e:
+                results.append(BatchResult(operation, e))
+                continue
+            results.append(BatchResult(operation))
+        return results
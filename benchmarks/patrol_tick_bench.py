@@ -0,0 +1,293 @@
+# Drive N patrols through full scheduler ticks against local stand-ins: synthetic
+# pages, in-memory or SQLite table storage and a fake Expo push API. Reports
+# patrols/sec, per-patrol latency percentiles, peak RSS of the main process and
+# of the largest parser pool process, and event loop block time, and writes the
+# results to JSON so runs can be compared across commits.
+# Usage: python -m benchmarks.patrol_tick_bench [--patrols 1000] [--urls 200]
+#        [--page-size 100000] [--latency 0.05] [--ticks 2] [--etag]
+#        [--storage memory|sqlite]
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+from benchmarks import fake_push_server, synthetic_site
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def start_server(app: web.Application) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner
+
+
+def get_base_url(runner: web.AppRunner) -> str:
+    host, port = runner.addresses[0][:2]
+    return f"http://{host}:{port}"
+
+
+# Measures how long the event loop was blocked by sleeping for a short interval
+# and recording how late each wake-up was
+class LoopMonitor:
+    def __init__(self, interval: float = 0.01, threshold: float = 0.005):
+        self.interval = interval
+        self.threshold = threshold
+        self.reset()
+
+    def reset(self):
+        self.blocked = 0.0
+        self.max_block = 0.0
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - start - self.interval
+            if lag > self.threshold:
+                self.blocked += lag
+                self.max_block = max(self.max_block, lag)
+
+
+async def seed_patrols(storage, base_url: str, patrols: int, urls: int):
+    operations = []
+    for index in range(patrols):
+        entity = {
+            "PartitionKey": f"user-{index % 50}",
+            "RowKey": str(uuid.UUID(int=index)),
+            "expo_push_token": f"ExponentPushToken[bench-{index}]",
+            "date_added": 0,
+            "url": f"{base_url}/page/{index % urls}",
+            "xpath": "//div[@id='stock']",
+            "search_string": "In stock",
+            "scrape_interval": 1,
+            "is_enabled": True,
+            "is_deleted": False,
+        }
+        operations.append(("upsert", entity))
+    await storage.submit_batch(storage.page_patrol_table_client, operations)
+
+
+async def run(args) -> dict:
+    site = synthetic_site.create_app(
+        args.page_size, args.latency, args.error_rate, args.etag
+    )
+    site_runner = await start_server(site)
+    push = fake_push_server.create_app()
+    push_runner = await start_server(push)
+    site_url, push_url = get_base_url(site_runner), get_base_url(push_runner)
+
+    # Settings are read when src is first imported, so configure the app first.
+    # Headers come from a pre-filled cache so no browser is needed.
+    headers_cache = os.path.join(tempfile.mkdtemp(), "headers_cache.json")
+    with open(headers_cache, "w", encoding="utf-8") as f:
+        json.dump({site_url: [time.time(), {"user-agent": "patrol-bench"}]}, f)
+    os.environ.update(
+        {
+            "EXPO_PUSH_URL": f"{push_url}{fake_push_server.SEND_PATH}",
+            "EXPO_RECEIPTS_URL": f"{push_url}{fake_push_server.RECEIPTS_PATH}",
+            "HEADERS_CACHE_PATH": headers_cache,
+            "SCRAPER_CONCURRENCY": str(args.concurrency),
+            "DOMAIN_RATE": str(args.domain_rate),
+            "DOMAIN_BURST": str(max(1, int(args.domain_rate))),
+            "PUSH_BATCH_LINGER": "0.05",
+        }
+    )
+    if args.parser_pool_size is not None:
+        os.environ["PARSER_POOL_SIZE"] = str(args.parser_pool_size)
+
+    from benchmarks.in_memory_storage import InMemoryTableStorage
+    from src.api.patrol_history_mgmt import PatrolHistoryManagement
+    from src.api.scraper import Scraper
+    from src.sqlite_storage import SqliteTableStorage
+    from src.util.browser_pool import BrowserPool
+    from src.util.domain_throttle import DomainThrottle
+    from src.util.fetch_engine import FetchEngine
+    from src.util.http_client import HttpClient
+    from src.util.http_headers_manager import HttpHeadersManager
+    from src.util.parser_pool import ParserPool
+    from src.util.patrol_schedule import PatrolSchedule
+    from src.util.push_dispatcher import PushNotificationDispatcher
+
+    # Time each URL group from when it is scheduled until all its patrols finish
+    class BenchScraper(Scraper):
+        latencies = []
+
+        async def run_patrol_group(self, url, entities, semaphore, stats):
+            start = time.perf_counter()
+            await super().run_patrol_group(url, entities, semaphore, stats)
+            self.latencies.extend([time.perf_counter() - start] * len(entities))
+
+    if args.storage == "sqlite":
+        storage = SqliteTableStorage(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    else:
+        storage = InMemoryTableStorage()
+    await storage.start()
+    await seed_patrols(storage, site_url, args.patrols, args.urls)
+    calls = getattr(storage, "calls", {})
+    calls.clear()
+
+    http_client = HttpClient()
+    push_dispatcher = PushNotificationDispatcher(http_client)
+    parser_pool = ParserPool()
+    # Every patrol is made due at once, measure the tick without the start limit
+    schedule = PatrolSchedule(max_starts_per_second=0)
+    # Synthetic pages are static, so the browser is never actually launched
+    browser_pool = BrowserPool()
+    scraper = BenchScraper(
+        storage,
+        PatrolHistoryManagement(storage, push_dispatcher, parser_pool),
+        HttpHeadersManager(browser_pool),
+        http_client,
+        schedule,
+        parser_pool,
+        DomainThrottle(),
+        FetchEngine(browser_pool),
+    )
+
+    await http_client.start()
+    await push_dispatcher.start()
+    parser_pool.start()
+    await scraper.seed_schedule()
+
+    monitor = LoopMonitor()
+    monitor_task = asyncio.create_task(monitor.run())
+    ticks = []
+    for tick in range(args.ticks):
+        # Make every patrol due again for the following ticks
+        for key in list(schedule.entries):
+            schedule.schedule(key, time.time())
+        scraper.latencies.clear()
+        monitor.reset()
+        site_requests = site["requests"]
+
+        start = time.perf_counter()
+        stats = await scraper.process_page_patrol()
+        duration = time.perf_counter() - start
+
+        ticks.append(
+            {
+                "tick": tick,
+                "duration_seconds": duration,
+                "patrols_per_second": stats.due / duration if duration else 0.0,
+                "latency_p50_seconds": percentile(scraper.latencies, 0.5),
+                "latency_p99_seconds": percentile(scraper.latencies, 0.99),
+                "loop_blocked_seconds": monitor.blocked,
+                "loop_max_block_seconds": monitor.max_block,
+                "site_requests": site["requests"] - site_requests,
+                "stats": {
+                    key: value
+                    for key, value in vars(stats).items()
+                    if key != "pending_writes"
+                },
+            }
+        )
+
+    await push_dispatcher.close(timeout=30)
+    monitor_task.cancel()
+    # Wait for the parser pool processes to exit, as only children that have been
+    # waited for count towards RUSAGE_CHILDREN
+    if parser_pool.executor is not None:
+        parser_pool.executor.shutdown(wait=True)
+    parser_pool.close()
+    await http_client.close()
+    await site_runner.cleanup()
+    await push_runner.cleanup()
+    await storage.close()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # The largest single child, i.e. parser pool process, not a sum over them
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "commit": get_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "ticks": ticks,
+        "peak_rss_bytes": usage.ru_maxrss * rss_unit,
+        "peak_child_rss_bytes": child_usage.ru_maxrss * rss_unit,
+        "push": {
+            "requests": push["requests"],
+            "messages": len(push["messages"]),
+            "sent": push_dispatcher.sent,
+            "failed": push_dispatcher.failed,
+            "undelivered": push_dispatcher.undelivered,
+        },
+        "storage_calls": dict(calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patrols", type=int, default=1000)
+    parser.add_argument("--urls", type=int, default=200)
+    parser.add_argument("--page-size", type=int, default=100_000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--etag", action="store_true")
+    parser.add_argument("--ticks", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--parser-pool-size", type=int, default=None)
+    # Per-origin rate limit; every synthetic page shares one origin
+    parser.add_argument("--domain-rate", type=float, default=1_000_000)
+    parser.add_argument("--storage", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+
+    output = args.output or os.path.join(
+        "benchmarks", "results", f"patrol_tick_{result['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    print(
+        f"{'tick':<6}{'patrols/s':>12}{'p50 (ms)':>12}{'p99 (ms)':>12}{'blocked (ms)':>14}"
+    )
+    for tick in result["ticks"]:
+        print(
+            f"{tick['tick']:<6}{tick['patrols_per_second']:>12.1f}"
+            f"{tick['latency_p50_seconds'] * 1000:>12.1f}"
+            f"{tick['latency_p99_seconds'] * 1000:>12.1f}"
+            f"{tick['loop_blocked_seconds'] * 1000:>14.1f}"
+        )
+    print(
+        f"peak RSS {result['peak_rss_bytes'] / 2**20:.1f} MiB main process,"
+        f" {result['peak_child_rss_bytes'] / 2**20:.1f} MiB largest parser process,"
+        f" results in {output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Local HTTP server serving synthetic product pages of a configurable size, with
+# optional latency, error rate and ETag revalidation, for benchmarking scrapes.
+# Every page has a <div id="stock"> holding the stock label patrols search for.
+# Usage: python -m benchmarks.synthetic_site [--port 8080] [--page-size 100000]
+import argparse
+import asyncio
+import hashlib
+import random
+
+from aiohttp import web
+
+
+def make_page(page_id: int, size: int) -> str:
+    rng = random.Random(page_id)
+    items = []
+    length = 0
+    index = 0
+    while length < size:
+        item = (
+            f'<li class="product" data-id="{index}"><a href="/p/{page_id}/{index}">'
+            f'<span class="name">Product {index} with a long descriptive title</span>'
+            f'<span class="price">&#163;{rng.randint(10, 500)}.99</span></a></li>'
+        )
+        items.append(item)
+        length += len(item)
+        index += 1
+
+    stock = "In stock" if page_id % 2 == 0 else "Sold out"
+    return (
+        f"<html><head><title>Page {page_id}</title></head><body>"
+        f'<div id="stock"><span class="label">{stock}</span></div>'
+        f'<ul class="products">{"".join(items)}</ul></body></html>'
+    )
+
+
+def create_app(
+    page_size: int = 100_000,
+    latency: float = 0.0,
+    error_rate: float = 0.0,
+    etag: bool = False,
+    seed: int = 42,
+) -> web.Application:
+    app = web.Application()
+    app["page_size"] = page_size
+    app["latency"] = latency
+    app["error_rate"] = error_rate
+    app["etag"] = etag
+    app["rng"] = random.Random(seed)
+    app["pages"] = {}
+    app["requests"] = 0
+    app["not_modified"] = 0
+    app.router.add_get("/page/{page_id}", serve_page)
+    return app
+
+
+async def serve_page(request: web.Request) -> web.Response:
+    app = request.app
+    app["requests"] += 1
+    if app["latency"]:
+        await asyncio.sleep(app["latency"])
+    if app["rng"].random() < app["error_rate"]:
+        raise web.HTTPInternalServerError()
+
+    page_id = int(request.match_info["page_id"])
+    if page_id not in app["pages"]:
+        text = make_page(page_id, app["page_size"])
+        app["pages"][page_id] = (text, f'"{hashlib.md5(text.encode()).hexdigest()}"')
+    text, page_etag = app["pages"][page_id]
+
+    if not app["etag"]:
+        return web.Response(text=text, content_type="text/html")
+
+    if request.headers.get("If-None-Match") == page_etag:
+        app["not_modified"] += 1
+        return web.Response(status=304, headers={"ETag": page_etag})
+    return web.Response(
+        text=text, content_type="text/html", headers={"ETag": page_etag}
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--page-size", type=int, default=100_000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--etag", action="store_true")
+    args = parser.parse_args()
+
+    web.run_app(
+        create_app(args.page_size, args.latency, args.error_rate, args.etag),
+        port=args.port,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+from fastapi import APIRouter
+
+from src.util.domain_throttle import DomainThrottle
+from src.util.worker_status import WorkerRegistry
+
+
+class AdminManagement:
+    def __init__(
+        self, domain_throttle: DomainThrottle, worker_registry: WorkerRegistry
+    ):
+        self.router = APIRouter()
+        self.domain_throttle = domain_throttle
+        self.worker_registry = worker_registry
+
+        self.router.get("/admin/domains")(self.get_domains)
+        self.router.get("/admin/workers")(self.get_workers)
+
+    # Rate limit, backoff and circuit breaker state of every origin scraped so far
+    async def get_domains(self):
+        return {"domains": self.domain_throttle.get_domains()}
+
+    # Health and throughput of the scrape workers, from their latest heartbeats
+    async def get_workers(self):
+        workers = await self.worker_registry.list_workers()
+        alive = [worker for worker in workers if worker["alive"]]
+        return {
+            "alive": len(alive),
+            "patrols_per_minute": sum(worker["patrols_per_minute"] for worker in alive),
+            "workers": workers,
+        }
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+
+class MetricsManagement:
+    def __init__(self):
+        self.router = APIRouter()
+
+        self.router.get("/metrics", include_in_schema=False)(self.get_metrics)
+
+    # Scrape pipeline metrics in the Prometheus text exposition format
+    async def get_metrics(self):
+        return Response(
+            generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST}
+        )
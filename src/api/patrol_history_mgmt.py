@@ -1,135 +1,349 @@
+import base64
+import hashlib
+import json
 import re
-import uuid
 from datetime import datetime
-from operator import itemgetter
-from typing import List
+from typing import Dict, List, Optional
 
-from fastapi import APIRouter, HTTPException
-from requests_html import AsyncHTMLSession
+from azure.data.tables import UpdateMode
+from fastapi import APIRouter, HTTPException, Query, Response
 
 from src.auth_config import auth_config
 from src.logger_config import setup_logger
-from src.models import PatrolHistory
-from src.table_storage import TableStorage
+from src.models import PatrolHistory, get_history_row_key
+from src.storage_backend import StorageBackend
+from src.util import snapshot_codec
+from src.util.parser_pool import ParserPool
+from src.util.push_dispatcher import PushNotificationDispatcher
+from src.util.shard_coordinator import get_shard
 
 
 class PatrolHistoryManagement:
-    def __init__(self, table_storage: TableStorage):
+    def __init__(
+        self,
+        table_storage: StorageBackend,
+        push_dispatcher: PushNotificationDispatcher,
+        parser_pool: ParserPool,
+    ):
         self.logger = setup_logger(__name__)
         self.router = APIRouter()
         self.table_storage = table_storage
+        self.push_dispatcher = push_dispatcher
+        # Snapshots are diffed and compressed in the pool, off the event loop
+        self.parser_pool = parser_pool
 
         self.router.get("/page-patrol/{page_patrol_id}/history")(
             self.get_patrol_history
         )
 
-    def record_scrape_history(
+    async def record_scrape_history(
         self,
         partition_key: str,
         page_patrol_id: str,
         scrape_time: datetime,
         scrape_html_content: str,
     ):
-        # Get user information from the authentication system
+        # Partitioned by patrol with an inverted timestamp so the newest comes first
         patrol_history = PatrolHistory(
-            PartitionKey=partition_key,
-            RowKey=str(uuid.uuid4()),
+            PartitionKey=page_patrol_id,
+            RowKey=get_history_row_key(scrape_time),
             page_patrol_id=page_patrol_id,
+            user_id=partition_key,
             scrape_time=scrape_time,
             scrape_html_content=scrape_html_content,
         )
 
+        # Store the snapshot compressed, as a delta against the latest keyframe
+        # where that is smaller
+        latest_entity = await self.get_latest_history_entity(page_patrol_id)
+        entity = patrol_history.dict(exclude={"scrape_html_content"})
+        entity.update(
+            await self.encode_snapshot(
+                page_patrol_id, scrape_html_content, latest_entity
+            )
+        )
+
         self.logger.info(
             f"page_patrol_id: {page_patrol_id} - Recording new HTML content"
+            f" ({entity['content_encoding']}, {len(entity['scrape_html_compressed'])}"
+            f" bytes)"
         )
-        self.table_storage.create_entity(
+        await self.table_storage.create_entity(
             self.table_storage.patrol_history_table_client,
-            entity=patrol_history.dict(),
+            entity=entity,
         )
 
-    def is_scrape_history_needed(
-        self, page_patrol_id: str, scrape_html_content: str
-    ) -> bool:
-        history_entities = (
-            self.table_storage.patrol_history_table_client.query_entities(
-                query_filter=f"page_patrol_id eq '{page_patrol_id}'",
+    async def encode_snapshot(
+        self, page_patrol_id: str, scrape_html_content: str, latest_entity
+    ) -> Dict:
+        latest_encoding = (latest_entity or {}).get("content_encoding")
+        delta_index = (latest_entity or {}).get("delta_index", 0) + 1
+        can_delta = latest_encoding in (snapshot_codec.KEYFRAME, snapshot_codec.DELTA)
+        if not auth_config.HISTORY_DELTA_ENABLED:
+            can_delta = False
+        # Start a new keyframe every HISTORY_KEYFRAME_INTERVAL snapshots
+        if delta_index >= auth_config.HISTORY_KEYFRAME_INTERVAL:
+            can_delta = False
+
+        base_row_key, base_html = None, None
+        if can_delta:
+            base_row_key = (
+                latest_entity["RowKey"]
+                if latest_encoding == snapshot_codec.KEYFRAME
+                else latest_entity["base_row_key"]
             )
+            base_html = await self.get_keyframe_html(
+                page_patrol_id, base_row_key, {latest_entity["RowKey"]: latest_entity}
+            )
+
+        encoding, content = await self.parser_pool.run(
+            snapshot_codec.encode, scrape_html_content, base_html
         )
-        history_entities = sorted(
-            history_entities, key=itemgetter("scrape_time"), reverse=True
-        )
+        if encoding == snapshot_codec.DELTA:
+            return {
+                "content_encoding": snapshot_codec.DELTA,
+                "scrape_html_compressed": content,
+                "base_row_key": base_row_key,
+                "delta_index": delta_index,
+            }
 
-        if len(history_entities) == 0:
-            return True
-        elif history_entities:  # Compare saved html with html scraped.
-            previously_recorded_html = str(
-                history_entities[0].get("scrape_html_content")
-            )
+        return {
+            "content_encoding": snapshot_codec.KEYFRAME,
+            "scrape_html_compressed": content,
+            "delta_index": 0,
+        }
 
-            # Remove any reference of a token from htmls as these will generally always be different
-            token_regex_pattern = 'token="+\\S+"'
-            previously_recorded_html_without_token = re.sub(
-                token_regex_pattern, "", previously_recorded_html
-            )
-            scraped_html_without_token = re.sub(
-                token_regex_pattern, "", scrape_html_content
+    # Decode the keyframe row_key, from the given rows if present or else from storage
+    async def get_keyframe_html(
+        self, page_patrol_id: str, row_key: str, known_entities: Dict, cache=None
+    ) -> str:
+        cache = {} if cache is None else cache
+        if row_key not in cache:
+            entity = known_entities.get(row_key)
+            if entity is None:
+                entity = await self.table_storage.get_entity(
+                    self.table_storage.patrol_history_table_client,
+                    page_patrol_id,
+                    row_key,
+                )
+            cache[row_key] = await self.parser_pool.run(
+                snapshot_codec.decode,
+                entity["scrape_html_compressed"],
+                snapshot_codec.KEYFRAME,
             )
+        return cache[row_key]
 
-            return previously_recorded_html_without_token != scraped_html_without_token
-        else:
-            return False
+    # Reconstruct the HTML of history rows stored raw, compressed or as deltas
+    async def decode_snapshots(self, page_patrol_id: str, entities) -> List[str]:
+        known_entities = {entity["RowKey"]: entity for entity in entities}
+        keyframe_cache: Dict[str, str] = {}
 
-    # Retrieve all patrol history for page patrol entity
-    async def get_patrol_history(self, page_patrol_id: str) -> List[PatrolHistory]:
-        entities = self.table_storage.query_entities(
+        snapshots = []
+        for entity in entities:
+            encoding = entity.get("content_encoding", snapshot_codec.RAW)
+            if encoding == snapshot_codec.RAW:
+                snapshots.append(str(entity.get("scrape_html_content") or ""))
+            elif encoding == snapshot_codec.KEYFRAME:
+                snapshots.append(
+                    await self.get_keyframe_html(
+                        page_patrol_id, entity["RowKey"], known_entities, keyframe_cache
+                    )
+                )
+            else:
+                base_html = await self.get_keyframe_html(
+                    page_patrol_id,
+                    entity["base_row_key"],
+                    known_entities,
+                    keyframe_cache,
+                )
+                snapshots.append(
+                    await self.parser_pool.run(
+                        snapshot_codec.decode,
+                        entity["scrape_html_compressed"],
+                        encoding,
+                        base_html,
+                    )
+                )
+
+        return snapshots
+
+    async def get_latest_history_entity(self, page_patrol_id: str):
+        # The first row of the patrol's partition is its newest snapshot
+        history_entities, _ = await self.table_storage.query_entities_page(
             self.table_storage.patrol_history_table_client,
-            query_filter=f"page_patrol_id eq '{page_patrol_id}'",
+            query_filter=f"PartitionKey eq '{page_patrol_id}'",
+            results_per_page=1,
         )
+        return history_entities[0] if history_entities else None
+
+    # Fingerprint of the HTML with volatile tokens stripped, used for change detection
+    @staticmethod
+    def get_content_hash(scrape_html_content: str) -> str:
+        # Remove any reference of a token from htmls as these will generally always be different
+        token_regex_pattern = 'token="+\\S+"'
+        html_without_token = re.sub(token_regex_pattern, "", scrape_html_content)
+        return hashlib.sha256(html_without_token.encode("utf-8")).hexdigest()
+
+    async def is_scrape_history_needed(self, entity, content_hash: str) -> bool:
+        recorded_hash = entity.get("last_recorded_html_hash")
+
+        # Patrols created before fingerprints existed are backfilled from history
+        if recorded_hash is None:
+            recorded_hash = await self.get_latest_history_hash(entity["RowKey"])
+
+        return recorded_hash != content_hash
+
+    # Fingerprint of the newest recorded snapshot, or None if there is no history
+    async def get_latest_history_hash(self, page_patrol_id: str) -> Optional[str]:
+        latest_entity = await self.get_latest_history_entity(page_patrol_id)
+        if latest_entity is None:
+            return None
+
+        (latest_html,) = await self.decode_snapshots(page_patrol_id, [latest_entity])
+        return self.get_content_hash(latest_html)
+
+    # One-off backfill of content fingerprints and shard numbers for patrols that
+    # predate them, or of shard numbers after SHARD_COUNT changed. Safe to re-run.
+    async def backfill_patrols(self) -> int:
+        backfilled = 0
+        continuation_token = None
+        while True:
+            # Walk the patrols a page at a time, reading only the columns needed
+            entities, continuation_token = await self.table_storage.query_entities_page(
+                self.table_storage.page_patrol_table_client,
+                query_filter="is_deleted eq false",
+                select=["PartitionKey", "RowKey", "last_recorded_html_hash", "shard"],
+                continuation_token=continuation_token,
+            )
+
+            for entity in entities:
+                updates = {}
+                # Patrols that were never scraped successfully have no shard yet,
+                # so a node claiming their shard would not find them
+                shard = get_shard(entity["RowKey"], auth_config.SHARD_COUNT)
+                if entity.get("shard") != shard:
+                    updates["shard"] = shard
 
-        # Sort entries based on scrape_time in descending order
-        entities = sorted(entities, key=itemgetter("scrape_time"), reverse=True)
+                if entity.get("last_recorded_html_hash") is None:
+                    content_hash = await self.get_latest_history_hash(entity["RowKey"])
+                    if content_hash is not None:
+                        updates["last_recorded_html_hash"] = content_hash
 
-        # Convert entities to PatrolHistory instances
+                if not updates:
+                    continue
+
+                await self.table_storage.update_entity(
+                    self.table_storage.page_patrol_table_client,
+                    mode=UpdateMode.MERGE,
+                    entity={
+                        "PartitionKey": entity["PartitionKey"],
+                        "RowKey": entity["RowKey"],
+                        **updates,
+                    },
+                )
+                backfilled += 1
+
+            if continuation_token is None:
+                break
+
+        self.logger.info(f"Backfilled {backfilled} page patrol(s)")
+        return backfilled
+
+    # One-off migration of history rows from the old user-partitioned layout to
+    # the patrol-partitioned, newest-first layout. Safe to re-run.
+    async def migrate_history_layout(self) -> int:
+        migrated = 0
+        continuation_token = None
+        while True:
+            entities, continuation_token = await self.table_storage.query_entities_page(
+                self.table_storage.patrol_history_table_client,
+                query_filter="PartitionKey ne ''",
+                continuation_token=continuation_token,
+            )
+
+            for entity in entities:
+                if entity["PartitionKey"] == entity["page_patrol_id"]:
+                    continue
+
+                # Derive the new RowKey from the old one so a re-run upserts the
+                # same row instead of duplicating it
+                await self.table_storage.upsert_entity(
+                    self.table_storage.patrol_history_table_client,
+                    mode=UpdateMode.REPLACE,
+                    entity={
+                        **entity,
+                        "PartitionKey": entity["page_patrol_id"],
+                        "RowKey": get_history_row_key(
+                            entity["scrape_time"], entity["RowKey"]
+                        ),
+                        "user_id": entity["PartitionKey"],
+                    },
+                )
+                await self.table_storage.delete_entity(
+                    self.table_storage.patrol_history_table_client,
+                    entity["PartitionKey"],
+                    entity["RowKey"],
+                )
+                migrated += 1
+
+            if continuation_token is None:
+                break
+
+        self.logger.info(f"Migrated {migrated} patrol history row(s) to the new layout")
+        return migrated
+
+    # Retrieve patrol history for page patrol entity, newest first, a page at a time.
+    # The token for the next page is returned in the X-Continuation-Token header.
+    async def get_patrol_history(
+        self,
+        response: Response,
+        page_patrol_id: str,
+        limit: int = Query(50, ge=1, le=1000),
+        continuation_token: Optional[str] = None,
+    ) -> List[PatrolHistory]:
+        try:
+            entities, next_token = await self.table_storage.query_entities_page(
+                self.table_storage.patrol_history_table_client,
+                query_filter=f"PartitionKey eq '{page_patrol_id}'",
+                results_per_page=limit,
+                continuation_token=self.decode_continuation_token(continuation_token),
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        if next_token:
+            response.headers["X-Continuation-Token"] = self.encode_continuation_token(
+                next_token
+            )
+
+        # Convert entities to PatrolHistory instances, decompressing their HTML
+        snapshots = await self.decode_snapshots(page_patrol_id, entities)
         patrol_histories = []
-        for entity in entities:
+        for entity, snapshot in zip(entities, snapshots):
             try:
-                patrol_history = PatrolHistory(**entity)
+                patrol_history = PatrolHistory(
+                    **{**entity, "scrape_html_content": snapshot}
+                )
                 patrol_histories.append(patrol_history)
             except Exception as e:
                 raise HTTPException(status_code=400, detail=str(e))
 
         return patrol_histories
 
-    async def send_push_notification(self, expo_push_token, title, message):
-        headers = {
-            "accept": "application/json",
-            "accept-encoding": "gzip, deflate",
-            "content-type": "application/json",
-            "authorization": f"Bearer {auth_config.EXPO_TOKEN}",
-        }
-
-        data = {
-            "to": expo_push_token,
-            "title": title,
-            "body": message,
-        }
+    @staticmethod
+    def encode_continuation_token(token) -> str:
+        return base64.urlsafe_b64encode(json.dumps(token).encode("utf-8")).decode()
 
-        asession = AsyncHTMLSession()
+    @staticmethod
+    def decode_continuation_token(token: Optional[str]):
+        if not token:
+            return None
         try:
-            resp = await asession.post(
-                "https://exp.host/--/api/v2/push/send", headers=headers, json=data
-            )  # type: ignore
-            print(resp)
-            return resp
-
-        # except PushServerError as exc:
-        #     # Log the error
-        #     log.error(f"PushServerError: {exc}")
-        # except (PushResponseError, ValidationError) as exc:
-        #     # Handle malformed messages
-        #     log.error(f"Malformed message: {exc}")
-        except Exception as exc:
-            # Handle any other exceptions
-            self.logger.error(
-                f"Unknown error occurred when sending push notification: {exc}"
-            )
+            return json.loads(base64.urlsafe_b64decode(token.encode("utf-8")))
+        except (ValueError, TypeError):
+            raise ValueError("Invalid continuation token") from None
+
+    # Queue a push notification; delivery, retries and receipts happen in the
+    # dispatcher's background task
+    def send_push_notification(self, expo_push_token, title, message):
+        self.push_dispatcher.enqueue(expo_push_token, title, message)
@@ -2,24 +2,34 @@ from datetime import datetime
 from operator import itemgetter
 from typing import Optional, Union
 
-from azure.data.tables import UpdateMode
+from azure.data.tables import TransactionOperation, UpdateMode
 from fastapi import APIRouter, Depends, HTTPException, Path, Query
 from fastapi_azure_auth.user import User
 
-from src.auth_config import azure_scheme
-from src.models import PagePatrol, ScrapeInterval, UserInfo
-from src.table_storage import TableStorage
+from src.auth_config import auth_config, azure_scheme
+from src.models import PagePatrol, PagePatrolSummaryFields, ScrapeInterval, UserInfo
+from src.storage_backend import StorageBackend
+from src.util.patrol_schedule import PatrolSchedule
+from src.util.shard_coordinator import get_shard
 
 
 class PatrolManagement:
-    def __init__(self, table_storage: TableStorage):
+    def __init__(
+        self,
+        table_storage: StorageBackend,
+        patrol_schedule: Optional[PatrolSchedule] = None,
+    ):
         self.table_storage = table_storage
+        # None when this process doesn't run the scheduler, and a worker picks up
+        # patrol changes from storage instead
+        self.patrol_schedule = patrol_schedule
         self.router = APIRouter()
 
         self.router.post("/page-patrol", response_model=PagePatrol)(
             self.add_page_patrol_entity
         )
         self.router.get("/page-patrol")(self.get_patrol_entities)
+        self.router.get("/page-patrol/{page_patrol_id}")(self.get_patrol_entity)
         self.router.put("/page-patrol/{page_patrol_id}")(self.update_patrol_entity)
         self.router.delete(
             "/page-patrol/{page_patrol_id}", response_model=dict[str, bool]
@@ -46,9 +56,11 @@ class PatrolManagement:
         user_info = await self.get_user_info(user)
 
         # Create a new PagePatrol object with the given data
+        date_added = int(datetime.now().timestamp())
         page_patrol = PagePatrol(
             PartitionKey=user_info.oid,
-            date_added=int(datetime.now().timestamp()),
+            date_added=date_added,
+            updated_at=date_added,
             url=url,
             xpath=xpath,
             search_string=search_string,
@@ -57,15 +69,20 @@ class PatrolManagement:
             is_enabled=True,
             is_deleted=False,
         )
+        page_patrol.shard = get_shard(page_patrol.RowKey, auth_config.SHARD_COUNT)
         try:
             # Add the new PagePatrol object to the table storage
-            self.table_storage.create_entity(
+            await self.table_storage.create_entity(
                 self.table_storage.page_patrol_table_client,
                 entity=page_patrol.dict(),
             )
         except Exception as e:
             raise HTTPException(status_code=400, detail=str(e))
 
+        # New patrols are due straight away
+        if self.patrol_schedule is not None:
+            self.patrol_schedule.schedule_entity(page_patrol.dict())
+
         return page_patrol.dict()
 
     # Retrieve all patrol entries for the authenticated user
@@ -73,15 +90,31 @@ class PatrolManagement:
         # Get user information from the authentication system
         user_info = await self.get_user_info(user)
         # Query the table storage for entries belonging to the authenticated user
-        entities = self.table_storage.query_entities(
+        entities = await self.table_storage.query_entities(
             self.table_storage.page_patrol_table_client,
             query_filter=f"PartitionKey eq '{user_info.oid}' and is_deleted eq false",
+            select=PagePatrolSummaryFields,
         )
         # Sort entries based on Timestamp in descending order
         entities = sorted(entities, key=itemgetter("date_added"), reverse=True)
 
         return [dict(entity.items()) for entity in entities]
 
+    # Retrieve a single patrol entry, including its last scraped HTML
+    async def get_patrol_entity(
+        self, page_patrol_id: str = Path(...), user: User = Depends(azure_scheme)
+    ):
+        # Get user information from the authentication system
+        user_info = await self.get_user_info(user)
+        # Get the patrol entity from the table storage
+        entity = await self.table_storage.get_entity(
+            self.table_storage.page_patrol_table_client, user_info.oid, page_patrol_id
+        )
+        if not entity:
+            raise HTTPException(status_code=404, detail="entity not found")
+
+        return dict(entity.items())
+
     # Update an existing patrol entity
     async def update_patrol_entity(
         self,
@@ -95,8 +128,11 @@ class PatrolManagement:
         # Get user information from the authentication system
         user_info = await self.get_user_info(user)
         # Get the patrol entity from the table storage
-        entity = self.table_storage.get_entity(
-            self.table_storage.page_patrol_table_client, user_info.oid, page_patrol_id
+        entity = await self.table_storage.get_entity(
+            self.table_storage.page_patrol_table_client,
+            user_info.oid,
+            page_patrol_id,
+            select=PagePatrolSummaryFields,
         )
         if not entity:
             raise HTTPException(status_code=404, detail="Entity not found")
@@ -109,13 +145,16 @@ class PatrolManagement:
             entity["search_string"] = search_string
         if scrape_interval:
             entity["scrape_interval"] = scrape_interval
+        entity["updated_at"] = int(datetime.now().timestamp())
 
         # Update the entity with the new data
-        self.table_storage.update_entity(
+        await self.table_storage.update_entity(
             self.table_storage.page_patrol_table_client,
-            mode=UpdateMode.REPLACE,
+            mode=UpdateMode.MERGE,
             entity=entity,
         )
+        if self.patrol_schedule is not None:
+            self.patrol_schedule.schedule_entity(entity)
 
         return {"success": True}
 
@@ -127,19 +166,25 @@ class PatrolManagement:
         user_info = await self.get_user_info(user)
 
         # Get the patrol entity from the table storage
-        entity = self.table_storage.get_entity(
-            self.table_storage.page_patrol_table_client, user_info.oid, page_patrol_id
+        entity = await self.table_storage.get_entity(
+            self.table_storage.page_patrol_table_client,
+            user_info.oid,
+            page_patrol_id,
+            select=PagePatrolSummaryFields,
         )
         if not entity:
             raise HTTPException(status_code=404, detail="entity not found")
 
         # Set the is_deleted flag to True for soft deletion
         entity["is_deleted"] = True
-        self.table_storage.update_entity(
+        entity["updated_at"] = int(datetime.now().timestamp())
+        await self.table_storage.update_entity(
             self.table_storage.page_patrol_table_client,
-            mode=UpdateMode.REPLACE,
+            mode=UpdateMode.MERGE,
             entity=entity,
         )
+        if self.patrol_schedule is not None:
+            self.patrol_schedule.remove(self.patrol_schedule.get_key(entity))
 
         return {"success": True}
 
@@ -150,15 +195,20 @@ class PatrolManagement:
         # Get user information from the authentication system
         user_info = await self.get_user_info(user)
         # Get the patrol entity from the table storage
-        entity = self.table_storage.get_entity(
-            self.table_storage.page_patrol_table_client, user_info.oid, page_patrol_id
+        entity = await self.table_storage.get_entity(
+            self.table_storage.page_patrol_table_client,
+            user_info.oid,
+            page_patrol_id,
+            select=PagePatrolSummaryFields,
         )
         # TODO: entity not found excpetion needs improvement
         if not entity:
             raise HTTPException(status_code=404, detail="entity not found")
 
         # Toggle the is_enabled flag
-        self.update_entity_helper(entity, is_enabled=not entity["is_enabled"])
+        await self.update_entity_helper(entity, is_enabled=not entity["is_enabled"])
+        if self.patrol_schedule is not None:
+            self.patrol_schedule.schedule_entity(entity)
 
         return {"success": True, "is_enabled": entity["is_enabled"]}
 
@@ -173,7 +223,7 @@ class PatrolManagement:
 
         return user_info
 
-    def update_entity_helper(
+    async def update_entity_helper(
         self, entity, url=None, xpath=None, search_string=None, is_enabled=None
     ):
         # Update the entity fields if new values are provided
@@ -185,11 +235,12 @@ class PatrolManagement:
             entity["search_string"] = search_string
         if is_enabled is not None:
             entity["is_enabled"] = is_enabled
+        entity["updated_at"] = int(datetime.now().timestamp())
 
         # Update the entity in the table storage
-        self.table_storage.update_entity(
+        await self.table_storage.update_entity(
             self.table_storage.page_patrol_table_client,
-            mode=UpdateMode.REPLACE,
+            mode=UpdateMode.MERGE,
             entity=entity,
         )
 
@@ -197,15 +248,65 @@ class PatrolManagement:
         self, expo_push_token: str, user: User = Depends(azure_scheme)
     ):
         partition_key = (await self.get_user_info(user)).oid
-        entities = self.table_storage.query_entities(
+        entities = await self.table_storage.query_entities(
             self.table_storage.page_patrol_table_client,
             query_filter=f"PartitionKey eq '{partition_key}' and is_deleted eq false",
+            select=["PartitionKey", "RowKey"],
         )
 
-        for entity in entities:
-            entity["expo_push_token"] = expo_push_token
-            self.table_storage.update_entity(
-                self.table_storage.page_patrol_table_client,
-                entity=entity,
-                mode=UpdateMode.REPLACE,
+        # All of a user's patrols share a partition, so this is one transaction
+        # per 100 patrols instead of a round-trip each
+        results = await self.table_storage.submit_batch(
+            self.table_storage.page_patrol_table_client,
+            [
+                (
+                    TransactionOperation.UPDATE,
+                    {
+                        "PartitionKey": entity["PartitionKey"],
+                        "RowKey": entity["RowKey"],
+                        "expo_push_token": expo_push_token,
+                    },
+                    {"mode": UpdateMode.MERGE},
+                )
+                for entity in entities
+            ],
+        )
+
+        failed = [result.operation[1]["RowKey"] for result in results if result.error]
+        if failed:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to update push token for page patrol(s): {failed}",
+            )
+
+    # Clear a push token Expo reported as no longer registered from every patrol
+    # that uses it
+    async def clear_push_token(self, expo_push_token: str):
+        token = expo_push_token.replace("'", "''")
+        entities = await self.table_storage.query_entities(
+            self.table_storage.page_patrol_table_client,
+            query_filter=f"expo_push_token eq '{token}'",
+            select=["PartitionKey", "RowKey"],
+        )
+
+        results = await self.table_storage.submit_batch(
+            self.table_storage.page_patrol_table_client,
+            [
+                (
+                    TransactionOperation.UPDATE,
+                    {
+                        "PartitionKey": entity["PartitionKey"],
+                        "RowKey": entity["RowKey"],
+                        "expo_push_token": "",
+                    },
+                    {"mode": UpdateMode.MERGE},
+                )
+                for entity in entities
+            ],
+        )
+
+        failed = [result.operation[1]["RowKey"] for result in results if result.error]
+        if failed:
+            raise RuntimeError(
+                f"Failed to clear push token for page patrol(s): {failed}"
             )
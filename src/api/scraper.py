@@ -1,81 +1,238 @@
-from datetime import datetime, timedelta
+import asyncio
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 
 import pytz
-from azure.data.tables import UpdateMode
+from azure.core.exceptions import ResourceNotFoundError
+from azure.data.tables import TransactionOperation, UpdateMode
 from fastapi import APIRouter, status
 from fastapi.responses import JSONResponse
-from requests_html import AsyncHTMLSession
 
 from src.api.patrol_history_mgmt import PatrolHistoryManagement
+from src.auth_config import auth_config
 from src.logger_config import setup_logger
-from src.table_storage import TableStorage
+from src.models import (
+    PagePatrolScrapeFields,
+    PagePatrolSummaryFields,
+    PatrolScheduleFields,
+)
+from src.storage_backend import StorageBackend
+from src.util import metrics
+from src.util.conditional_cache import ConditionalCache
+from src.util.document import HTTP_TIER, RENDER_TIER, Document
+from src.util.document_cache import DocumentCache
+from src.util.domain_throttle import (
+    CircuitOpenError,
+    DomainThrottle,
+    DomainThrottledError,
+    DomainUnavailableError,
+)
+from src.util.fetch_engine import FetchEngine
+from src.util.http_client import HttpClient, HttpResponse, HttpStatusError
 from src.util.http_headers_manager import HttpHeadersManager
+from src.util.parser_pool import ParserPool
+from src.util.patrol_schedule import PatrolKey, PatrolSchedule
+from src.util.shard_coordinator import ShardCoordinator, get_shard
 from src.util.util import Utils
 
 
+@dataclass
+class TickStats:
+    due: int = 0
+    completed: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    fetches: int = 0
+    fetches_saved: int = 0
+    not_modified: int = 0
+    # Skipped because their origin's circuit is open or it asked us to back off
+    short_circuited: int = 0
+    throttled: int = 0
+    # Pages rendered in a headless browser rather than fetched over HTTP
+    rendered: int = 0
+    # Pages reused from the lookup endpoint's document cache instead of fetched
+    reused: int = 0
+    # Last scrape updates, flushed as batched transactions at the end of the tick
+    pending_writes: List[Tuple] = field(default_factory=list, repr=False)
+
+    def add(self, other: "TickStats"):
+        for stat in fields(self):
+            if stat.name != "pending_writes":
+                setattr(
+                    self,
+                    stat.name,
+                    getattr(self, stat.name) + getattr(other, stat.name),
+                )
+
+
 class Scraper:
     def __init__(
         self,
-        table_storage: TableStorage,
+        table_storage: StorageBackend,
         patrol_history_mgmt: PatrolHistoryManagement,
         headers_manager: HttpHeadersManager,
+        http_client: HttpClient,
+        patrol_schedule: PatrolSchedule,
+        parser_pool: ParserPool,
+        domain_throttle: DomainThrottle,
+        fetch_engine: FetchEngine,
+        shard_coordinator: Optional[ShardCoordinator] = None,
     ):
         self.router = APIRouter()
         self.logger = setup_logger(__name__)
         self.table_storage = table_storage
         self.patrol_history_mgmt = patrol_history_mgmt
         self.headers_manager = headers_manager
+        self.http_client = http_client
+        self.patrol_schedule = patrol_schedule
+        self.parser_pool = parser_pool
+        self.domain_throttle = domain_throttle
+        self.fetch_engine = fetch_engine
+        # Set in distributed mode, where this node only runs its leased shards
+        self.shard_coordinator = shard_coordinator
+        # Shared by overlapping ticks, created on first use inside the event loop
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.read_semaphore: Optional[asyncio.Semaphore] = None
+        self.conditional_cache = ConditionalCache(
+            auth_config.CONDITIONAL_CACHE_MAX_SIZE
+        )
+        self.document_cache = DocumentCache(
+            auth_config.DOCUMENT_CACHE_TTL, auth_config.DOCUMENT_CACHE_MAX_SIZE
+        )
+        # Whether the last full read found patrols without their current shard
+        # number, which reading newly claimed shards by shard would miss
+        self.unsharded_patrols = True
+        # Totals across every tick, reported in worker heartbeats
+        self.totals = TickStats()
+        self.ticks = 0
+        self.last_tick_duration = 0.0
+
+    # Download the page at url so it can be evaluated against many xpaths
+    async def fetch_document(self, url: str) -> Document:
+        with metrics.PHASE_SECONDS.labels("headers").time():
+            headers = await self.headers_manager.get_headers(url)
+        resp = await self.get_page(
+            url, headers={**headers, **self.conditional_cache.validators(url)}
+        )
+
+        # Cookies have likely gone stale, refresh the site's headers and retry once
+        if resp.status in (401, 403):
+            self.logger.info(f"Got {resp.status} from {url}, refreshing headers")
+            self.headers_manager.invalidate(url)
+            with metrics.PHASE_SECONDS.labels("headers").time():
+                headers = await self.headers_manager.get_headers(url)
+            await self.acquire(url)
+            resp = await self.get_page(
+                url, headers={**headers, **self.conditional_cache.validators(url)}
+            )
+
+        # Unchanged since the last fetch, reuse the document and its results
+        if resp.status == 304:
+            document = self.conditional_cache.get_not_modified(url)
+            if document is not None:
+                document.not_modified = True
+                return document
+            await self.acquire(url)
+            resp = await self.get_page(url, headers=headers)
+
+        # An error page is a failed fetch, not the page missing its elements, so it
+        # is neither recorded nor escalated to rendering
+        if not 200 <= resp.status < 300:
+            raise HttpStatusError(url, resp.status)
+
+        document = Document(
+            resp.url,
+            resp.text,
+            etag=resp.headers.get("etag"),
+            last_modified=resp.headers.get("last-modified"),
+        )
+        self.conditional_cache.store(url, document)
+        return document
+
+    # Wait for the origin's rate limit before every request sent to it. Raises a
+    # DomainUnavailableError if it shouldn't be contacted now.
+    async def acquire(self, url: str):
+        await self.domain_throttle.acquire(
+            url, max_wait=auth_config.SCRAPER_PATROL_TIMEOUT
+        )
+
+    # GET a page, feeding the outcome to the origin's rate limiter and circuit breaker
+    async def get_page(self, url: str, headers: Dict[str, str]) -> HttpResponse:
+        try:
+            with metrics.PHASE_SECONDS.labels("fetch").time():
+                resp = await self.http_client.get(url, headers=headers)
+        except Exception:
+            self.domain_throttle.record_failure(url)
+            raise
+
+        metrics.FETCHES.labels("http").inc()
+        self.domain_throttle.record_response(
+            url, resp.status, resp.headers.get("retry-after")
+        )
+        return resp
+
+    # Render a page in a headless browser, feeding the outcome to the throttle too
+    async def render_document(self, url: str) -> Document:
+        try:
+            with metrics.PHASE_SECONDS.labels("render").time():
+                document, status_code = await self.fetch_engine.render(url)
+        except Exception:
+            self.domain_throttle.record_failure(url)
+            raise
+
+        metrics.FETCHES.labels("render").inc()
+        if status_code is not None:
+            self.domain_throttle.record_response(url, status_code, None)
+            if not 200 <= status_code < 300:
+                raise HttpStatusError(url, status_code)
+        return document
 
     # Given url, element_xpath and search_string, search for search_string within the element and return its HTML if found.
     async def is_string_within_element(self, url, xpath, search_string):
-        asession = AsyncHTMLSession()
-        headers = await self.headers_manager.get_headers(url)
-        resp = await asession.get(url, headers=headers)  # type: ignore
-
-        # Get base_url
-        base_url = Utils.get_baseurl_from(url)
-
-        # Select the elements
-        elements = resp.html.xpath(xpath)
-
-        if not elements:
-            return (
-                "web_element_not_found",
-                (
-                    f"Could not find any web element from xpath: {xpath}"
-                    f" Please double check the xpath."
-                ),
-                "",
+        query = (xpath, search_string)
+        try:
+            document = await self.document_cache.get_or_fetch(
+                url, lambda: self.fetch_for_lookup(url, query)
             )
+            # A cached page is only parsed again for queries it has no result for
+            await self.evaluate_document(document, url, [query])
+        except CircuitOpenError as e:
+            return ("circuit_open", str(e), "")
+        except DomainThrottledError as e:
+            return ("rate_limited", str(e), "")
+        except HttpStatusError as e:
+            return ("fetch_failed", str(e), "")
+        except asyncio.TimeoutError:
+            # e.g. an xpath that runs away on this page
+            return ("timed_out", f"Timed out loading {url} or evaluating {xpath}", "")
 
-        # Multiple web elements found
-        if len(elements) > 1:
-            return (
-                "multiple_elements_found",
-                (
-                    f"More than one web element found from xpath: {xpath}"
-                    f" Please provide an xpath for a unique web element."
-                ),
-                "",
-            )
+        return document.results[query]
 
-        # One element found
-        element = elements[0]
-        # Check if string exists within the web element or any of its child elements
-        if search_string in element.text or any(
-            search_string in child.text for child in element.xpath(".//*")
-        ):
-            return (
-                "found",
-                "Found string within the web element.",
-                element.html.replace('href="/', f'href="{base_url}/'),
-            )
-        else:
-            return (
-                "string_not_found",
-                "Did not find the string within the web element.",
-                "",
+    # Fetch a page for the lookup endpoint, only called on a document cache miss so
+    # repeated attempts on the same page don't spend the origin's rate limit
+    async def fetch_for_lookup(self, url: str, query: Tuple[str, str]) -> Document:
+        await self.acquire(url)
+        return await self.fetch_and_evaluate(url, [query])
+
+    # Evaluate queries the document has no memoised result for in the parser pool,
+    # so parsing and XPath matching never run on the event loop
+    async def evaluate_document(
+        self, document: Document, url: str, queries: List[Tuple[str, str]]
+    ):
+        missing_queries = [
+            query for query in dict.fromkeys(queries) if query not in document.results
+        ]
+        if not missing_queries:
+            return
+
+        with metrics.PHASE_SECONDS.labels("parse").time():
+            results = await self.parser_pool.evaluate(
+                document.text, url, missing_queries
             )
+        document.results.update(zip(missing_queries, results))
 
     def get_response(self, status_code, status_detail, html_content):
         return JSONResponse(
@@ -99,7 +256,12 @@ class Scraper:
             "found": status.HTTP_200_OK,
             "web_element_not_found": status.HTTP_400_BAD_REQUEST,
             "multiple_elements_found": status.HTTP_400_BAD_REQUEST,
+            "invalid_xpath": status.HTTP_400_BAD_REQUEST,
             "string_not_found": status.HTTP_404_NOT_FOUND,
+            "circuit_open": status.HTTP_503_SERVICE_UNAVAILABLE,
+            "rate_limited": status.HTTP_429_TOO_MANY_REQUESTS,
+            "fetch_failed": status.HTTP_502_BAD_GATEWAY,
+            "timed_out": status.HTTP_504_GATEWAY_TIMEOUT,
         }
 
         return self.get_response(
@@ -108,83 +270,438 @@ class Scraper:
             req_html_content,
         )
 
-    async def process_page_patrol(self):
-        self.logger.info("Starting process_page_patrol")
+    # Load every active patrol's next due time once, before the scheduler starts
+    async def seed_schedule(self):
+        entities = await self.table_storage.query_entities(
+            self.table_storage.page_patrol_table_client,
+            query_filter="is_enabled eq true and is_deleted eq false",
+            select=PatrolScheduleFields,
+        )
+        self.unsharded_patrols = self.has_unsharded(entities)
+        self.patrol_schedule.seed(entities)
+        self.logger.info(f"Seeded schedule with {len(self.patrol_schedule)} patrol(s)")
 
-        utc = pytz.UTC
-        now = datetime.utcnow().replace(tzinfo=utc)
+    # Schedule patrols that are not known yet, e.g. in newly claimed shards or added
+    # through another replica's API, optionally only those matching query_filter.
+    # Known ones keep their due time, and removed ones are dropped when next read.
+    async def sync_schedule(self, query_filter: Optional[str] = None):
+        active_filter = "is_enabled eq true and is_deleted eq false"
+        entities = await self.table_storage.query_entities(
+            self.table_storage.page_patrol_table_client,
+            query_filter=(
+                f"{active_filter} and {query_filter}" if query_filter else active_filter
+            ),
+            select=PatrolScheduleFields,
+        )
+        if query_filter is None:
+            self.unsharded_patrols = self.has_unsharded(entities)
+        self.patrol_schedule.seed(
+            entity
+            for entity in entities
+            if self.patrol_schedule.get_key(entity) not in self.patrol_schedule
+        )
+
+    # Patrols only get their shard number on creation or a successful scrape, until
+    # the backfill tool has run
+    @staticmethod
+    def has_unsharded(entities) -> bool:
+        return any(
+            entity.get("shard") != get_shard(entity["RowKey"], auth_config.SHARD_COUNT)
+            for entity in entities
+        )
 
-        # Get all enabled and not deleted page_patrol entries
-        entities = self.table_storage.query_entities(
+    # Reschedule patrols changed through any API process since updated_since, known
+    # or not, so a re-enabled patrol or a new scrape interval applies straight away.
+    # Disabled and deleted ones are dropped from the schedule.
+    async def sync_changes(self, updated_since: int):
+        entities = await self.table_storage.query_entities(
             self.table_storage.page_patrol_table_client,
-            query_filter="is_enabled eq true and is_deleted eq false",
+            query_filter=f"updated_at ge {updated_since}",
+            select=PatrolScheduleFields,
         )
-        for entity in entities:
-            # Calculate the elapsed time since the last scrape attempt
-            last_scrape_time = entity.get("last_scrape_time", None)
-            if last_scrape_time:
-                time_elapsed = now - last_scrape_time
-            else:
-                time_elapsed = timedelta(minutes=entity["scrape_interval"])
+        self.patrol_schedule.seed(entities)
 
-            # Check if the time elapsed is greater or equal to the entry's scrape_interval
-            if time_elapsed >= timedelta(minutes=entity["scrape_interval"]):
-                self.logger.info(
-                    f"Searching for: {entity['search_string']} on {entity['url']}"
-                )
-                # Perform the scraping task
-                (
-                    req_status,
-                    req_status_detail,
-                    req_html_content,
-                ) = await self.is_string_within_element(
-                    entity["url"],
-                    entity["xpath"],
-                    entity["search_string"],
-                )
+    # Wake exactly when patrols are due and run them as a tick in the background
+    async def run_scheduler(self):
+        if self.shard_coordinator is not None:
+            shard_sync = asyncio.create_task(self.run_shard_sync())
 
-                # Update the PagePatrol entry with the last scrape event information
-                entity["last_scrape_time"] = datetime.utcnow().replace(tzinfo=utc)
-                entity["last_scrape_status"] = req_status
-                entity["last_scrape_status_detail"] = req_status_detail
-                entity["last_scrape_html_content"] = req_html_content
-
-                # Update the PagePatrol entry in the table storage
-                self.table_storage.update_entity(
-                    self.table_storage.page_patrol_table_client,
-                    mode=UpdateMode.REPLACE,
-                    entity=entity,
+        ticks = set()
+        try:
+            while True:
+                await self.patrol_schedule.wait_until_due()
+                tick = asyncio.create_task(
+                    self.process_page_patrol(self.patrol_schedule.pop_due())
                 )
+                ticks.add(tick)
+                tick.add_done_callback(ticks.discard)
+        finally:
+            if self.shard_coordinator is not None:
+                shard_sync.cancel()
 
-                # If scrape history is needed, record it and send push notification
-                if self.patrol_history_mgmt.is_scrape_history_needed(
-                    page_patrol_id=entity["RowKey"],
-                    scrape_html_content=req_html_content,
-                ):
-                    self.patrol_history_mgmt.record_scrape_history(
-                        entity["PartitionKey"],
-                        entity["RowKey"],
-                        entity["last_scrape_time"],
-                        req_html_content,
+    # Keep this node's shard leases alive and its schedule in line with them. Newly
+    # claimed shards and patrols changed through the API are read on their own, and
+    # the whole table only as a backstop.
+    async def run_shard_sync(self):
+        last_resync = last_poll = time.time()
+        while True:
+            await asyncio.sleep(auth_config.LEASE_RENEW_INTERVAL)
+            try:
+                gained, lost = await self.shard_coordinator.rebalance()
+                if lost:
+                    self.patrol_schedule.prune()
+                # Read by shard once every patrol has its shard number, or in full
+                if gained and self.unsharded_patrols:
+                    await self.sync_schedule()
+                elif gained:
+                    shard_filter = " or ".join(
+                        f"shard eq {shard}" for shard in sorted(gained)
                     )
-                    # Send push notification
-                    url = (
-                        Utils.get_baseurl_from(entity["url"])
-                        .replace("https://", "")
-                        .replace("www.", "")
-                    )
-                    await self.patrol_history_mgmt.send_push_notification(
-                        entity["expo_push_token"],
-                        "Patrol Success!",
-                        f"Patrol has found something on {url}",
+                    await self.sync_schedule(f"({shard_filter})")
+
+                now = time.time()
+                if now - last_resync >= auth_config.SCHEDULE_RESYNC_INTERVAL:
+                    await self.sync_schedule()
+                    last_resync = now
+                if now - last_poll >= auth_config.SCHEDULE_POLL_INTERVAL:
+                    # Overlap the last poll in case other nodes' clocks are behind
+                    await self.sync_changes(
+                        int(last_poll - auth_config.SCHEDULE_POLL_INTERVAL)
                     )
+                    last_poll = now
+            except Exception as e:
+                self.logger.error(f"Failed to sync shard leases: {e}")
+
+    async def process_page_patrol(
+        self, patrol_keys: Optional[List[PatrolKey]] = None
+    ) -> TickStats:
+        self.logger.info("Starting process_page_patrol")
+        tick_start = time.monotonic()
+
+        if patrol_keys is None:
+            patrol_keys = self.patrol_schedule.pop_due()
+
+        # Point-read only the patrols that are due, concurrently
+        if self.read_semaphore is None:
+            self.read_semaphore = asyncio.Semaphore(
+                auth_config.SCHEDULE_READ_CONCURRENCY
+            )
+        entities = await asyncio.gather(
+            *(self.read_due_patrol(key, self.read_semaphore) for key in patrol_keys)
+        )
+        due_entities = [entity for entity in entities if entity is not None]
+
+        # Group due patrols by URL so each page is fetched and parsed only once
+        url_groups = defaultdict(list)
+        for entity in due_entities:
+            url_groups[entity["url"]].append(entity)
+
+        # Run URL groups concurrently, bounded by the global concurrency limit
+        stats = TickStats(
+            due=len(due_entities), fetches_saved=len(due_entities) - len(url_groups)
+        )
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(auth_config.SCRAPER_CONCURRENCY)
+        try:
+            await asyncio.gather(
+                *(
+                    self.run_patrol_group(url, group, self.semaphore, stats)
+                    for url, group in url_groups.items()
+                )
+            )
+            await self.flush_pending_writes(stats)
+        finally:
+            # Put every patrol back on the schedule, whatever its outcome
+            for entity in due_entities:
+                key = self.patrol_schedule.get_key(entity)
+                self.patrol_schedule.complete(
+                    key,
+                    self.patrol_schedule.get_next_run(
+                        entity["url"], entity["scrape_interval"], time.time()
+                    ),
+                )
+
+        tick_duration = time.monotonic() - tick_start
+        self.totals.add(stats)
+        self.ticks += 1
+        self.last_tick_duration = tick_duration
+        metrics.TICK_SECONDS.observe(tick_duration)
+        metrics.SCHEDULED_PATROLS.set(len(self.patrol_schedule))
+        self.logger.info(
+            f"Finished process_page_patrol in {tick_duration:.2f}s -"
+            f" due: {stats.due}, completed: {stats.completed},"
+            f" failed: {stats.failed}, timed out: {stats.timed_out},"
+            f" short-circuited: {stats.short_circuited}, throttled: {stats.throttled},"
+            f" rendered: {stats.rendered}, reused: {stats.reused},"
+            f" fetches: {stats.fetches}, fetches saved: {stats.fetches_saved},"
+            f" not modified: {stats.not_modified} (hit rate"
+            f" {self.conditional_cache.hit_rate:.0%},"
+            f" {self.conditional_cache.bytes_saved} bytes saved)"
+        )
+        return stats
+
+    # Write the tick's last scrape updates as per-partition table transactions
+    async def flush_pending_writes(self, stats: TickStats):
+        if not stats.pending_writes:
+            return
+
+        with metrics.PHASE_SECONDS.labels("storage").time():
+            results = await self.table_storage.submit_batch(
+                self.table_storage.page_patrol_table_client, stats.pending_writes
+            )
+        for result in results:
+            if result.error:
+                stats.failed += 1
+                stats.completed -= 1
+                metrics.SCRAPES.labels("save_failed").inc()
+                self.logger.error(
+                    f"page_patrol_id: {result.operation[1]['RowKey']}"
+                    f" - Failed to save last scrape: {result.error}"
+                )
+
+    # Fetch a URL once and evaluate every patrol watching it against the shared document
+    async def run_patrol_group(
+        self, url: str, entities, semaphore: asyncio.Semaphore, stats: TickStats
+    ):
+        # A page the lookup endpoint fetched moments ago, e.g. while one of these
+        # patrols was being set up, is reused rather than fetched again
+        cached_document = self.document_cache.get(url)
+
+        # Wait for the origin's rate limit before taking a slot, so a busy host
+        # can't hold up patrols for other hosts
+        try:
+            if cached_document is None:
+                await self.acquire(url)
+        except DomainUnavailableError as e:
+            self.skip_patrols(url, entities, stats, e)
+            return
+
+        async with semaphore:
+            try:
+                queries = [
+                    (entity["xpath"], entity["search_string"]) for entity in entities
+                ]
+                if cached_document is None:
+                    fetch = self.fetch_and_evaluate(url, queries)
                 else:
-                    page_patrol_id = entity["RowKey"]
-                    self.logger.info(
-                        f"page_patrol_id: {page_patrol_id} - Scraped HTML is same as previously recorded"
+                    fetch = self.reuse_document(cached_document, url, queries)
+                document = await asyncio.wait_for(
+                    fetch, timeout=auth_config.SCRAPER_PATROL_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                stats.timed_out += len(entities)
+                metrics.SCRAPES.labels("timed_out").inc(len(entities))
+                self.logger.warning(
+                    f"Timed out after {auth_config.SCRAPER_PATROL_TIMEOUT}s fetching"
+                    f" {url} for {len(entities)} patrol(s)"
+                )
+                return
+            except DomainUnavailableError as e:
+                # The origin wouldn't take a retry this fetch needed
+                self.skip_patrols(url, entities, stats, e)
+                return
+            except Exception as e:
+                stats.failed += len(entities)
+                metrics.SCRAPES.labels("failed").inc(len(entities))
+                self.logger.error(
+                    f"Failed fetching {url} for {len(entities)} patrol(s): {e}"
+                )
+                return
+
+            if cached_document is not None:
+                stats.reused += 1
+            else:
+                stats.fetches += 1
+                if document.tier == RENDER_TIER:
+                    stats.rendered += 1
+                if document.not_modified:
+                    stats.not_modified += 1
+
+            await asyncio.gather(
+                *(self.run_patrol(entity, document, stats) for entity in entities)
+            )
+
+    # Count patrols skipped because their origin's circuit is open or it asked us to
+    # back off
+    def skip_patrols(
+        self, url: str, entities, stats: TickStats, error: DomainUnavailableError
+    ):
+        if isinstance(error, CircuitOpenError):
+            stats.short_circuited += len(entities)
+            metrics.SCRAPES.labels("circuit_open").inc(len(entities))
+        else:
+            stats.throttled += len(entities)
+            metrics.SCRAPES.labels("rate_limited").inc(len(entities))
+        self.logger.warning(f"Skipping {len(entities)} patrol(s) on {url}: {error}")
+
+    async def reuse_document(
+        self, document: Document, url: str, queries: List[Tuple[str, str]]
+    ) -> Document:
+        await self.evaluate_document(document, url, queries)
+        return document
+
+    # Fetch a URL once, through the cheapest tier known to work for it, and evaluate
+    # every (xpath, search_string) query against it. A URL without a known tier is
+    # fetched over HTTP and rendered in a headless browser if an xpath is missing.
+    async def fetch_and_evaluate(
+        self, url: str, queries: List[Tuple[str, str]]
+    ) -> Document:
+        if self.fetch_engine.get_tier(url) == RENDER_TIER:
+            try:
+                document = await self.render_document(url)
+            except Exception:
+                # Probe from plain HTTP up again next time
+                self.fetch_engine.forget(url)
+                raise
+            await self.evaluate_document(document, url, queries)
+            return document
+
+        document = await self.fetch_document(url)
+        await self.evaluate_document(document, url, queries)
+        http_results = [document.results[query] for query in queries]
+        if not self.fetch_engine.should_render(url, http_results):
+            return document
+
+        self.logger.info(f"Missing element(s) on {url} over HTTP, rendering it")
+        try:
+            await self.acquire(url)
+        except DomainUnavailableError as e:
+            # Leave the tier unknown so rendering is tried again on a later fetch
+            self.logger.info(f"Not rendering {url} now: {e}")
+            return document
+
+        try:
+            rendered = await self.render_document(url)
+            await self.evaluate_document(rendered, url, queries)
+        except HttpStatusError as e:
+            # Likely transient too, so don't settle on a tier from it
+            self.logger.warning(f"Failed to render {url}: {e}")
+            return document
+        except Exception as e:
+            self.logger.warning(f"Failed to render {url}: {e}")
+            self.fetch_engine.remember(url, HTTP_TIER)
+            return document
+
+        render_results = [rendered.results[query] for query in queries]
+        if self.fetch_engine.choose(url, http_results, render_results) == RENDER_TIER:
+            return rendered
+        return document
+
+    # The due patrol's entity, or None if it was removed, disabled or couldn't be
+    # read, in which case it is dropped from the schedule or retried later
+    async def read_due_patrol(self, key: PatrolKey, semaphore: asyncio.Semaphore):
+        partition_key, row_key = key
+        try:
+            async with semaphore:
+                with metrics.PHASE_SECONDS.labels("storage").time():
+                    entity = await self.table_storage.get_entity(
+                        self.table_storage.page_patrol_table_client,
+                        partition_key,
+                        row_key,
+                        select=PagePatrolSummaryFields,
                     )
+        except ResourceNotFoundError:
+            entity = None
+        except Exception as e:
+            # Storage hiccup, try this patrol again in a minute
+            self.logger.error(f"page_patrol_id: {row_key} - Failed to read: {e}")
+            self.patrol_schedule.complete(key, time.time() + 60)
+            return None
+
+        if entity and entity["is_enabled"] and not entity["is_deleted"]:
+            return entity
+        self.patrol_schedule.remove(key)
+        return None
+
+    # Run a single patrol in isolation so a slow or failing patrol can't hold up the tick
+    async def run_patrol(self, entity, document: Document, stats: TickStats):
+        try:
+            await asyncio.wait_for(
+                self.process_entity(entity, document, stats),
+                timeout=auth_config.SCRAPER_PATROL_TIMEOUT,
+            )
+            stats.completed += 1
+        except asyncio.TimeoutError:
+            stats.timed_out += 1
+            metrics.SCRAPES.labels("timed_out").inc()
+            self.logger.warning(
+                f"page_patrol_id: {entity['RowKey']} - Timed out after"
+                f" {auth_config.SCRAPER_PATROL_TIMEOUT}s on {entity['url']}"
+            )
+        except Exception as e:
+            stats.failed += 1
+            metrics.SCRAPES.labels("failed").inc()
+            self.logger.error(
+                f"page_patrol_id: {entity['RowKey']} - Failed on {entity['url']}: {e}"
+            )
+
+    async def process_entity(self, entity, document: Document, stats: TickStats):
+        utc = pytz.UTC
+        self.logger.info(f"Searching for: {entity['search_string']} on {entity['url']}")
+        # Look up the patrol's result, evaluated with the rest of its URL group
+        req_status, req_status_detail, req_html_content = document.results[
+            (entity["xpath"], entity["search_string"])
+        ]
+
+        # Compare the normalised content fingerprint with the last recorded one
+        content_hash = self.patrol_history_mgmt.get_content_hash(req_html_content)
+        with metrics.PHASE_SECONDS.labels("history").time():
+            is_history_needed = await self.patrol_history_mgmt.is_scrape_history_needed(
+                entity, content_hash
+            )
 
-                # Log the result of processing each entry
-                self.logger.info(
-                    f"Processed entry '{entity['url']}' with status '{req_status_detail}'"
+        # Update the PagePatrol entry with the last scrape event information
+        entity["last_scrape_time"] = datetime.utcnow().replace(tzinfo=utc)
+        entity["last_scrape_status"] = req_status
+        entity["last_scrape_status_detail"] = req_status_detail
+        entity["last_scrape_html_content"] = req_html_content
+        entity["last_recorded_html_hash"] = content_hash
+        entity["shard"] = get_shard(entity["RowKey"], auth_config.SHARD_COUNT)
+
+        # Record history before the fingerprint is queued so a failure is retried
+        if is_history_needed:
+            with metrics.PHASE_SECONDS.labels("history").time():
+                await self.patrol_history_mgmt.record_scrape_history(
+                    entity["PartitionKey"],
+                    entity["RowKey"],
+                    entity["last_scrape_time"],
+                    req_html_content,
                 )
+
+        # Queue an update of only the last scrape fields of the PagePatrol entry
+        stats.pending_writes.append(
+            (
+                TransactionOperation.UPDATE,
+                {
+                    column: entity[column]
+                    for column in ["PartitionKey", "RowKey", *PagePatrolScrapeFields]
+                },
+                {"mode": UpdateMode.MERGE},
+            )
+        )
+
+        # If scrape history was recorded, send push notification
+        if is_history_needed:
+            # Send push notification
+            url = (
+                Utils.get_baseurl_from(entity["url"])
+                .replace("https://", "")
+                .replace("www.", "")
+            )
+            self.patrol_history_mgmt.send_push_notification(
+                entity["expo_push_token"],
+                "Patrol Success!",
+                f"Patrol has found something on {url}",
+            )
+        else:
+            page_patrol_id = entity["RowKey"]
+            self.logger.info(
+                f"page_patrol_id: {page_patrol_id} - Scraped HTML is same as previously recorded"
+            )
+
+        metrics.SCRAPES.labels(req_status).inc()
+
+        # Log the result of processing each entry
+        self.logger.info(
+            f"Processed entry '{entity['url']}' with status '{req_status_detail}'"
+        )
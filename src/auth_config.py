@@ -1,6 +1,8 @@
-from typing import Union
+from typing import Literal, Optional, Union
 
+from fastapi import Depends, HTTPException
 from fastapi_azure_auth import SingleTenantAzureAuthorizationCodeBearer
+from fastapi_azure_auth.user import User
 from pydantic import AnyHttpUrl, BaseSettings, Field
 
 
@@ -10,10 +12,114 @@ class AuthConfig(BaseSettings):
     OPENAPI_CLIENT_ID: str = Field(default="", env="OPENAPI_CLIENT_ID")
     APP_CLIENT_ID: str = Field(default="", env="APP_CLIENT_ID")
     TENANT_ID: str = Field(default="", env="TENANT_ID")
+    # App role required for the /admin endpoints, which cover every user's patrols
+    ADMIN_ROLE: str = Field(default="Admin", env="ADMIN_ROLE")
     COSMOSDB_CONNECTION_STRING: str = Field(
         default="", env="COSMOSDB_CONNECTION_STRING"
     )
+    # "sqlite" keeps tables in a local database file instead of Azure Tables
+    STORAGE_BACKEND: Literal["azure", "sqlite"] = Field(
+        default="azure", env="STORAGE_BACKEND"
+    )
+    SQLITE_PATH: str = Field(default="page_patrol.db", env="SQLITE_PATH")
     EXPO_TOKEN: str = Field(default="", env="EXPO_TOKEN")
+    SCRAPER_CONCURRENCY: int = Field(default=20, env="SCRAPER_CONCURRENCY")
+    SCRAPER_PATROL_TIMEOUT: float = Field(default=60.0, env="SCRAPER_PATROL_TIMEOUT")
+    HTTP_MAX_CONNECTIONS: int = Field(default=100, env="HTTP_MAX_CONNECTIONS")
+    HTTP_MAX_CONNECTIONS_PER_HOST: int = Field(
+        default=10, env="HTTP_MAX_CONNECTIONS_PER_HOST"
+    )
+    HTTP_KEEPALIVE_TIMEOUT: float = Field(default=30.0, env="HTTP_KEEPALIVE_TIMEOUT")
+    HTTP_TIMEOUT: float = Field(default=30.0, env="HTTP_TIMEOUT")
+    HTTP_CONNECT_TIMEOUT: float = Field(default=10.0, env="HTTP_CONNECT_TIMEOUT")
+    BROWSER_POOL_SIZE: int = Field(default=1, env="BROWSER_POOL_SIZE")
+    BROWSER_MAX_PAGES: int = Field(default=4, env="BROWSER_MAX_PAGES")
+    HEADERS_CACHE_TTL: float = Field(default=6 * 60 * 60, env="HEADERS_CACHE_TTL")
+    HEADERS_CACHE_MAX_SIZE: int = Field(default=1000, env="HEADERS_CACHE_MAX_SIZE")
+    HEADERS_CACHE_PATH: str = Field(
+        default="headers_cache.json", env="HEADERS_CACHE_PATH"
+    )
+    CONDITIONAL_CACHE_MAX_SIZE: int = Field(
+        default=500, env="CONDITIONAL_CACHE_MAX_SIZE"
+    )
+    # Render pages whose xpath is missing from the plain HTTP response, for pages
+    # built by JavaScript
+    FETCH_RENDER_ENABLED: bool = Field(default=True, env="FETCH_RENDER_ENABLED")
+    FETCH_RENDER_TIMEOUT: float = Field(default=20.0, env="FETCH_RENDER_TIMEOUT")
+    # How long the tier that worked for a URL is remembered before probing again
+    FETCH_TIER_TTL: float = Field(default=24 * 60 * 60, env="FETCH_TIER_TTL")
+    FETCH_TIER_CACHE_MAX_SIZE: int = Field(
+        default=5000, env="FETCH_TIER_CACHE_MAX_SIZE"
+    )
+    PARSER_POOL_SIZE: Optional[int] = Field(default=None, env="PARSER_POOL_SIZE")
+    # A parse or xpath evaluation running longer restarts the pool, as lxml can't
+    # be interrupted and would hold the worker forever
+    PARSER_TASK_TIMEOUT: float = Field(default=30.0, env="PARSER_TASK_TIMEOUT")
+    # Recently fetched pages kept, with their results, for the element lookup endpoint
+    DOCUMENT_CACHE_TTL: float = Field(default=120.0, env="DOCUMENT_CACHE_TTL")
+    DOCUMENT_CACHE_MAX_SIZE: int = Field(default=50, env="DOCUMENT_CACHE_MAX_SIZE")
+    XPATH_CACHE_SIZE: int = Field(default=256, env="XPATH_CACHE_SIZE")
+    HISTORY_DELTA_ENABLED: bool = Field(default=True, env="HISTORY_DELTA_ENABLED")
+    HISTORY_KEYFRAME_INTERVAL: int = Field(default=10, env="HISTORY_KEYFRAME_INTERVAL")
+    EXPO_PUSH_URL: str = Field(
+        default="https://exp.host/--/api/v2/push/send", env="EXPO_PUSH_URL"
+    )
+    EXPO_RECEIPTS_URL: str = Field(
+        default="https://exp.host/--/api/v2/push/getReceipts", env="EXPO_RECEIPTS_URL"
+    )
+    PUSH_QUEUE_MAX_SIZE: int = Field(default=10000, env="PUSH_QUEUE_MAX_SIZE")
+    PUSH_BATCH_LINGER: float = Field(default=1.0, env="PUSH_BATCH_LINGER")
+    PUSH_MAX_RETRIES: int = Field(default=5, env="PUSH_MAX_RETRIES")
+    PUSH_RETRY_BACKOFF: float = Field(default=1.0, env="PUSH_RETRY_BACKOFF")
+    # Expo recommends checking receipts around 15 minutes after sending
+    PUSH_RECEIPT_DELAY: float = Field(default=15 * 60, env="PUSH_RECEIPT_DELAY")
+    # Spread patrols over their interval with stable per-URL offsets
+    SCHEDULE_SPREAD: bool = Field(default=True, env="SCHEDULE_SPREAD")
+    # Patrols due within this many seconds of the earliest one start in the same
+    # tick, so patrols on one URL share a fetch and their writes share a batch
+    SCHEDULE_DRAIN_WINDOW: float = Field(default=10.0, env="SCHEDULE_DRAIN_WINDOW")
+    # Most URL groups, and so page fetches, started per second, smoothing bursts of
+    # due patrols; 0 for none
+    SCHEDULE_MAX_STARTS_PER_SECOND: float = Field(
+        default=20.0, env="SCHEDULE_MAX_STARTS_PER_SECOND"
+    )
+    # Most due patrols point-read from storage at once
+    SCHEDULE_READ_CONCURRENCY: int = Field(default=50, env="SCHEDULE_READ_CONCURRENCY")
+    # Set to false when scraping runs in separate `python -m src.worker` processes
+    RUN_SCHEDULER: bool = Field(default=True, env="RUN_SCHEDULER")
+    WORKER_PROCESSES: int = Field(default=1, env="WORKER_PROCESSES")
+    WORKER_HEARTBEAT_INTERVAL: float = Field(
+        default=15.0, env="WORKER_HEARTBEAT_INTERVAL"
+    )
+    # Worker process n serves its own /metrics on this port plus n, as the API's
+    # /metrics only covers the API process; unset for none
+    WORKER_METRICS_PORT: Optional[int] = Field(default=None, env="WORKER_METRICS_PORT")
+    # "distributed" splits patrols between replicas through leased shards
+    SCRAPER_MODE: Literal["standalone", "distributed"] = Field(
+        default="standalone", env="SCRAPER_MODE"
+    )
+    SHARD_COUNT: int = Field(default=64, env="SHARD_COUNT")
+    LEASE_BACKEND: Literal["table", "memory"] = Field(
+        default="table", env="LEASE_BACKEND"
+    )
+    LEASE_DURATION: float = Field(default=30.0, env="LEASE_DURATION")
+    LEASE_RENEW_INTERVAL: float = Field(default=10.0, env="LEASE_RENEW_INTERVAL")
+    # How often a node looks for patrols added or changed through any API process,
+    # and how often it reads every patrol as a backstop
+    SCHEDULE_POLL_INTERVAL: float = Field(default=60.0, env="SCHEDULE_POLL_INTERVAL")
+    SCHEDULE_RESYNC_INTERVAL: float = Field(
+        default=60 * 60, env="SCHEDULE_RESYNC_INTERVAL"
+    )
+    NODE_ID: Optional[str] = Field(default=None, env="NODE_ID")
+    # Per-origin request rate, backed off multiplicatively on 429/503
+    DOMAIN_RATE: float = Field(default=2.0, env="DOMAIN_RATE")
+    DOMAIN_BURST: int = Field(default=10, env="DOMAIN_BURST")
+    DOMAIN_MIN_RATE: float = Field(default=0.05, env="DOMAIN_MIN_RATE")
+    DOMAIN_BACKOFF: float = Field(default=0.5, env="DOMAIN_BACKOFF")
+    DOMAIN_RATE_STEP: float = Field(default=0.1, env="DOMAIN_RATE_STEP")
+    DOMAIN_MAX_BACKOFF: float = Field(default=3600.0, env="DOMAIN_MAX_BACKOFF")
+    CIRCUIT_FAILURE_THRESHOLD: int = Field(default=5, env="CIRCUIT_FAILURE_THRESHOLD")
+    CIRCUIT_RESET_TIMEOUT: float = Field(default=300.0, env="CIRCUIT_RESET_TIMEOUT")
 
     class Config:
         env_file = ".env"
@@ -29,3 +135,10 @@ azure_scheme = SingleTenantAzureAuthorizationCodeBearer(
         f"api://{auth_config.APP_CLIENT_ID}/user_impersonation": "user_impersonation",
     },
 )
+
+
+# Only let users holding the admin app role through
+async def require_admin(user: User = Depends(azure_scheme)) -> User:
+    if auth_config.ADMIN_ROLE not in user.roles:
+        raise HTTPException(status_code=403, detail="Admin role required")
+    return user
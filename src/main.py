@@ -1,17 +1,27 @@
-import os
+import asyncio
 
 import uvicorn
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.interval import IntervalTrigger
 from fastapi import FastAPI, Security
 from fastapi.middleware.cors import CORSMiddleware
 
+from src.api.admin_mgmt import AdminManagement
+from src.api.metrics_mgmt import MetricsManagement
 from src.api.patrol_history_mgmt import PatrolHistoryManagement
 from src.api.patrol_mgmt import PatrolManagement
 from src.api.scraper import Scraper
-from src.auth_config import auth_config, azure_scheme
-from src.table_storage import TableStorage
+from src.auth_config import auth_config, azure_scheme, require_admin
+from src.storage_backend import create_storage_backend
+from src.util.browser_pool import BrowserPool
+from src.util.domain_throttle import DomainThrottle
+from src.util.fetch_engine import FetchEngine
+from src.util.http_client import HttpClient
 from src.util.http_headers_manager import HttpHeadersManager
+from src.util.lease_backend import InMemoryLeaseBackend, TableLeaseBackend
+from src.util.parser_pool import ParserPool
+from src.util.patrol_schedule import PatrolSchedule
+from src.util.push_dispatcher import PushNotificationDispatcher
+from src.util.shard_coordinator import ShardCoordinator
+from src.util.worker_status import WorkerRegistry
 
 app = FastAPI(
     swagger_ui_oauth2_redirect_url="/oauth2-redirect",
@@ -24,7 +34,28 @@ app = FastAPI(
 
 @app.on_event("startup")
 async def startup_event():
-    setup_scheduler()
+    await table_storage.start()
+    await http_client.start()
+    await browser_pool.start()
+    parser_pool.start()
+    await push_dispatcher.start()
+    # Without the scheduler, patrols are scraped by `python -m src.worker`
+    app.state.scheduler_task = None
+    if auth_config.RUN_SCHEDULER:
+        app.state.scheduler_task = await setup_scheduler()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if app.state.scheduler_task is not None:
+        app.state.scheduler_task.cancel()
+    if shard_coordinator is not None:
+        await shard_coordinator.close()
+    await push_dispatcher.close()
+    await http_client.close()
+    await browser_pool.close()
+    parser_pool.close()
+    await table_storage.close()
 
 
 if auth_config.BACKEND_CORS_ORIGINS:
@@ -36,26 +67,58 @@ if auth_config.BACKEND_CORS_ORIGINS:
         allow_headers=["*"],
     )
 
-table_storage = TableStorage()
-patrol_management = PatrolManagement(table_storage)
-patrol_history_management = PatrolHistoryManagement(table_storage)
-headers_manager = HttpHeadersManager()
-scraper = Scraper(table_storage, patrol_history_management, headers_manager)
+table_storage = create_storage_backend()
+http_client = HttpClient()
+shard_coordinator = None
+patrol_schedule = PatrolSchedule()
+if auth_config.RUN_SCHEDULER and auth_config.SCRAPER_MODE == "distributed":
+    if auth_config.LEASE_BACKEND == "table":
+        lease_backend = TableLeaseBackend(table_storage)
+    else:
+        lease_backend = InMemoryLeaseBackend()
+    shard_coordinator = ShardCoordinator(lease_backend)
+    patrol_schedule = PatrolSchedule(shard_coordinator.owns)
+# Without the scheduler nothing pops the schedule, so the API leaves it alone
+patrol_management = PatrolManagement(
+    table_storage, patrol_schedule if auth_config.RUN_SCHEDULER else None
+)
+push_dispatcher = PushNotificationDispatcher(
+    http_client, on_invalid_token=patrol_management.clear_push_token
+)
+parser_pool = ParserPool()
+patrol_history_management = PatrolHistoryManagement(
+    table_storage, push_dispatcher, parser_pool
+)
+browser_pool = BrowserPool()
+headers_manager = HttpHeadersManager(browser_pool)
+domain_throttle = DomainThrottle()
+fetch_engine = FetchEngine(browser_pool)
+scraper = Scraper(
+    table_storage,
+    patrol_history_management,
+    headers_manager,
+    http_client,
+    patrol_schedule,
+    parser_pool,
+    domain_throttle,
+    fetch_engine,
+    shard_coordinator,
+)
+admin_management = AdminManagement(domain_throttle, WorkerRegistry(table_storage))
+metrics_management = MetricsManagement()
 
 app.include_router(scraper.router, dependencies=[Security(azure_scheme)])
 app.include_router(patrol_management.router)
 app.include_router(patrol_history_management.router)
+app.include_router(admin_management.router, dependencies=[Security(require_admin)])
+app.include_router(metrics_management.router)
 
 
-def setup_scheduler():
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(
-        scraper.process_page_patrol,
-        trigger=IntervalTrigger(minutes=int(os.getenv("SCRAPER_INTERVAL", 1))),
-        id="process_website_monitor",
-        replace_existing=True,
-    )
-    scheduler.start()
+async def setup_scheduler() -> asyncio.Task:
+    if shard_coordinator is not None:
+        await shard_coordinator.start()
+    await scraper.seed_schedule()
+    return asyncio.create_task(scraper.run_scheduler())
 
 
 if __name__ == "__main__":
@@ -19,6 +19,8 @@ class PagePatrol(BaseModel):
     RowKey: str = Field(default_factory=lambda: str(uuid.uuid4()))
     expo_push_token: Optional[str] = None
     date_added: int
+    # Last change through the API, so nodes not sharing its process pick it up
+    updated_at: Optional[int] = None
     url: str
     xpath: str
     search_string: str
@@ -29,11 +31,54 @@ class PagePatrol(BaseModel):
     last_scrape_status: Optional[str] = None
     last_scrape_status_detail: Optional[str] = None
     last_scrape_html_content: Optional[str] = None
+    last_recorded_html_hash: Optional[str] = None
+    # Lets a node read only the patrols in shards it just claimed
+    shard: Optional[int] = None
+
+
+# PagePatrol columns written by the scraper after each scrape. The shard is kept
+# current there for patrols stored before it, or with another SHARD_COUNT.
+PagePatrolScrapeFields = [
+    "last_scrape_time",
+    "last_scrape_status",
+    "last_scrape_status_detail",
+    "last_scrape_html_content",
+    "last_recorded_html_hash",
+    "shard",
+]
+
+# PagePatrol columns needed to place a patrol on the schedule
+PatrolScheduleFields = [
+    "PartitionKey",
+    "RowKey",
+    "url",
+    "scrape_interval",
+    "last_scrape_time",
+    "is_enabled",
+    "is_deleted",
+    "shard",
+]
+
+# Every PagePatrol column except the HTML payload, for list and scan queries
+PagePatrolSummaryFields = [
+    field for field in PagePatrol.__fields__ if field != "last_scrape_html_content"
+]
+
+
+# PatrolHistory rows are partitioned by page_patrol_id and keyed by an inverted
+# millisecond timestamp, so a partition reads back newest-first
+HistoryRowKeyMax = 10**13 - 1
+
+
+def get_history_row_key(scrape_time: datetime, unique_id: Optional[str] = None) -> str:
+    inverted_time = HistoryRowKeyMax - int(scrape_time.timestamp() * 1000)
+    return f"{inverted_time:013d}_{unique_id or uuid.uuid4()}"
 
 
 class PatrolHistory(BaseModel):
     PartitionKey: str
     page_patrol_id: str
     RowKey: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: Optional[str] = None
     scrape_time: datetime
     scrape_html_content: str
@@ -0,0 +1,469 @@
+import asyncio
+import base64
+import json
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+)
+from azure.data.tables import (
+    EntityProperty,
+    TableEntity,
+    TransactionOperation,
+    UpdateMode,
+)
+
+from .logger_config import setup_logger
+from .storage_backend import (
+    PAGE_PATROL_TABLE,
+    PATROL_HISTORY_TABLE,
+    PATROL_LEASE_TABLE,
+    WORKER_STATUS_TABLE,
+    BatchResult,
+    StorageBackend,
+)
+from .util.odata_filter import Node, parse_filter
+
+# Properties the app filters on, indexed so those queries avoid a full scan.
+# PartitionKey and RowKey are covered by the primary key.
+INDEXES = {
+    PAGE_PATROL_TABLE: [
+        ("is_deleted",),
+        ("expo_push_token",),
+        ("is_enabled", "is_deleted", "shard"),
+        ("updated_at",),
+    ],
+    PATROL_HISTORY_TABLE: [("page_patrol_id",)],
+    PATROL_LEASE_TABLE: [],
+    WORKER_STATUS_TABLE: [],
+}
+
+# Properties stored in their own columns rather than in the JSON document
+COLUMNS = {"PartitionKey": "PartitionKey", "RowKey": "RowKey", "Timestamp": "timestamp"}
+
+SQL_OPERATORS = {"eq": "=", "ne": "!=", "gt": ">", "ge": ">=", "lt": "<", "le": "<="}
+
+# Azure Tables returns at most 1000 entities per page
+DEFAULT_PAGE_SIZE = 1000
+
+
+class SqliteTable:
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+
+
+# JSON has no datetime or binary type, so those are stored as UTC ISO 8601 and
+# base64 strings, with their types recorded alongside. ISO strings in one format
+# sort chronologically, so range filters on datetimes still work.
+def encode_value(value: Any) -> Tuple[Any, Optional[str]]:
+    if isinstance(value, EntityProperty):
+        value = value.value
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc).isoformat(timespec="microseconds"), (
+            "datetime"
+        )
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii"), "bytes"
+    if isinstance(value, uuid.UUID):
+        return str(value), None
+    return value, None
+
+
+def decode_value(value: Any, value_type: Optional[str]) -> Any:
+    if value_type == "datetime":
+        return datetime.fromisoformat(value)
+    if value_type == "bytes":
+        return base64.b64decode(value)
+    return value
+
+
+def get_column(name: str) -> str:
+    if name in COLUMNS:
+        return COLUMNS[name]
+    # Property names are plain identifiers, checked by the filter tokenizer
+    return f"json_extract(data, '$.{name}')"
+
+
+# Translate a parsed filter into a WHERE clause. A comparison against a missing
+# property is NULL, which is treated as false under "not" as it is when
+# filtering entities in memory.
+def to_sql(node: Node, params: List[Any]) -> str:
+    kind = node[0]
+    if kind in ("and", "or"):
+        clauses = [to_sql(child, params) for child in node[1]]
+        return "(" + f" {kind.upper()} ".join(clauses) + ")"
+    if kind == "not":
+        return f"NOT COALESCE({to_sql(node[1], params)}, 0)"
+
+    _, name, op, literal = node
+    params.append(encode_value(literal)[0])
+    return f"{get_column(name)} {SQL_OPERATORS[op]} ?"
+
+
+# Storage in a local SQLite database, for single-node deployments, development
+# and benchmarks. Each table keeps its properties as a JSON document with
+# expression indexes on the queried properties. Calls run one at a time on a
+# dedicated thread; writes take the database lock, so several processes can
+# share one file.
+class SqliteTableStorage(StorageBackend):
+    def __init__(self, path: str):
+        self.logger = setup_logger(__name__)
+        self.path = path
+        self.connection: Optional[sqlite3.Connection] = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+        self.page_patrol_table_client = SqliteTable(PAGE_PATROL_TABLE)
+        self.patrol_history_table_client = SqliteTable(PATROL_HISTORY_TABLE)
+        self.patrol_lease_table_client = SqliteTable(PATROL_LEASE_TABLE)
+        self.worker_status_table_client = SqliteTable(WORKER_STATUS_TABLE)
+
+    async def start(self):
+        await self.run(self.connect)
+        self.logger.info(f"Using SQLite storage at {self.path}")
+
+    async def close(self):
+        if self.connection is not None:
+            await self.run(self.connection.close)
+            self.connection = None
+        self.executor.shutdown(wait=True)
+
+    async def run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    def connect(self):
+        # Transactions are managed explicitly, see in_transaction
+        self.connection = sqlite3.connect(
+            self.path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        for table_name, indexes in INDEXES.items():
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table_name}" ('
+                "PartitionKey TEXT NOT NULL, RowKey TEXT NOT NULL, "
+                "etag TEXT NOT NULL, timestamp TEXT NOT NULL, "
+                "data TEXT NOT NULL, types TEXT, "
+                "PRIMARY KEY (PartitionKey, RowKey)) WITHOUT ROWID"
+            )
+            for properties in indexes:
+                columns = ", ".join(get_column(name) for name in properties)
+                self.connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS "ix_{table_name}_'
+                    f'{"_".join(properties)}" ON "{table_name}" ({columns})'
+                )
+
+    def in_transaction(self, function, *args):
+        # IMMEDIATE takes the write lock up front, so a conditional write cannot
+        # race another process between reading the etag and writing
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = function(*args)
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+        return result
+
+    @classmethod
+    def to_entity(cls, row: Tuple, select: Optional[List[str]] = None) -> TableEntity:
+        partition_key, row_key, etag, timestamp, data, types = row
+        value_types = json.loads(types) if types else {}
+        entity = TableEntity(PartitionKey=partition_key, RowKey=row_key)
+        for name, value in json.loads(data).items():
+            entity[name] = decode_value(value, value_types.get(name))
+        entity._metadata = {
+            "etag": etag,
+            "timestamp": datetime.fromisoformat(timestamp),
+        }
+        return cls.select(entity, select) if select else entity
+
+    @staticmethod
+    def select(entity: TableEntity, select: List[str]) -> TableEntity:
+        selected = TableEntity(
+            {name: entity[name] for name in select if name in entity}
+        )
+        selected._metadata = entity.metadata
+        return selected
+
+    def read_row(self, table_name: str, partition_key, row_key) -> Optional[Tuple]:
+        return self.connection.execute(
+            "SELECT PartitionKey, RowKey, etag, timestamp, data, types "
+            f'FROM "{table_name}" WHERE PartitionKey = ? AND RowKey = ?',
+            (partition_key, row_key),
+        ).fetchone()
+
+    def write_row(self, table_name: str, entity) -> Dict[str, Any]:
+        data: Dict[str, Any] = {}
+        value_types: Dict[str, str] = {}
+        for name, value in entity.items():
+            # Azure Tables does not store null properties either
+            if name in COLUMNS or value is None:
+                continue
+            data[name], value_type = encode_value(value)
+            if value_type is not None:
+                value_types[name] = value_type
+
+        etag = f'W/"{uuid.uuid4().hex}"'
+        timestamp = datetime.now(timezone.utc)
+        self.connection.execute(
+            f'INSERT OR REPLACE INTO "{table_name}" '
+            "(PartitionKey, RowKey, etag, timestamp, data, types) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                entity["PartitionKey"],
+                entity["RowKey"],
+                etag,
+                encode_value(timestamp)[0],
+                json.dumps(data),
+                json.dumps(value_types) if value_types else None,
+            ),
+        )
+        return {"etag": etag, "date": timestamp}
+
+    @staticmethod
+    def check_condition(row: Tuple, etag, match_condition):
+        if match_condition == MatchConditions.IfNotModified and etag != row[2]:
+            raise ResourceModifiedError("The update condition was not satisfied.")
+
+    def apply_create(self, table_name: str, entity) -> Dict[str, Any]:
+        if self.read_row(table_name, entity["PartitionKey"], entity["RowKey"]):
+            raise ResourceExistsError("The specified entity already exists.")
+        return self.write_row(table_name, entity)
+
+    def apply_update(
+        self, table_name: str, mode, entity, etag=None, match_condition=None
+    ) -> Dict[str, Any]:
+        row = self.read_row(table_name, entity["PartitionKey"], entity["RowKey"])
+        if row is None:
+            raise ResourceNotFoundError("The specified resource does not exist.")
+        self.check_condition(row, etag, match_condition)
+        if mode == UpdateMode.MERGE:
+            entity = {**self.to_entity(row), **entity}
+        return self.write_row(table_name, entity)
+
+    def apply_upsert(self, table_name: str, mode, entity) -> Dict[str, Any]:
+        row = self.read_row(table_name, entity["PartitionKey"], entity["RowKey"])
+        if row is not None and mode == UpdateMode.MERGE:
+            entity = {**self.to_entity(row), **entity}
+        return self.write_row(table_name, entity)
+
+    def apply_delete(
+        self, table_name: str, partition_key, row_key, etag=None, match_condition=None
+    ):
+        # Deleting a missing entity succeeds, as with the Azure SDK
+        row = self.read_row(table_name, partition_key, row_key)
+        if row is None:
+            return
+        self.check_condition(row, etag, match_condition)
+        self.connection.execute(
+            f'DELETE FROM "{table_name}" WHERE PartitionKey = ? AND RowKey = ?',
+            (partition_key, row_key),
+        )
+
+    def apply_operation(self, table_name: str, operation: Tuple):
+        action, entity = operation[0], operation[1]
+        kwargs = operation[2] if len(operation) > 2 else {}
+        etag, match_condition = kwargs.get("etag"), kwargs.get("match_condition")
+        if action == TransactionOperation.CREATE:
+            self.apply_create(table_name, entity)
+        elif action == TransactionOperation.UPDATE:
+            mode = kwargs.get("mode", UpdateMode.MERGE)
+            self.apply_update(table_name, mode, entity, etag, match_condition)
+        elif action == TransactionOperation.UPSERT:
+            self.apply_upsert(table_name, kwargs.get("mode", UpdateMode.MERGE), entity)
+        elif action == TransactionOperation.DELETE:
+            self.apply_delete(
+                table_name,
+                entity["PartitionKey"],
+                entity["RowKey"],
+                etag,
+                match_condition,
+            )
+        else:
+            raise ValueError(f"Unsupported transaction operation: {action}")
+
+    # Apply every operation in one transaction, rolling back only the ones that
+    # fail so the result matches Azure's retry-without-the-failed-operation
+    def apply_batch(self, table_name: str, operations: List[Tuple]):
+        results = []
+        for operation in operations:
+            self.connection.execute("SAVEPOINT operation")
+            try:
+                self.apply_operation(table_name, operation)
+            except Exception as e:
+                self.connection.execute("ROLLBACK TO operation")
+                results.append(BatchResult(operation, e))
+            else:
+                results.append(BatchResult(operation))
+            self.connection.execute("RELEASE operation")
+        return results
+
+    def apply_query(
+        self,
+        table_name: str,
+        query_filter,
+        select: Optional[List[str]] = None,
+        limit: Optional[int] = None,
+        start_key: Optional[Tuple[str, str]] = None,
+    ) -> List[TableEntity]:
+        params: List[Any] = []
+        clauses = []
+        node = parse_filter(query_filter or "")
+        if node is not None:
+            clauses.append(to_sql(node, params))
+        if start_key is not None:
+            clauses.append("(PartitionKey, RowKey) >= (?, ?)")
+            params.extend(start_key)
+
+        sql = (
+            "SELECT PartitionKey, RowKey, etag, timestamp, data, types "
+            f'FROM "{table_name}"'
+        )
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY PartitionKey, RowKey"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        rows = self.connection.execute(sql, params).fetchall()
+        return [self.to_entity(row, select) for row in rows]
+
+    async def create_entity(self, table_client: SqliteTable, entity, **kwargs):
+        with self.observe(table_client, "create"):
+            return await self.run(
+                self.in_transaction,
+                self.apply_create,
+                table_client.table_name,
+                entity,
+            )
+
+    async def query_entities(
+        self,
+        table_client: SqliteTable,
+        query_filter,
+        select: Optional[List[str]] = None,
+        results_per_page: Optional[int] = None,
+    ):
+        with self.observe(table_client, "query"):
+            return await self.run(
+                self.apply_query, table_client.table_name, query_filter, select
+            )
+
+    # The continuation token holds the keys of the first entity of the next page
+    async def query_entities_page(
+        self,
+        table_client: SqliteTable,
+        query_filter,
+        select: Optional[List[str]] = None,
+        results_per_page: Optional[int] = None,
+        continuation_token: Optional[Any] = None,
+    ) -> Tuple[List, Optional[Any]]:
+        start_key = None
+        if continuation_token is not None:
+            if not isinstance(continuation_token, dict) or not all(
+                isinstance(continuation_token.get(name), str)
+                for name in ("PartitionKey", "RowKey")
+            ):
+                raise ValueError("Invalid continuation token")
+            start_key = (
+                continuation_token["PartitionKey"],
+                continuation_token["RowKey"],
+            )
+
+        page_size = results_per_page or DEFAULT_PAGE_SIZE
+        # Read the whole rows so the next page's keys are known even if not
+        # selected, then apply select
+        with self.observe(table_client, "query_page"):
+            entities = await self.run(
+                self.apply_query,
+                table_client.table_name,
+                query_filter,
+                None,
+                page_size + 1,
+                start_key,
+            )
+
+        next_token = None
+        if len(entities) > page_size:
+            next_entity = entities.pop()
+            next_token = {
+                "PartitionKey": next_entity["PartitionKey"],
+                "RowKey": next_entity["RowKey"],
+            }
+        if select:
+            entities = [self.select(entity, select) for entity in entities]
+        return entities, next_token
+
+    async def get_entity(
+        self,
+        table_client: SqliteTable,
+        partition_key,
+        row_key,
+        select: Optional[List[str]] = None,
+    ):
+        with self.observe(table_client, "get"):
+            row = await self.run(
+                self.read_row, table_client.table_name, partition_key, row_key
+            )
+            if row is None:
+                raise ResourceNotFoundError("The specified resource does not exist.")
+            return self.to_entity(row, select)
+
+    async def update_entity(self, table_client: SqliteTable, mode, entity, **kwargs):
+        with self.observe(table_client, "update"):
+            return await self.run(
+                self.in_transaction,
+                self.apply_update,
+                table_client.table_name,
+                mode,
+                entity,
+                kwargs.get("etag"),
+                kwargs.get("match_condition"),
+            )
+
+    async def upsert_entity(self, table_client: SqliteTable, mode, entity):
+        with self.observe(table_client, "upsert"):
+            await self.run(
+                self.in_transaction,
+                self.apply_upsert,
+                table_client.table_name,
+                mode,
+                entity,
+            )
+
+    async def delete_entity(
+        self, table_client: SqliteTable, partition_key, row_key, **kwargs
+    ):
+        with self.observe(table_client, "delete"):
+            await self.run(
+                self.in_transaction,
+                self.apply_delete,
+                table_client.table_name,
+                partition_key,
+                row_key,
+                kwargs.get("etag"),
+                kwargs.get("match_condition"),
+            )
+
+    async def submit_batch(
+        self, table_client: SqliteTable, operations: List[Tuple]
+    ) -> List[BatchResult]:
+        with self.observe(table_client, "transaction"):
+            return await self.run(
+                self.in_transaction,
+                self.apply_batch,
+                table_client.table_name,
+                operations,
+            )
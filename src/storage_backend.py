@@ -0,0 +1,126 @@
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, List, Optional, Tuple
+
+from .auth_config import auth_config
+from .util import metrics
+
+# Names of the tables every backend provides
+PAGE_PATROL_TABLE = "PagePatrol"
+PATROL_HISTORY_TABLE = "PatrolHistory"
+PATROL_LEASE_TABLE = "PatrolLeases"
+WORKER_STATUS_TABLE = "WorkerStatus"
+
+
+@dataclass
+class BatchResult:
+    operation: Tuple
+    error: Optional[Exception] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+# Entity storage with Azure Tables semantics. Entities are addressed by
+# PartitionKey and RowKey, queried with OData filters, carry an ETag for
+# conditional writes, and failures raise the azure.core exceptions.
+class StorageBackend(ABC):
+    page_patrol_table_client: Any
+    patrol_history_table_client: Any
+    patrol_lease_table_client: Any
+    worker_status_table_client: Any
+
+    @abstractmethod
+    async def start(self):
+        ...
+
+    @abstractmethod
+    async def close(self):
+        ...
+
+    # Record the latency, and failure if any, of a storage call
+    @contextmanager
+    def observe(self, table_client, operation: str):
+        labels = (table_client.table_name, operation)
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            metrics.STORAGE_ERRORS.labels(*labels).inc()
+            raise
+        finally:
+            metrics.STORAGE_SECONDS.labels(*labels).observe(time.perf_counter() - start)
+
+    # Returns the new entity's metadata, including its etag
+    @abstractmethod
+    async def create_entity(self, table_client, entity, **kwargs):
+        ...
+
+    @abstractmethod
+    async def query_entities(
+        self,
+        table_client,
+        query_filter,
+        select: Optional[List[str]] = None,
+        results_per_page: Optional[int] = None,
+    ):
+        ...
+
+    # Fetch a single page, returning the token for the next one
+    @abstractmethod
+    async def query_entities_page(
+        self,
+        table_client,
+        query_filter,
+        select: Optional[List[str]] = None,
+        results_per_page: Optional[int] = None,
+        continuation_token: Optional[Any] = None,
+    ) -> Tuple[List, Optional[Any]]:
+        ...
+
+    @abstractmethod
+    async def get_entity(
+        self,
+        table_client,
+        partition_key,
+        row_key,
+        select: Optional[List[str]] = None,
+    ):
+        ...
+
+    # Accepts etag and match_condition for a conditional update
+    @abstractmethod
+    async def update_entity(self, table_client, mode, entity, **kwargs):
+        ...
+
+    @abstractmethod
+    async def upsert_entity(self, table_client, mode, entity):
+        ...
+
+    @abstractmethod
+    async def delete_entity(self, table_client, partition_key, row_key, **kwargs):
+        ...
+
+    # Submit (operation, entity[, kwargs]) tuples in as few round trips as
+    # possible, returning one result per operation
+    @abstractmethod
+    async def submit_batch(
+        self, table_client, operations: List[Tuple]
+    ) -> List[BatchResult]:
+        ...
+
+
+# The backend selected by STORAGE_BACKEND
+def create_storage_backend() -> StorageBackend:
+    # Imported here as both implementations build on this module
+    if auth_config.STORAGE_BACKEND == "sqlite":
+        from .sqlite_storage import SqliteTableStorage
+
+        return SqliteTableStorage(auth_config.SQLITE_PATH)
+
+    from .table_storage import TableStorage
+
+    return TableStorage()
@@ -1,36 +1,175 @@
-from azure.data.tables import TableClient, TableServiceClient
+import asyncio
+from collections import defaultdict
+from typing import Any, List, Optional, Tuple
+
+from azure.data.tables import RequestTooLargeError, TableTransactionError
+from azure.data.tables.aio import TableClient, TableServiceClient
 
 from .auth_config import auth_config
+from .storage_backend import (
+    PAGE_PATROL_TABLE,
+    PATROL_HISTORY_TABLE,
+    PATROL_LEASE_TABLE,
+    WORKER_STATUS_TABLE,
+    BatchResult,
+    StorageBackend,
+)
+
+# Azure Tables accepts at most 100 operations per transaction
+MAX_BATCH_SIZE = 100
 
 
-class TableStorage:
+# Storage backed by Azure Tables (or Cosmos DB for Table)
+class TableStorage(StorageBackend):
     def __init__(self):
         self.connection_string = auth_config.COSMOSDB_CONNECTION_STRING
         self.table_service = TableServiceClient.from_connection_string(
             conn_str=self.connection_string
         )
 
-        self.table_service.create_table_if_not_exists("PagePatrol")
-        self.table_service.create_table_if_not_exists("PatrolHistory")
-
         self.page_patrol_table_client = self.table_service.get_table_client(
-            "PagePatrol"
+            PAGE_PATROL_TABLE
         )
         self.patrol_history_table_client = self.table_service.get_table_client(
-            "PatrolHistory"
+            PATROL_HISTORY_TABLE
+        )
+        self.patrol_lease_table_client = self.table_service.get_table_client(
+            PATROL_LEASE_TABLE
+        )
+        self.worker_status_table_client = self.table_service.get_table_client(
+            WORKER_STATUS_TABLE
         )
 
-    def create_entity(self, table_client: TableClient, entity):
-        table_client.create_entity(entity=entity)
+    async def start(self):
+        await self.table_service.create_table_if_not_exists(PAGE_PATROL_TABLE)
+        await self.table_service.create_table_if_not_exists(PATROL_HISTORY_TABLE)
+        await self.table_service.create_table_if_not_exists(PATROL_LEASE_TABLE)
+        await self.table_service.create_table_if_not_exists(WORKER_STATUS_TABLE)
+
+    async def close(self):
+        await self.page_patrol_table_client.close()
+        await self.patrol_history_table_client.close()
+        await self.patrol_lease_table_client.close()
+        await self.worker_status_table_client.close()
+        await self.table_service.close()
+
+    async def create_entity(self, table_client: TableClient, entity, **kwargs):
+        with self.observe(table_client, "create"):
+            return await table_client.create_entity(entity=entity, **kwargs)
+
+    async def query_entities(
+        self,
+        table_client: TableClient,
+        query_filter,
+        select: Optional[List[str]] = None,
+        results_per_page: Optional[int] = None,
+    ):
+        with self.observe(table_client, "query"):
+            return [
+                entity
+                async for entity in table_client.query_entities(
+                    query_filter=query_filter,
+                    select=select,
+                    results_per_page=results_per_page,
+                )
+            ]
+
+    # Fetch a single server-side page, returning the token for the next one
+    async def query_entities_page(
+        self,
+        table_client: TableClient,
+        query_filter,
+        select: Optional[List[str]] = None,
+        results_per_page: Optional[int] = None,
+        continuation_token: Optional[Any] = None,
+    ) -> Tuple[List, Optional[Any]]:
+        pages = table_client.query_entities(
+            query_filter=query_filter,
+            select=select,
+            results_per_page=results_per_page,
+        ).by_page(continuation_token=continuation_token)
+
+        with self.observe(table_client, "query_page"):
+            try:
+                page = await pages.__anext__()
+            except StopAsyncIteration:
+                return [], None
+
+            return [entity async for entity in page], pages.continuation_token
+
+    async def get_entity(
+        self,
+        table_client: TableClient,
+        partition_key,
+        row_key,
+        select: Optional[List[str]] = None,
+    ):
+        with self.observe(table_client, "get"):
+            return await table_client.get_entity(partition_key, row_key, select=select)
+
+    async def update_entity(self, table_client: TableClient, mode, entity, **kwargs):
+        with self.observe(table_client, "update"):
+            return await table_client.update_entity(mode=mode, entity=entity, **kwargs)
+
+    async def upsert_entity(self, table_client: TableClient, mode, entity):
+        with self.observe(table_client, "upsert"):
+            await table_client.upsert_entity(mode=mode, entity=entity)
+
+    async def delete_entity(
+        self, table_client: TableClient, partition_key, row_key, **kwargs
+    ):
+        with self.observe(table_client, "delete"):
+            await table_client.delete_entity(partition_key, row_key, **kwargs)
+
+    # Submit operations as table transactions grouped by PartitionKey
+    async def submit_batch(
+        self, table_client: TableClient, operations: List[Tuple]
+    ) -> List[BatchResult]:
+        partitions = defaultdict(list)
+        for operation in operations:
+            partitions[operation[1]["PartitionKey"]].append(operation)
+
+        chunks = [
+            partition_operations[start : start + MAX_BATCH_SIZE]
+            for partition_operations in partitions.values()
+            for start in range(0, len(partition_operations), MAX_BATCH_SIZE)
+        ]
+        chunk_results = await asyncio.gather(
+            *(self.submit_transaction(table_client, chunk) for chunk in chunks)
+        )
+        return [result for results in chunk_results for result in results]
 
-    def query_entities(self, table_client: TableClient, query_filter):
-        return table_client.query_entities(query_filter=query_filter)
+    async def submit_transaction(
+        self, table_client: TableClient, operations: List[Tuple]
+    ) -> List[BatchResult]:
+        results = []
+        while operations:
+            try:
+                with self.observe(table_client, "transaction"):
+                    await table_client.submit_transaction(operations)
+            except RequestTooLargeError as e:
+                if len(operations) == 1:
+                    return results + [BatchResult(operations[0], e)]
 
-    def get_entity(self, table_client: TableClient, partition_key, row_key):
-        return table_client.get_entity(partition_key, row_key)
+                # Payload too large, split the transaction in two and retry
+                middle = len(operations) // 2
+                results.extend(
+                    await self.submit_transaction(table_client, operations[:middle])
+                )
+                results.extend(
+                    await self.submit_transaction(table_client, operations[middle:])
+                )
+                return results
+            except TableTransactionError as e:
+                # The transaction was rolled back, report the failing operation
+                # and retry the rest without it
+                index = e.index if 0 <= e.index < len(operations) else 0
+                results.append(BatchResult(operations[index], e))
+                operations = operations[:index] + operations[index + 1 :]
+                continue
+            except Exception as e:
+                return results + [BatchResult(operation, e) for operation in operations]
 
-    def update_entity(self, table_client: TableClient, mode, entity):
-        table_client.update_entity(mode=mode, entity=entity)
+            return results + [BatchResult(operation) for operation in operations]
 
-    def delete_entity(self, table_client: TableClient, partition_key, row_key):
-        table_client.delete_entity(partition_key, row_key)
+        return results
@@ -0,0 +1,15 @@
+# Backfill last_recorded_html_hash on existing patrols from their latest history,
+# and their shard number, which nodes claiming a shard read them by.
+# Usage: python -m src.tools.backfill_content_hash
+import asyncio
+
+from src.tools.bootstrap import open_patrol_history_management
+
+
+async def main():
+    async with open_patrol_history_management() as patrol_history_management:
+        await patrol_history_management.backfill_patrols()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,23 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from src.api.patrol_history_mgmt import PatrolHistoryManagement
+from src.storage_backend import create_storage_backend
+from src.util.http_client import HttpClient
+from src.util.parser_pool import ParserPool
+from src.util.push_dispatcher import PushNotificationDispatcher
+
+
+# PatrolHistoryManagement over started storage for a one-off tool, closed on exit
+@asynccontextmanager
+async def open_patrol_history_management() -> AsyncIterator[PatrolHistoryManagement]:
+    table_storage = create_storage_backend()
+    parser_pool = ParserPool()
+    await table_storage.start()
+    try:
+        # Tools never send notifications, so the dispatcher is never started
+        push_dispatcher = PushNotificationDispatcher(HttpClient())
+        yield PatrolHistoryManagement(table_storage, push_dispatcher, parser_pool)
+    finally:
+        parser_pool.close()
+        await table_storage.close()
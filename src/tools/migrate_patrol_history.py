@@ -0,0 +1,15 @@
+# Move PatrolHistory rows from the user-partitioned layout to the patrol-partitioned,
+# newest-first layout.
+# Usage: python -m src.tools.migrate_patrol_history
+import asyncio
+
+from src.tools.bootstrap import open_patrol_history_management
+
+
+async def main():
+    async with open_patrol_history_management() as patrol_history_management:
+        await patrol_history_management.migrate_history_layout()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
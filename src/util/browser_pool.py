@@ -0,0 +1,94 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+from playwright.async_api import Browser, Error, Page, Playwright, async_playwright
+
+from src.auth_config import auth_config
+from src.logger_config import setup_logger
+
+
+class BrowserPool:
+    def __init__(self):
+        self.logger = setup_logger(__name__)
+        self.playwright: Optional[Playwright] = None
+        self.browsers: List[Optional[Browser]] = []
+        self.next_browser = 0
+        # Created on start so they bind to the running event loop
+        self.lock: Optional[asyncio.Lock] = None
+        self.page_semaphore: Optional[asyncio.Semaphore] = None
+
+    # Browsers are launched on first use, so a missing or broken browser install
+    # only fails the pages that need one, not the whole process
+    async def start(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+            self.page_semaphore = asyncio.Semaphore(auth_config.BROWSER_MAX_PAGES)
+
+    async def close(self):
+        if self.lock is None:
+            return
+
+        async with self.lock:
+            for browser in self.browsers:
+                if browser is not None and browser.is_connected():
+                    await browser.close()
+            self.browsers = []
+
+            if self.playwright is not None:
+                await self.playwright.stop()
+                self.playwright = None
+                self.logger.info("Closed browser pool")
+
+    async def _launch_browser(self, index: int) -> Browser:
+        browser = await self.playwright.chromium.launch(headless=True)  # type: ignore
+        self.browsers[index] = browser
+        self.logger.info(f"Launched browser {index + 1}/{len(self.browsers)}")
+        return browser
+
+    # Hand out browsers round-robin, launching them on first use and relaunching any
+    # that have crashed
+    async def _get_browser(self) -> Browser:
+        if self.lock is None:
+            await self.start()
+
+        async with self.lock:  # type: ignore
+            if self.playwright is None:
+                self.playwright = await async_playwright().start()
+                self.browsers = [None] * auth_config.BROWSER_POOL_SIZE
+
+            index = self.next_browser % len(self.browsers)
+            self.next_browser += 1
+
+            browser = self.browsers[index]
+            if browser is None:
+                browser = await self._launch_browser(index)
+            elif not browser.is_connected():
+                self.logger.warning(f"Browser {index + 1} is disconnected, relaunching")
+                browser = await self._launch_browser(index)
+
+            return browser
+
+    # Yield a page in its own isolated browser context, closed again on exit
+    @asynccontextmanager
+    async def new_page(self) -> AsyncIterator[Page]:
+        if self.page_semaphore is None:
+            await self.start()
+
+        async with self.page_semaphore:  # type: ignore
+            browser = await self._get_browser()
+            try:
+                context = await browser.new_context()
+            except Error:
+                # The browser died between the health check and now, retry once
+                browser = await self._get_browser()
+                context = await browser.new_context()
+
+            try:
+                yield await context.new_page()
+            finally:
+                try:
+                    await context.close()
+                except Error:
+                    # The context is gone with its browser, nothing to clean up
+                    pass
@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from src.util.document import Document
+
+
+class ConditionalCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # URL -> last document served with an ETag or Last-Modified validator
+        self.documents: "OrderedDict[str, Document]" = OrderedDict()
+        self.conditional_requests = 0
+        self.not_modified = 0
+        self.bytes_saved = 0
+
+    # Request headers that let the server answer 304 if the page is unchanged
+    def validators(self, url: str) -> Dict[str, str]:
+        document = self.documents.get(url)
+        if document is None:
+            return {}
+
+        headers = {}
+        if document.etag:
+            headers["If-None-Match"] = document.etag
+        if document.last_modified:
+            headers["If-Modified-Since"] = document.last_modified
+        self.conditional_requests += 1
+        return headers
+
+    # Return the cached document for a 304 response, if it is still held
+    def get_not_modified(self, url: str) -> Optional[Document]:
+        document = self.documents.get(url)
+        if document is None:
+            return None
+
+        self.not_modified += 1
+        self.bytes_saved += len(document.text)
+        self.documents.move_to_end(url)
+        return document
+
+    def store(self, url: str, document: Document):
+        if not document.etag and not document.last_modified:
+            self.documents.pop(url, None)
+            return
+
+        self.documents[url] = document
+        self.documents.move_to_end(url)
+        while len(self.documents) > self.max_size:
+            self.documents.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        if not self.conditional_requests:
+            return 0.0
+        return self.not_modified / self.conditional_requests
@@ -0,0 +1,27 @@
+from typing import Dict, Optional, Tuple
+
+from src.util.html_matcher import MatchResult
+
+# How a document was fetched: a plain HTTP GET, or rendered in a headless browser
+HTTP_TIER = "http"
+RENDER_TIER = "render"
+
+
+class Document:
+    def __init__(
+        self,
+        url: str,
+        text: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        tier: str = HTTP_TIER,
+    ):
+        self.url = url
+        self.text = text
+        self.tier = tier
+        self.etag = etag
+        self.last_modified = last_modified
+        # Set when the document was served again from a 304 Not Modified response
+        self.not_modified = False
+        # (xpath, search_string) -> result, reused while the page is unchanged
+        self.results: Dict[Tuple[str, str], MatchResult] = {}
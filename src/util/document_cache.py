@@ -0,0 +1,72 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from src.logger_config import setup_logger
+from src.util import metrics
+from src.util.document import Document
+
+
+# Pages fetched for the element lookup endpoint, kept for a short while so a user
+# refining an xpath or search string doesn't refetch the page every time. Results
+# are memoised on the document, and new queries are evaluated by the caller in the
+# parser pool like any other document.
+class DocumentCache:
+    def __init__(self, ttl: float, max_size: int):
+        self.logger = setup_logger(__name__)
+        self.ttl = ttl
+        self.max_size = max_size
+        # URL -> (fetched at, document), least recently used first
+        self.entries: "OrderedDict[str, Tuple[float, Document]]" = OrderedDict()
+        # URL -> in-flight fetch shared by concurrent callers
+        self.pending: Dict[str, asyncio.Task] = {}
+
+    # The document for url if it was fetched within the TTL
+    def get(self, url: str) -> Optional[Document]:
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+        fetched_at, document = entry
+        if time.time() - fetched_at >= self.ttl:
+            del self.entries[url]
+            return None
+
+        self.entries.move_to_end(url)
+        return document
+
+    # The cached document for url, or one fetched with fetch. Concurrent misses for
+    # the same URL share a single fetch, and failures are not cached.
+    async def get_or_fetch(
+        self, url: str, fetch: Callable[[], Awaitable[Document]]
+    ) -> Document:
+        document = self.get(url)
+        if document is not None:
+            metrics.DOCUMENT_CACHE_REQUESTS.labels("hit").inc()
+            return document
+
+        task = self.pending.get(url)
+        if task is not None:
+            metrics.DOCUMENT_CACHE_REQUESTS.labels("shared").inc()
+        else:
+            metrics.DOCUMENT_CACHE_REQUESTS.labels("miss").inc()
+            task = asyncio.ensure_future(self.fetch(url, fetch))
+            task.add_done_callback(lambda task: self.on_fetched(url, task))
+            self.pending[url] = task
+
+        # Shielded so one caller giving up doesn't cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    async def fetch(self, url: str, fetch: Callable[[], Awaitable[Document]]):
+        document = await fetch()
+        self.entries[url] = (time.time(), document)
+        self.entries.move_to_end(url)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return document
+
+    # Retrieve the fetch's error even when every caller stopped waiting for it
+    def on_fetched(self, url: str, task: asyncio.Task):
+        self.pending.pop(url, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.warning(f"Failed to fetch {url}: {task.exception()}")
@@ -0,0 +1,209 @@
+import asyncio
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional
+
+from src.auth_config import auth_config
+from src.logger_config import setup_logger
+from src.util.util import Utils
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+# Most origins named in a state summary
+SUMMARY_ORIGINS = 20
+
+
+class DomainUnavailableError(Exception):
+    def __init__(self, origin: str, message: str):
+        super().__init__(message)
+        self.origin = origin
+
+
+# The origin failed repeatedly and is skipped until its circuit is probed again
+class CircuitOpenError(DomainUnavailableError):
+    pass
+
+
+# The origin asked us to back off for longer than the caller is willing to wait
+class DomainThrottledError(DomainUnavailableError):
+    pass
+
+
+@dataclass
+class DomainState:
+    origin: str
+    # Requests per second, lowered on 429/503 and raised again on success
+    rate: float
+    tokens: float
+    refilled_at: float
+    blocked_until: float = 0.0
+    circuit: str = CIRCUIT_CLOSED
+    # When an open circuit may be probed, or a lost half-open probe retried
+    circuit_retry_at: float = 0.0
+    consecutive_failures: int = 0
+    requests: int = 0
+    throttled_responses: int = 0
+    failures: int = 0
+    short_circuited: int = 0
+
+
+# Per-origin token bucket with AIMD backoff on 429/503 and a circuit breaker
+class DomainThrottle:
+    def __init__(self):
+        self.logger = setup_logger(__name__)
+        self.max_rate = auth_config.DOMAIN_RATE
+        self.burst = auth_config.DOMAIN_BURST
+        self.domains: Dict[str, DomainState] = {}
+
+    def get_state(self, url: str) -> DomainState:
+        origin = Utils.get_baseurl_from(url)
+        state = self.domains.get(origin)
+        if state is None:
+            state = DomainState(origin, self.max_rate, self.burst, time.monotonic())
+            self.domains[origin] = state
+        return state
+
+    # Wait for a request slot on the url's origin, raising if the origin is
+    # short-circuited or would need a longer wait than max_wait
+    async def acquire(self, url: str, max_wait: Optional[float] = None):
+        state = self.get_state(url)
+        while True:
+            now = time.monotonic()
+            self.check_circuit(state, now)
+
+            state.tokens = min(
+                self.burst, state.tokens + (now - state.refilled_at) * state.rate
+            )
+            state.refilled_at = now
+
+            wait = max(state.blocked_until - now, (1 - state.tokens) / state.rate)
+            if wait <= 0:
+                state.tokens -= 1
+                state.requests += 1
+                return
+
+            if max_wait is not None and wait > max_wait:
+                raise DomainThrottledError(
+                    state.origin,
+                    f"{state.origin} is rate limited for another {wait:.0f}s",
+                )
+            await asyncio.sleep(wait)
+
+    def check_circuit(self, state: DomainState, now: float):
+        if state.circuit == CIRCUIT_CLOSED:
+            return
+
+        # Let a single probe through once the open period has passed
+        if now >= state.circuit_retry_at:
+            state.circuit = CIRCUIT_HALF_OPEN
+            state.circuit_retry_at = now + auth_config.CIRCUIT_RESET_TIMEOUT
+            return
+
+        state.short_circuited += 1
+        raise CircuitOpenError(
+            state.origin,
+            f"{state.origin} is unavailable after {state.consecutive_failures}"
+            f" consecutive failures, retrying in {state.circuit_retry_at - now:.0f}s",
+        )
+
+    def record_response(self, url: str, status: int, retry_after: Optional[str]):
+        state = self.get_state(url)
+        now = time.monotonic()
+
+        if status in (429, 503):
+            # Multiplicative decrease, and pause for as long as the host asked
+            state.throttled_responses += 1
+            state.rate = max(
+                auth_config.DOMAIN_MIN_RATE, state.rate * auth_config.DOMAIN_BACKOFF
+            )
+            state.tokens = min(state.tokens, 0)
+            delay = self.parse_retry_after(retry_after)
+            if delay is None:
+                delay = 1 / state.rate
+            state.blocked_until = max(state.blocked_until, now + delay)
+            self.logger.warning(
+                f"{state.origin} returned {status}, slowing to {state.rate:.2f} req/s"
+            )
+
+        if status >= 500:
+            self.record_failure(url)
+            return
+
+        # Additive increase back towards the configured rate
+        if status != 429:
+            state.rate = min(self.max_rate, state.rate + auth_config.DOMAIN_RATE_STEP)
+        state.consecutive_failures = 0
+        if state.circuit != CIRCUIT_CLOSED:
+            state.circuit = CIRCUIT_CLOSED
+            self.logger.info(f"{state.origin} recovered, closing circuit")
+
+    def record_failure(self, url: str):
+        state = self.get_state(url)
+        state.failures += 1
+        state.consecutive_failures += 1
+
+        # A failed probe reopens the circuit straight away
+        failing = state.consecutive_failures >= auth_config.CIRCUIT_FAILURE_THRESHOLD
+        if state.circuit == CIRCUIT_HALF_OPEN or (
+            state.circuit == CIRCUIT_CLOSED and failing
+        ):
+            state.circuit = CIRCUIT_OPEN
+            state.circuit_retry_at = (
+                time.monotonic() + auth_config.CIRCUIT_RESET_TIMEOUT
+            )
+            self.logger.warning(
+                f"{state.origin} failed {state.consecutive_failures} time(s) in a row,"
+                f" opening circuit for {auth_config.CIRCUIT_RESET_TIMEOUT}s"
+            )
+
+    # Retry-After is either a number of seconds or an HTTP date
+    @staticmethod
+    def parse_retry_after(retry_after: Optional[str]) -> Optional[float]:
+        if not retry_after:
+            return None
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                return None
+            if retry_at.tzinfo is None:
+                retry_at = retry_at.replace(tzinfo=timezone.utc)
+            delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+        return min(max(delay, 0.0), auth_config.DOMAIN_MAX_BACKOFF)
+
+    def get_domains(self) -> List[Dict]:
+        now = time.monotonic()
+        domains = []
+        for state in self.domains.values():
+            domain = asdict(state)
+            del domain["tokens"], domain["refilled_at"]
+            domain["blocked_for"] = max(state.blocked_until - now, 0.0)
+            domain["circuit_retry_in"] = (
+                max(state.circuit_retry_at - now, 0.0)
+                if state.circuit != CIRCUIT_CLOSED
+                else None
+            )
+            del domain["blocked_until"], domain["circuit_retry_at"]
+            domains.append(domain)
+        return sorted(domains, key=lambda domain: domain["origin"])
+
+    # Counts of origins short-circuited or slowed down, for worker heartbeats
+    def get_summary(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        open_circuits, backed_off = [], []
+        for state in self.domains.values():
+            if state.circuit != CIRCUIT_CLOSED:
+                open_circuits.append(state.origin)
+            elif state.rate < self.max_rate or state.blocked_until > now:
+                backed_off.append(state.origin)
+        return {
+            "domains": len(self.domains),
+            "open_circuits": len(open_circuits),
+            "backed_off_domains": len(backed_off),
+            "unavailable_domains": ",".join(sorted(open_circuits)[:SUMMARY_ORIGINS]),
+        }
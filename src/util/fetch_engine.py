@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+from playwright.async_api import Route
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from playwright_stealth import stealth_async
+
+from src.auth_config import auth_config
+from src.logger_config import setup_logger
+from src.util.browser_pool import BrowserPool
+from src.util.document import HTTP_TIER, RENDER_TIER, Document
+from src.util.html_matcher import MatchResult
+
+# Resources a page doesn't need to build its DOM, skipped when rendering
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+
+
+# Picks how to fetch each URL. Pages are fetched with plain HTTP until an xpath
+# matches nothing, then rendered in a pooled headless browser. Whichever tier
+# found more elements is remembered for the URL, so later ticks go straight to
+# it, until FETCH_TIER_TTL passes and the cheaper tier is tried again.
+class FetchEngine:
+    def __init__(self, browser_pool: BrowserPool):
+        self.logger = setup_logger(__name__)
+        self.browser_pool = browser_pool
+        self.enabled = auth_config.FETCH_RENDER_ENABLED
+        self.ttl = auth_config.FETCH_TIER_TTL
+        self.max_size = auth_config.FETCH_TIER_CACHE_MAX_SIZE
+        # URL -> (decided_at, tier), least recently used first
+        self.tiers: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    # The tier remembered for url, or None if it should be probed from HTTP up
+    def get_tier(self, url: str) -> Optional[str]:
+        entry = self.tiers.get(url)
+        if entry is None:
+            return None
+        if time.time() - entry[0] >= self.ttl:
+            del self.tiers[url]
+            return None
+
+        self.tiers.move_to_end(url)
+        return entry[1]
+
+    def remember(self, url: str, tier: str):
+        self.tiers[url] = (time.time(), tier)
+        self.tiers.move_to_end(url)
+        while len(self.tiers) > self.max_size:
+            self.tiers.popitem(last=False)
+
+    def forget(self, url: str):
+        self.tiers.pop(url, None)
+
+    # Escalate a URL probed over HTTP if any of its xpaths matched nothing
+    def should_render(self, url: str, results: Iterable[MatchResult]) -> bool:
+        if not self.enabled or self.get_tier(url) is not None:
+            return False
+        return count_missing(results) > 0
+
+    # Remember the rendered tier only if it found elements plain HTTP did not
+    def choose(
+        self,
+        url: str,
+        http_results: Iterable[MatchResult],
+        render_results: Iterable[MatchResult],
+    ) -> str:
+        missing_over_http = count_missing(http_results)
+        tier = RENDER_TIER
+        if count_missing(render_results) >= missing_over_http:
+            tier = HTTP_TIER
+        self.remember(url, tier)
+        self.logger.info(f"Using {tier} fetches for {url}")
+        return tier
+
+    # Load url in a headless browser, skipping images, fonts and media, and return
+    # the DOM once the page's network goes quiet
+    async def render(self, url: str) -> Tuple[Document, Optional[int]]:
+        async with self.browser_pool.new_page() as page:
+            await stealth_async(page)
+            await page.route("**/*", block_resources)
+
+            status = None
+            try:
+                response = await page.goto(
+                    url,
+                    wait_until="networkidle",
+                    timeout=auth_config.FETCH_RENDER_TIMEOUT * 1000,
+                )
+                status = response.status if response is not None else None
+            except PlaywrightTimeoutError:
+                # Pages that keep polling never go idle, use what has rendered
+                self.logger.info(f"{url} did not go idle, using the page as rendered")
+
+            return Document(page.url, await page.content(), tier=RENDER_TIER), status
+
+
+async def block_resources(route: Route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+def count_missing(results: Iterable[MatchResult]) -> int:
+    return sum(1 for result in results if result[0] == "web_element_not_found")
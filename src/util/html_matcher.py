@@ -0,0 +1,116 @@
+import re
+from functools import lru_cache
+from typing import List, Tuple
+
+from lxml import etree
+from pyquery.text import INLINE_TAGS, SEPARATORS, WHITESPACE_RE
+from requests_html import HTML
+
+from src.auth_config import auth_config
+from src.util.util import Utils
+
+# (status, status_detail, html_content) as returned by the scraper
+MatchResult = Tuple[str, str, str]
+
+# HTML whitespace as pyquery squashes it, which leaves non-breaking spaces alone
+WHITESPACE_PATTERN = WHITESPACE_RE
+SPACE_PATTERN = re.compile(r" {2,}")
+BLOCK_BOUNDARY_PATTERN = re.compile(r" *\n[\n ]*")
+
+
+# Compiled XPath expressions, bounded so arbitrary user input can't grow it forever
+@lru_cache(maxsize=auth_config.XPATH_CACHE_SIZE)
+def compile_xpath(xpath: str) -> etree.XPath:
+    return etree.XPath(xpath)
+
+
+# Text content of an element and all of its descendants in a single walk of the
+# subtree, with whitespace squashed and block elements separated by newlines
+def get_text_content(element) -> str:
+    parts = []
+    events = ("start", "end", "comment", "pi")
+    for event, node in etree.iterwalk(element, events=events):
+        is_block = event in ("start", "end") and (
+            node.tag in SEPARATORS or node.tag not in INLINE_TAGS
+        )
+        if is_block:
+            parts.append("\n")
+        if event == "start" and node.text:
+            parts.append(WHITESPACE_PATTERN.sub(" ", node.text))
+        elif event != "start" and node is not element and node.tail:
+            parts.append(WHITESPACE_PATTERN.sub(" ", node.tail))
+
+    text = SPACE_PATTERN.sub(" ", "".join(parts))
+    return BLOCK_BOUNDARY_PATTERN.sub("\n", text).strip()
+
+
+# Parse a page once and evaluate every (xpath, search_string) query against it.
+# Runs in a parser pool worker process, so it only takes and returns plain data.
+def evaluate_document(
+    text: str, url: str, queries: List[Tuple[str, str]]
+) -> List[MatchResult]:
+    root = HTML(url=url, html=text).lxml
+    results = []
+    for xpath, search_string in queries:
+        try:
+            results.append(match_element(root, url, xpath, search_string))
+        except etree.XPathError as e:
+            # A malformed xpath only fails the patrols that use it
+            results.append(
+                (
+                    "invalid_xpath",
+                    f"Could not evaluate xpath: {xpath} ({e})"
+                    f" Please double check the xpath.",
+                    "",
+                )
+            )
+    return results
+
+
+def match_element(root, url: str, xpath: str, search_string: str) -> MatchResult:
+    # Get base_url
+    base_url = Utils.get_baseurl_from(url)
+
+    # Select the elements, ignoring attribute, text and scalar results
+    selected = compile_xpath(xpath)(root)
+    if not isinstance(selected, list):
+        selected = []
+    elements = [element for element in selected if isinstance(element, etree._Element)]
+
+    if not elements:
+        return (
+            "web_element_not_found",
+            (
+                f"Could not find any web element from xpath: {xpath}"
+                f" Please double check the xpath."
+            ),
+            "",
+        )
+
+    # Multiple web elements found
+    if len(elements) > 1:
+        return (
+            "multiple_elements_found",
+            (
+                f"More than one web element found from xpath: {xpath}"
+                f" Please provide an xpath for a unique web element."
+            ),
+            "",
+        )
+
+    # One element found
+    element = elements[0]
+    # Check if string exists within the web element or any of its child elements
+    if search_string in get_text_content(element):
+        html = etree.tostring(element, encoding="unicode").strip()
+        return (
+            "found",
+            "Found string within the web element.",
+            html.replace('href="/', f'href="{base_url}/'),
+        )
+    else:
+        return (
+            "string_not_found",
+            "Did not find the string within the web element.",
+            "",
+        )
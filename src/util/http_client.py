@@ -0,0 +1,82 @@
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+from src.auth_config import auth_config
+from src.logger_config import setup_logger
+
+
+# The server answered with an error instead of the page
+class HttpStatusError(Exception):
+    def __init__(self, url: str, status: int):
+        super().__init__(f"{url} returned HTTP {status}")
+        self.url = url
+        self.status = status
+
+
+@dataclass
+class HttpResponse:
+    url: str
+    status: int
+    headers: Dict[str, str]
+    text: str
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+class HttpClient:
+    def __init__(self):
+        self.logger = setup_logger(__name__)
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        if self.session is not None and not self.session.closed:
+            return
+
+        # One keep-alive pool shared by every caller, capped globally and per host
+        connector = aiohttp.TCPConnector(
+            limit=auth_config.HTTP_MAX_CONNECTIONS,
+            limit_per_host=auth_config.HTTP_MAX_CONNECTIONS_PER_HOST,
+            keepalive_timeout=auth_config.HTTP_KEEPALIVE_TIMEOUT,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=auth_config.HTTP_TIMEOUT,
+            connect=auth_config.HTTP_CONNECT_TIMEOUT,
+        )
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self.logger.info("Started shared HTTP client")
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            self.logger.info("Closed shared HTTP client")
+        self.session = None
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> HttpResponse:
+        if self.session is None or self.session.closed:
+            await self.start()
+
+        async with self.session.request(method, url, **kwargs) as resp:  # type: ignore
+            text = await resp.text(errors="replace")
+            return HttpResponse(
+                url=str(resp.url),
+                status=resp.status,
+                headers={key.lower(): value for key, value in resp.headers.items()},
+                text=text,
+            )
+
+    async def get(
+        self, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> HttpResponse:
+        return await self.request("GET", url, headers=headers)
+
+    async def post(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        json: Optional[Any] = None,
+    ) -> HttpResponse:
+        return await self.request("POST", url, headers=headers, json=json)
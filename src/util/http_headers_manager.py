@@ -1,53 +1,146 @@
-from typing import Dict
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
 
-from playwright.async_api import Request, async_playwright
+from playwright.async_api import Request
 from playwright_stealth import stealth_async
 
+from src.auth_config import auth_config
+from src.logger_config import setup_logger
+from src.util import metrics
+from src.util.browser_pool import BrowserPool
+from src.util.util import Utils
+
 
 class HttpHeadersManager:
-    def __init__(self):
-        self.headers_dict: Dict[str, Dict[str, str]] = {}
+    def __init__(self, browser_pool: BrowserPool):
+        self.logger = setup_logger(__name__)
+        self.browser_pool = browser_pool
+        self.ttl = auth_config.HEADERS_CACHE_TTL
+        self.max_size = auth_config.HEADERS_CACHE_MAX_SIZE
+        self.cache_path = auth_config.HEADERS_CACHE_PATH
+
+        # Site origin -> (acquired_at, headers), least recently used first
+        self.headers_dict: "OrderedDict[str, Tuple[float, Dict[str, str]]]" = (
+            OrderedDict()
+        )
+        # Site origin -> in-flight acquisition shared by concurrent callers
+        self.pending: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        metrics.HEADER_CACHE_HIT_RATIO.set_function(self.get_hit_rate)
+
+        self.load()
 
     async def get_headers(self, url: str) -> Dict[str, str]:
+        origin = Utils.get_baseurl_from(url)
+
+        cached = self.headers_dict.get(origin)
+        if cached and time.time() - cached[0] < self.ttl:
+            self.hits += 1
+            metrics.HEADER_CACHE_REQUESTS.labels("hit").inc()
+            self.headers_dict.move_to_end(origin)
+            return cached[1]
+
+        self.misses += 1
+        metrics.HEADER_CACHE_REQUESTS.labels("miss").inc()
+        if origin not in self.pending:
+            self.pending[origin] = asyncio.ensure_future(self.acquire(origin, url))
+            self.pending[origin].add_done_callback(
+                lambda _: self.pending.pop(origin, None)
+            )
+
+        return await asyncio.shield(self.pending[origin])
+
+    def get_hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    # Drop the cached headers for the origin of url, e.g. after a 401/403 response
+    def invalidate(self, url: str):
+        origin = Utils.get_baseurl_from(url)
+        if self.headers_dict.pop(origin, None) is not None:
+            self.logger.info(f"Invalidated cached headers for {origin}")
+            self.save()
+
+    async def acquire(self, origin: str, url: str) -> Dict[str, str]:
+        headers: Dict[str, str] = {}
+
         def get_pw_headers(request: Request, url: str):
             if request.url == url:
-                self.headers = request.headers
-
-        if url not in self.headers_dict:
-            async with async_playwright() as p:
-                self.headers = {}
-                browser = await p.chromium.launch(headless=True)
-                context = await browser.new_context()
-
-                page = await context.new_page()
-                await stealth_async(page)
-
-                page.on(
-                    "request",
-                    lambda request: get_pw_headers(request, url),
-                )
-                await page.goto(url, wait_until="domcontentloaded", timeout=30000)
-
-                # list of common cookie acceptance texts
-                acceptance_texts = ["accept", "agree"]
-                buttons = await page.query_selector_all("button")
-
-                for button in buttons:
-                    for text in acceptance_texts:
-                        try:
-                            if text in (await button.inner_text()).lower():
-                                await button.click()
-                                break
-                        except Exception:
-                            # Catch any exception and keep running
-                            continue
-
-                pw_cookies = await context.cookies()
-                cookies_str = "; ".join(
-                    [f"{cookie['name']}={cookie['value']}" for cookie in pw_cookies]
-                )
-
-                self.headers["cookie"] = cookies_str
-                self.headers_dict[url] = self.headers
-
-        return self.headers_dict[url]
+                headers.update(request.headers)
+
+        async with self.browser_pool.new_page() as page:
+            await stealth_async(page)
+
+            page.on(
+                "request",
+                lambda request: get_pw_headers(request, url),
+            )
+            await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+
+            # list of common cookie acceptance texts
+            acceptance_texts = ["accept", "agree"]
+            buttons = await page.query_selector_all("button")
+
+            for button in buttons:
+                for text in acceptance_texts:
+                    try:
+                        if text in (await button.inner_text()).lower():
+                            await button.click()
+                            break
+                    except Exception:
+                        # Catch any exception and keep running
+                        continue
+
+            pw_cookies = await page.context.cookies()
+            cookies_str = "; ".join(
+                [f"{cookie['name']}={cookie['value']}" for cookie in pw_cookies]
+            )
+
+        headers["cookie"] = cookies_str
+        self.headers_dict[origin] = (time.time(), headers)
+        self.headers_dict.move_to_end(origin)
+        while len(self.headers_dict) > self.max_size:
+            self.headers_dict.popitem(last=False)
+
+        self.logger.info(f"Acquired headers for {origin}")
+        self.save()
+        return headers
+
+    def load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Could not load headers cache: {e}")
+            return
+
+        now = time.time()
+        for origin, (acquired_at, headers) in entries.items():
+            if now - acquired_at < self.ttl:
+                self.headers_dict[origin] = (acquired_at, headers)
+        while len(self.headers_dict) > self.max_size:
+            self.headers_dict.popitem(last=False)
+
+        self.logger.info(f"Loaded {len(self.headers_dict)} cached header set(s)")
+
+    def save(self):
+        if not self.cache_path:
+            return
+
+        # Write to a temporary file first so a crash can't leave a truncated cache,
+        # one per process as worker processes share the cache path
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.headers_dict, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            self.logger.warning(f"Could not save headers cache: {e}")
@@ -0,0 +1,139 @@
+import itertools
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+)
+from azure.data.tables import UpdateMode
+
+from src.storage_backend import StorageBackend
+
+LEASE_PARTITION_KEY = "lease"
+
+
+@dataclass
+class Lease:
+    name: str
+    owner: str
+    expires_at: float
+    # Version used for compare-and-swap, changes on every write
+    etag: Optional[str] = None
+
+    def is_expired(self, now: Optional[float] = None) -> bool:
+        return self.expires_at <= (time.time() if now is None else now)
+
+
+# Storage for named, expiring leases. Every write is conditional on the version
+# last read, so only one node can win a race to acquire or renew a lease.
+class LeaseBackend(ABC):
+    @abstractmethod
+    async def list_leases(self) -> List[Lease]:
+        ...
+
+    # Take or renew a lease. current is the lease as last read (None if it did
+    # not exist); returns the new lease, or None if someone else wrote it first.
+    @abstractmethod
+    async def acquire(
+        self, name: str, owner: str, duration: float, current: Optional[Lease]
+    ) -> Optional[Lease]:
+        ...
+
+    @abstractmethod
+    async def release(self, lease: Lease):
+        ...
+
+
+# Leases held in process memory, for a single host or local testing
+class InMemoryLeaseBackend(LeaseBackend):
+    def __init__(self):
+        self.leases: Dict[str, Lease] = {}
+        self.versions = itertools.count()
+
+    async def list_leases(self) -> List[Lease]:
+        return list(self.leases.values())
+
+    async def acquire(
+        self, name: str, owner: str, duration: float, current: Optional[Lease]
+    ) -> Optional[Lease]:
+        stored = self.leases.get(name)
+        stored_etag = stored.etag if stored else None
+        if stored_etag != (current.etag if current else None):
+            return None
+
+        lease = Lease(name, owner, time.time() + duration, str(next(self.versions)))
+        self.leases[name] = lease
+        return lease
+
+    async def release(self, lease: Lease):
+        stored = self.leases.get(lease.name)
+        if stored is not None and stored.etag == lease.etag:
+            del self.leases[lease.name]
+
+
+# Leases stored as rows of the PatrolLeases table, using ETags for concurrency
+class TableLeaseBackend(LeaseBackend):
+    def __init__(self, table_storage: StorageBackend):
+        self.table_storage = table_storage
+        self.table_client = table_storage.patrol_lease_table_client
+
+    async def list_leases(self) -> List[Lease]:
+        entities = await self.table_storage.query_entities(
+            self.table_client,
+            query_filter=f"PartitionKey eq '{LEASE_PARTITION_KEY}'",
+        )
+        return [
+            Lease(
+                entity["RowKey"],
+                entity["owner"],
+                entity["expires_at"],
+                entity.metadata["etag"],
+            )
+            for entity in entities
+        ]
+
+    async def acquire(
+        self, name: str, owner: str, duration: float, current: Optional[Lease]
+    ) -> Optional[Lease]:
+        expires_at = time.time() + duration
+        entity = {
+            "PartitionKey": LEASE_PARTITION_KEY,
+            "RowKey": name,
+            "owner": owner,
+            "expires_at": expires_at,
+        }
+
+        try:
+            if current is None:
+                metadata = await self.table_storage.create_entity(
+                    self.table_client, entity
+                )
+            else:
+                metadata = await self.table_storage.update_entity(
+                    self.table_client,
+                    mode=UpdateMode.REPLACE,
+                    entity=entity,
+                    etag=current.etag,
+                    match_condition=MatchConditions.IfNotModified,
+                )
+        except (ResourceExistsError, ResourceModifiedError, ResourceNotFoundError):
+            return None
+
+        return Lease(name, owner, expires_at, metadata["etag"])
+
+    async def release(self, lease: Lease):
+        try:
+            await self.table_storage.delete_entity(
+                self.table_client,
+                LEASE_PARTITION_KEY,
+                lease.name,
+                etag=lease.etag,
+                match_condition=MatchConditions.IfNotModified,
+            )
+        except (ResourceModifiedError, ResourceNotFoundError):
+            pass
@@ -0,0 +1,76 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Latency buckets from a cached lookup up to a slow page render
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TICK_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Time spent in each stage of a scrape: headers, fetch, parse, storage, history, push
+PHASE_SECONDS = Histogram(
+    "page_patrol_phase_seconds",
+    "Time spent per scrape pipeline phase",
+    ["phase"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Outcome of every scheduled patrol, by scrape status or failure kind
+SCRAPES = Counter("page_patrol_scrapes_total", "Scheduled patrol outcomes", ["status"])
+
+TICK_SECONDS = Histogram(
+    "page_patrol_tick_seconds",
+    "Duration of a scheduler tick, from reading due patrols to saving results",
+    buckets=TICK_BUCKETS,
+)
+
+# Page downloads by fetch tier, plain HTTP or headless render
+FETCHES = Counter("page_patrol_fetches_total", "Page fetches by tier", ["tier"])
+
+# How late patrols are started compared to when they were due
+SCHEDULE_LAG_SECONDS = Histogram(
+    "page_patrol_schedule_lag_seconds",
+    "Delay between a patrol's due time and its start",
+    buckets=LATENCY_BUCKETS,
+)
+
+SCHEDULED_PATROLS = Gauge(
+    "page_patrol_scheduled_patrols", "Patrols on this node's schedule"
+)
+
+HEADER_CACHE_REQUESTS = Counter(
+    "page_patrol_header_cache_requests_total",
+    "Header cache lookups by result",
+    ["result"],
+)
+
+HEADER_CACHE_HIT_RATIO = Gauge(
+    "page_patrol_header_cache_hit_ratio",
+    "Share of header lookups served from the cache since start",
+)
+
+DOCUMENT_CACHE_REQUESTS = Counter(
+    "page_patrol_document_cache_requests_total",
+    "Document cache lookups by result",
+    ["result"],
+)
+
+STORAGE_SECONDS = Histogram(
+    "page_patrol_storage_seconds",
+    "Table storage call latency",
+    ["table", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+
+STORAGE_ERRORS = Counter(
+    "page_patrol_storage_errors_total",
+    "Failed table storage calls",
+    ["table", "operation"],
+)
+
+PUSH_NOTIFICATIONS = Counter(
+    "page_patrol_push_notifications_total",
+    "Push notifications by outcome",
+    ["result"],
+)
+
+PUSH_QUEUE_SIZE = Gauge(
+    "page_patrol_push_queue_size", "Push notifications waiting to be sent"
+)
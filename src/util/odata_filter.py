@@ -0,0 +1,183 @@
+import operator
+import re
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, List, Mapping, Optional, Tuple
+
+# The subset of the Azure Tables OData $filter grammar used by this app:
+# comparisons joined with and/or/not and parentheses, against string, bool,
+# number, datetime'...' and guid'...' literals
+TOKEN_PATTERN = re.compile(
+    r"\s*(?:"
+    r"(?P<paren>[()])"
+    r"|(?P<typed>(?:datetime|guid|X|binary)'(?:[^']|'')*')"
+    r"|(?P<string>'(?:[^']|'')*')"
+    r"|(?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?L?)"
+    r"|(?P<word>[A-Za-z_][A-Za-z0-9_]*)"
+    r")"
+)
+
+COMPARISONS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "gt": operator.gt,
+    "ge": operator.ge,
+    "lt": operator.lt,
+    "le": operator.le,
+}
+
+Predicate = Callable[[Mapping[str, Any]], bool]
+Node = Tuple
+
+
+class FilterSyntaxError(ValueError):
+    pass
+
+
+def tokenize(query_filter: str) -> List[Tuple[str, str]]:
+    tokens = []
+    position = 0
+    query_filter = query_filter.rstrip()
+    while position < len(query_filter):
+        match = TOKEN_PATTERN.match(query_filter, position)
+        if match is None or match.end() == position:
+            raise FilterSyntaxError(
+                f"Unexpected input at {position} in filter: {query_filter}"
+            )
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        position = match.end()
+    return tokens
+
+
+def parse_literal(kind: str, value: str) -> Any:
+    if kind == "string":
+        return value[1:-1].replace("''", "'")
+    if kind == "number":
+        value = value.rstrip("L")
+        return float(value) if any(c in value for c in ".eE") else int(value)
+
+    prefix, _, quoted = value.partition("'")
+    text = quoted[:-1].replace("''", "'")
+    if prefix == "datetime":
+        return datetime.fromisoformat(text.replace("Z", "+00:00"))
+    if prefix == "guid":
+        return str(uuid.UUID(text))
+    return bytes.fromhex(text)
+
+
+# Parse a filter into a tree of ("or", nodes), ("and", nodes), ("not", node) and
+# ("compare", property, op, literal) tuples; None for an empty filter
+@lru_cache(maxsize=256)
+def parse_filter(query_filter: str) -> Optional[Node]:
+    if not query_filter or not query_filter.strip():
+        return None
+
+    parser = FilterParser(tokenize(query_filter), query_filter)
+    node = parser.parse_or()
+    if parser.position != len(parser.tokens):
+        raise FilterSyntaxError(f"Unexpected trailing input in filter: {query_filter}")
+    return node
+
+
+# Compile a filter into a predicate over entities; an entity missing a compared
+# property never matches, as in Azure Tables
+@lru_cache(maxsize=256)
+def compile_filter(query_filter: str) -> Predicate:
+    node = parse_filter(query_filter)
+    if node is None:
+        return lambda entity: True
+    return build_predicate(node)
+
+
+def build_predicate(node: Node) -> Predicate:
+    kind = node[0]
+    if kind == "or":
+        predicates = [build_predicate(child) for child in node[1]]
+        return lambda entity: any(predicate(entity) for predicate in predicates)
+    if kind == "and":
+        predicates = [build_predicate(child) for child in node[1]]
+        return lambda entity: all(predicate(entity) for predicate in predicates)
+    if kind == "not":
+        predicate = build_predicate(node[1])
+        return lambda entity: not predicate(entity)
+
+    _, name, op, literal = node
+    compare = COMPARISONS[op]
+
+    def compare_property(entity: Mapping[str, Any]) -> bool:
+        value = entity.get(name)
+        if value is None:
+            return False
+        try:
+            return compare(value, literal)
+        except TypeError:
+            # Mismatched types, e.g. a string compared to a number
+            return False
+
+    return compare_property
+
+
+class FilterParser:
+    def __init__(self, tokens: List[Tuple[str, str]], query_filter: str):
+        self.tokens = tokens
+        self.query_filter = query_filter
+        self.position = 0
+
+    def peek(self) -> Tuple[str, str]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return ("end", "")
+
+    def take(self) -> Tuple[str, str]:
+        token = self.peek()
+        if token[0] == "end":
+            raise FilterSyntaxError(f"Unexpected end of filter: {self.query_filter}")
+        self.position += 1
+        return token
+
+    def parse_or(self) -> Node:
+        nodes = [self.parse_and()]
+        while self.peek() == ("word", "or"):
+            self.take()
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", tuple(nodes))
+
+    def parse_and(self) -> Node:
+        nodes = [self.parse_not()]
+        while self.peek() == ("word", "and"):
+            self.take()
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else ("and", tuple(nodes))
+
+    def parse_not(self) -> Node:
+        if self.peek() == ("word", "not"):
+            self.take()
+            return ("not", self.parse_not())
+        return self.parse_primary()
+
+    def parse_primary(self) -> Node:
+        if self.peek() == ("paren", "("):
+            self.take()
+            node = self.parse_or()
+            if self.take() != ("paren", ")"):
+                raise FilterSyntaxError(f"Expected ')' in filter: {self.query_filter}")
+            return node
+
+        kind, name = self.take()
+        _, op = self.take()
+        if kind != "word" or op not in COMPARISONS:
+            raise FilterSyntaxError(
+                f"Expected '<property> <op> <value>' in filter: {self.query_filter}"
+            )
+
+        kind, value = self.take()
+        if kind == "word" and value in ("true", "false"):
+            literal = value == "true"
+        elif kind in ("string", "number", "typed"):
+            literal = parse_literal(kind, value)
+        else:
+            raise FilterSyntaxError(
+                f"Unsupported value {value!r} in filter: {self.query_filter}"
+            )
+        return ("compare", name, op, literal)
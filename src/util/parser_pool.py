@@ -0,0 +1,88 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, List, Optional, Tuple
+
+from src.auth_config import auth_config
+from src.logger_config import setup_logger
+from src.util.html_matcher import MatchResult, evaluate_document
+
+
+class ParserPool:
+    def __init__(self):
+        self.logger = setup_logger(__name__)
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        # A pool size of 0 evaluates inline on the event loop, e.g. for debugging
+        if self.executor is not None or auth_config.PARSER_POOL_SIZE == 0:
+            return
+
+        # Spawn rather than fork so workers don't inherit the loop, sockets or browser
+        self.executor = ProcessPoolExecutor(
+            max_workers=auth_config.PARSER_POOL_SIZE,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        pool_size = auth_config.PARSER_POOL_SIZE or os.cpu_count()
+        self.logger.info(f"Started parser pool with {pool_size} worker(s)")
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            self.logger.info("Closed parser pool")
+
+    async def evaluate(
+        self, text: str, url: str, queries: List[Tuple[str, str]]
+    ) -> List[MatchResult]:
+        return await self.run(evaluate_document, text, url, queries)
+
+    # Run a CPU-bound, module-level function in a worker process, with plain data
+    # arguments and result
+    async def run(self, func: Callable, *args) -> Any:
+        if self.executor is None and auth_config.PARSER_POOL_SIZE != 0:
+            self.start()
+
+        if self.executor is None:
+            return func(*args)
+
+        try:
+            return await self.submit(func, *args)
+        except BrokenProcessPool:
+            # Another task's worker died or got stuck, and the pool was replaced
+            return await self.submit(func, *args)
+
+    async def submit(self, func: Callable, *args) -> Any:
+        executor = self.executor
+        try:
+            return await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(executor, func, *args),
+                timeout=auth_config.PARSER_TASK_TIMEOUT,
+            )
+        except BrokenProcessPool:
+            # A worker was OOM-killed or crashed in lxml, which breaks every task
+            # sent to the pool from then on
+            self.restart(executor, "a worker process died")
+            raise
+        except asyncio.TimeoutError:
+            self.restart(
+                executor,
+                f"a task ran for over {auth_config.PARSER_TASK_TIMEOUT}s",
+            )
+            raise
+
+    # Replace a broken or stuck pool with a new one, unless another task already did
+    def restart(self, executor: ProcessPoolExecutor, reason: str):
+        if self.executor is not executor:
+            return
+
+        self.logger.warning(f"Restarting parser pool, {reason}")
+        # Shutting down doesn't stop a worker stuck in lxml, so terminate them all.
+        # Their other tasks fail with BrokenProcessPool and are retried.
+        for process in list(executor._processes.values()):
+            process.terminate()
+        executor.shutdown(wait=False)
+        self.executor = None
+        self.start()
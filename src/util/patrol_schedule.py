@@ -0,0 +1,216 @@
+import asyncio
+import heapq
+import itertools
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from src.auth_config import auth_config
+from src.util import metrics
+
+# (PartitionKey, RowKey) of a PagePatrol entity
+PatrolKey = Tuple[str, str]
+
+
+# Stable offset of a URL's patrols within their interval, so URLs sharing an
+# interval are spread evenly over it instead of running in phase, while patrols
+# on the same URL stay in phase and share a fetch. Each scrape interval divides
+# the longer ones, so a URL's slots for a longer interval fall on its slots for
+# every shorter one too.
+def get_offset(url: str, interval: float) -> float:
+    return zlib.crc32(url.encode("utf-8")) % interval
+
+
+class PatrolSchedule:
+    def __init__(
+        self,
+        key_filter: Optional[Callable[[PatrolKey], bool]] = None,
+        max_starts_per_second: Optional[float] = None,
+    ):
+        # Only patrols accepted by the filter are scheduled, e.g. those in the
+        # shards this node holds
+        self.key_filter = key_filter
+        self.spread = auth_config.SCHEDULE_SPREAD
+        self.drain_window = auth_config.SCHEDULE_DRAIN_WINDOW
+        # Token bucket bounding how many URL groups, and so page fetches, start per
+        # second, 0 for no limit
+        if max_starts_per_second is None:
+            max_starts_per_second = auth_config.SCHEDULE_MAX_STARTS_PER_SECOND
+        self.max_starts_per_second = max_starts_per_second
+        self.burst = max(1.0, max_starts_per_second)
+        self.tokens = self.burst
+        self.tokens_updated = time.time()
+        # Min-heap of (due_time, version, key); superseded entries are skipped lazily
+        self.heap: List[Tuple[float, int, PatrolKey]] = []
+        self.entries: Dict[PatrolKey, Tuple[float, int]] = {}
+        # URL each patrol watches, for patrols scheduled with one
+        self.urls: Dict[PatrolKey, str] = {}
+        self.in_flight: Set[PatrolKey] = set()
+        self.counter = itertools.count()
+        self.wakeup: Optional[asyncio.Event] = None
+
+    def __len__(self) -> int:
+        return len(self.entries) + len(self.in_flight)
+
+    def __contains__(self, key: PatrolKey) -> bool:
+        return key in self.entries or key in self.in_flight
+
+    def accepts(self, key: PatrolKey) -> bool:
+        return self.key_filter is None or self.key_filter(key)
+
+    @staticmethod
+    def get_key(entity) -> PatrolKey:
+        return (entity["PartitionKey"], entity["RowKey"])
+
+    # Next due time of a patrol from its last scrape time and scrape interval.
+    # Patrols never scraped are due straight away.
+    def get_due_time(self, entity) -> float:
+        last_scrape_time = entity.get("last_scrape_time", None)
+        if not last_scrape_time:
+            return time.time()
+        return self.get_next_run(
+            entity["url"], entity["scrape_interval"], last_scrape_time.timestamp()
+        )
+
+    # When a patrol on url run at last_run is next due. With spreading, that is
+    # the URL's next slot at least half an interval on, so a late run doesn't
+    # push it out of its slot while an out of phase patrol moves into it.
+    def get_next_run(self, url: str, scrape_interval: float, last_run: float) -> float:
+        interval = scrape_interval * 60
+        if not self.spread:
+            return last_run + interval
+
+        earliest = last_run + interval / 2
+        return earliest + (get_offset(url, interval) - earliest) % interval
+
+    def seed(self, entities):
+        for entity in entities:
+            self.schedule_entity(entity)
+
+    def schedule_entity(self, entity):
+        if not entity.get("is_enabled", True) or entity.get("is_deleted", False):
+            self.remove(self.get_key(entity))
+            return
+        self.schedule(
+            self.get_key(entity), self.get_due_time(entity), entity.get("url")
+        )
+
+    def schedule(self, key: PatrolKey, due_time: float, url: Optional[str] = None):
+        if not self.accepts(key):
+            self.remove(key)
+            return
+
+        if url is not None:
+            self.urls[key] = url
+
+        version = next(self.counter)
+        self.entries[key] = (due_time, version)
+        heapq.heappush(self.heap, (due_time, version, key))
+
+        # Wake the scheduler loop if this patrol is now the earliest one due
+        if self.wakeup is not None and self.heap[0][2] == key:
+            self.wakeup.set()
+
+    def remove(self, key: PatrolKey):
+        self.entries.pop(key, None)
+        self.in_flight.discard(key)
+        self.urls.pop(key, None)
+
+    # Drop scheduled patrols the filter no longer accepts
+    def prune(self):
+        for key in [key for key in self.entries if not self.accepts(key)]:
+            self.remove(key)
+
+    # Reschedule a patrol once it has been processed, unless it was removed or
+    # rescheduled by the API while it was running
+    def complete(self, key: PatrolKey, due_time: float):
+        if key not in self.in_flight:
+            return
+        self.in_flight.discard(key)
+        if key not in self.entries:
+            self.schedule(key, due_time)
+
+    def _discard_stale(self):
+        while self.heap:
+            due_time, version, key = self.heap[0]
+            if self.entries.get(key) == (due_time, version):
+                return
+            heapq.heappop(self.heap)
+
+    def next_due_time(self) -> Optional[float]:
+        self._discard_stale()
+        return self.heap[0][0] if self.heap else None
+
+    # Start tokens available at now, refilled at max_starts_per_second
+    def refill(self, now: float) -> float:
+        elapsed = max(now - self.tokens_updated, 0.0)
+        self.tokens = min(
+            self.burst, self.tokens + elapsed * self.max_starts_per_second
+        )
+        self.tokens_updated = now
+        return self.tokens
+
+    # When the earliest due patrol may start, allowing for the start rate limit
+    def next_start_time(self, now: Optional[float] = None) -> Optional[float]:
+        next_due_time = self.next_due_time()
+        if next_due_time is None or not self.max_starts_per_second:
+            return next_due_time
+
+        now = time.time() if now is None else now
+        tokens = self.refill(now)
+        if tokens >= 1:
+            return next_due_time
+        return max(next_due_time, now + (1 - tokens) / self.max_starts_per_second)
+
+    # Pop the patrols due at or before now, and those due within the drain window
+    # after it, and mark them in flight. With a start rate limit, each URL group
+    # takes one token, and the rest stay due and are popped as tokens come back.
+    def pop_due(self, now: Optional[float] = None) -> List[PatrolKey]:
+        now = time.time() if now is None else now
+        limit = None
+        if self.max_starts_per_second:
+            limit = int(self.refill(now))
+
+        due_keys = []
+        groups = set()
+        while True:
+            next_due_time = self.next_due_time()
+            if next_due_time is None or next_due_time > now + self.drain_window:
+                break
+
+            key = self.heap[0][2]
+            group = self.urls.get(key, key)
+            if limit is not None and group not in groups and len(groups) >= limit:
+                break
+
+            due_time, _, key = heapq.heappop(self.heap)
+            del self.entries[key]
+            if self.accepts(key):
+                metrics.SCHEDULE_LAG_SECONDS.observe(max(now - due_time, 0.0))
+                self.in_flight.add(key)
+                due_keys.append(key)
+                groups.add(group)
+            else:
+                self.urls.pop(key, None)
+
+        if limit is not None:
+            self.tokens -= len(groups)
+        return due_keys
+
+    # Sleep until the earliest patrol is due and may start, waking early if an
+    # earlier one is added
+    async def wait_until_due(self):
+        if self.wakeup is None:
+            self.wakeup = asyncio.Event()
+
+        while True:
+            self.wakeup.clear()
+            next_start_time = self.next_start_time()
+            if next_start_time is not None and next_start_time <= time.time():
+                return
+
+            timeout = None if next_start_time is None else next_start_time - time.time()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,282 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from src.auth_config import auth_config
+from src.logger_config import setup_logger
+from src.util import metrics
+from src.util.http_client import HttpClient, HttpResponse
+
+# Expo accepts at most 100 messages per send and 1000 ids per receipt request
+MAX_MESSAGES_PER_REQUEST = 100
+MAX_RECEIPTS_PER_REQUEST = 1000
+# Expo keeps receipts for a day, stop asking for them after that
+RECEIPT_MAX_AGE = 24 * 60 * 60
+
+# Ticket and receipt errors that mean the token should no longer be used
+INVALID_TOKEN_ERRORS = {"DeviceNotRegistered"}
+# Ticket errors worth sending the message again for
+RETRYABLE_TICKET_ERRORS = {"MessageRateExceeded"}
+
+
+@dataclass
+class PushMessage:
+    to: str
+    title: str
+    body: str
+
+    def to_json(self) -> Dict[str, str]:
+        return {"to": self.to, "title": self.title, "body": self.body}
+
+
+class PushNotificationDispatcher:
+    def __init__(
+        self,
+        http_client: HttpClient,
+        on_invalid_token: Optional[Callable[[str], Awaitable[None]]] = None,
+    ):
+        self.logger = setup_logger(__name__)
+        self.http_client = http_client
+        self.on_invalid_token = on_invalid_token
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        # Ticket id -> (sent_at, push token), waiting for its receipt
+        self.pending_receipts: Dict[str, Tuple[float, str]] = {}
+        # Accepted by Expo; those whose receipt later reports an error are also
+        # counted as undelivered, while failed ones were never accepted
+        self.sent = 0
+        self.failed = 0
+        self.undelivered = 0
+        self.dropped = 0
+        self.invalid_tokens = 0
+        metrics.PUSH_QUEUE_SIZE.set_function(self.get_queue_size)
+
+    async def start(self):
+        if self.tasks:
+            return
+
+        self.queue = asyncio.Queue(maxsize=auth_config.PUSH_QUEUE_MAX_SIZE)
+        self.tasks = [
+            asyncio.create_task(self.run_sender()),
+            asyncio.create_task(self.run_receipt_checker()),
+        ]
+        self.logger.info("Started push notification dispatcher")
+
+    # Give queued messages a moment to go out, then stop the background tasks
+    async def close(self, timeout: float = 5.0):
+        if not self.tasks:
+            return
+
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(
+                f"Dropping {self.queue.qsize()} queued push notification(s) on shutdown"
+            )
+
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.logger.info("Closed push notification dispatcher")
+
+    # Queue a notification without waiting for it to be delivered
+    def enqueue(self, expo_push_token: Optional[str], title: str, body: str):
+        if not expo_push_token:
+            return
+
+        if self.queue is None:
+            self.logger.warning("Push notification dispatcher is not started")
+            self.count("dropped")
+            return
+
+        try:
+            self.queue.put_nowait(PushMessage(expo_push_token, title, body))
+        except asyncio.QueueFull:
+            self.count("dropped")
+            self.logger.warning("Push notification queue is full, dropping message")
+
+    def get_queue_size(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+
+    # Bump one of the sent/failed/undelivered/dropped/invalid_tokens counters and
+    # its metric
+    def count(self, result: str, amount: int = 1):
+        setattr(self, result, getattr(self, result) + amount)
+        metrics.PUSH_NOTIFICATIONS.labels(result).inc(amount)
+
+    def get_headers(self) -> Dict[str, str]:
+        return {
+            "accept": "application/json",
+            "accept-encoding": "gzip, deflate",
+            "content-type": "application/json",
+            "authorization": f"Bearer {auth_config.EXPO_TOKEN}",
+        }
+
+    # Collect up to a full batch, waiting briefly for more after the first message
+    async def next_batch(self) -> List[PushMessage]:
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + auth_config.PUSH_BATCH_LINGER
+        while len(batch) < MAX_MESSAGES_PER_REQUEST:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run_sender(self):
+        while True:
+            batch = await self.next_batch()
+            try:
+                await self.send_batch(batch)
+            except Exception as e:
+                self.count("failed", len(batch))
+                self.logger.error(f"Failed to send push notifications: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def send_batch(self, messages: List[PushMessage]):
+        for attempt in range(auth_config.PUSH_MAX_RETRIES + 1):
+            if attempt:
+                await self.backoff(attempt)
+
+            try:
+                with metrics.PHASE_SECONDS.labels("push").time():
+                    resp = await self.http_client.post(
+                        auth_config.EXPO_PUSH_URL,
+                        headers=self.get_headers(),
+                        json=[message.to_json() for message in messages],
+                    )
+            except Exception as e:
+                self.logger.warning(f"Push request failed (attempt {attempt + 1}): {e}")
+                continue
+
+            # Rate limited or server side error, retry the whole batch
+            if resp.status == 429 or resp.status >= 500:
+                self.logger.warning(
+                    f"Push request returned {resp.status} (attempt {attempt + 1})"
+                )
+                continue
+
+            if resp.status != 200:
+                self.count("failed", len(messages))
+                self.logger.error(
+                    f"Push request rejected with status {resp.status}: {resp.text}"
+                )
+                return
+
+            messages = await self.handle_tickets(messages, resp)
+            if not messages:
+                return
+
+        self.count("failed", len(messages))
+        self.logger.error(
+            f"Giving up on {len(messages)} push notification(s) after "
+            f"{auth_config.PUSH_MAX_RETRIES} retries"
+        )
+
+    # Record ticket ids for receipt checks, returning the messages to send again
+    async def handle_tickets(
+        self, messages: List[PushMessage], resp: HttpResponse
+    ) -> List[PushMessage]:
+        tickets = resp.json().get("data", [])
+        if len(tickets) != len(messages):
+            self.logger.error(
+                f"Expected {len(messages)} push tickets, got {len(tickets)}: {resp.text}"
+            )
+            self.count("failed", len(messages))
+            return []
+
+        now = time.time()
+        retry = []
+        for message, ticket in zip(messages, tickets):
+            if ticket.get("status") == "ok":
+                self.count("sent")
+                if ticket.get("id"):
+                    self.pending_receipts[ticket["id"]] = (now, message.to)
+                continue
+
+            error = ticket.get("details", {}).get("error")
+            if error in RETRYABLE_TICKET_ERRORS:
+                retry.append(message)
+            elif error in INVALID_TOKEN_ERRORS:
+                self.count("failed")
+                await self.drop_token(message.to)
+            else:
+                self.count("failed")
+                self.logger.error(
+                    f"Push notification failed: {ticket.get('message', error)}"
+                )
+        return retry
+
+    async def run_receipt_checker(self):
+        while True:
+            await asyncio.sleep(auth_config.PUSH_RECEIPT_DELAY)
+            try:
+                await self.check_receipts()
+            except Exception as e:
+                self.logger.error(f"Failed to check push receipts: {e}")
+
+    async def check_receipts(self, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        due_ids = [
+            ticket_id
+            for ticket_id, (sent_at, _) in self.pending_receipts.items()
+            if now - sent_at >= auth_config.PUSH_RECEIPT_DELAY
+        ]
+
+        for start in range(0, len(due_ids), MAX_RECEIPTS_PER_REQUEST):
+            ids = due_ids[start : start + MAX_RECEIPTS_PER_REQUEST]
+            resp = await self.http_client.post(
+                auth_config.EXPO_RECEIPTS_URL,
+                headers=self.get_headers(),
+                json={"ids": ids},
+            )
+            if resp.status != 200:
+                self.logger.warning(f"Push receipt request returned {resp.status}")
+                continue
+
+            receipts = resp.json().get("data", {})
+            for ticket_id in ids:
+                receipt = receipts.get(ticket_id)
+                if receipt is None:
+                    # Not ready yet, ask again next time unless it has expired
+                    sent_at, _ = self.pending_receipts[ticket_id]
+                    if now - sent_at > RECEIPT_MAX_AGE:
+                        del self.pending_receipts[ticket_id]
+                    continue
+
+                _, token = self.pending_receipts.pop(ticket_id)
+                if receipt.get("status") == "ok":
+                    continue
+
+                error = receipt.get("details", {}).get("error")
+                self.count("undelivered")
+                if error in INVALID_TOKEN_ERRORS:
+                    await self.drop_token(token)
+                else:
+                    self.logger.error(
+                        f"Push notification was not delivered: "
+                        f"{receipt.get('message', error)}"
+                    )
+
+    async def drop_token(self, expo_push_token: str):
+        self.count("invalid_tokens")
+        self.logger.info(f"Dropping invalid push token {expo_push_token}")
+        if self.on_invalid_token is None:
+            return
+
+        try:
+            await self.on_invalid_token(expo_push_token)
+        except Exception as e:
+            self.logger.error(f"Failed to drop invalid push token: {e}")
+
+    async def backoff(self, attempt: int):
+        delay = auth_config.PUSH_RETRY_BACKOFF * 2 ** (attempt - 1)
+        await asyncio.sleep(delay * random.uniform(0.5, 1.5))
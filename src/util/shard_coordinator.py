@@ -0,0 +1,144 @@
+import math
+import os
+import random
+import socket
+import time
+import uuid
+import zlib
+from typing import Dict, Optional, Set, Tuple
+
+from src.auth_config import auth_config
+from src.logger_config import setup_logger
+from src.util.lease_backend import Lease, LeaseBackend
+from src.util.patrol_schedule import PatrolKey
+
+NODE_LEASE_PREFIX = "node:"
+SHARD_LEASE_PREFIX = "shard:"
+# Node leases expired for this many lease durations are deleted
+DEAD_NODE_RETENTION = 10
+
+
+# Stable shard of a patrol, the same on every node and across restarts
+def get_shard(row_key: str, shard_count: int) -> int:
+    return zlib.crc32(row_key.encode("utf-8")) % shard_count
+
+
+# Splits patrols between replicas: each node heartbeats a node lease and holds
+# leases on roughly an equal share of the shards, only scraping patrols in them
+class ShardCoordinator:
+    def __init__(self, lease_backend: LeaseBackend, node_id: Optional[str] = None):
+        self.logger = setup_logger(__name__)
+        self.lease_backend = lease_backend
+        self.shard_count = auth_config.SHARD_COUNT
+        self.lease_duration = auth_config.LEASE_DURATION
+        self.node_id = node_id or auth_config.NODE_ID or self.get_default_node_id()
+        # Shard -> lease held by this node
+        self.leases: Dict[int, Lease] = {}
+        self.node_lease: Optional[Lease] = None
+        self.live_nodes = 0
+
+    async def start(self):
+        await self.rebalance()
+
+    # Hand every shard back so other nodes can pick them up straight away
+    async def close(self):
+        for lease in [*self.leases.values(), self.node_lease]:
+            if lease is not None:
+                await self.lease_backend.release(lease)
+        self.leases = {}
+        self.node_lease = None
+        self.logger.info(f"Node {self.node_id} released its shards")
+
+    def owns(self, key: PatrolKey) -> bool:
+        lease = self.leases.get(get_shard(key[1], self.shard_count))
+        return lease is not None and not lease.is_expired()
+
+    # Heartbeat, renew held shards, then shed or claim shards towards a fair share.
+    # Returns the shards gained and lost since the last call.
+    async def rebalance(self) -> Tuple[Set[int], Set[int]]:
+        before = set(self.leases)
+        now = time.time()
+        current = {
+            lease.name: lease for lease in await self.lease_backend.list_leases()
+        }
+
+        node_name = f"{NODE_LEASE_PREFIX}{self.node_id}"
+        self.node_lease = await self.renew(node_name, current.get(node_name))
+
+        live_nodes = {
+            lease.owner
+            for lease in current.values()
+            if lease.name.startswith(NODE_LEASE_PREFIX) and not lease.is_expired(now)
+        }
+        live_nodes.add(self.node_id)
+        self.live_nodes = len(live_nodes)
+        target = math.ceil(self.shard_count / len(live_nodes))
+
+        # Renew held shards, dropping any that were taken over after expiring
+        for shard in list(self.leases):
+            lease = await self.renew(
+                self.get_shard_name(shard), current.get(self.get_shard_name(shard))
+            )
+            if lease is None:
+                del self.leases[shard]
+            else:
+                self.leases[shard] = lease
+
+        # More nodes joined, give the surplus back for them to claim
+        while len(self.leases) > target:
+            await self.lease_backend.release(self.leases.pop(max(self.leases)))
+
+        # Claim unowned or expired shards, e.g. after a node left or died
+        if len(self.leases) < target:
+            free_shards = [
+                shard
+                for shard in range(self.shard_count)
+                if self.is_free(current.get(self.get_shard_name(shard)), now)
+            ]
+            random.shuffle(free_shards)
+            for shard in free_shards:
+                if len(self.leases) >= target:
+                    break
+                name = self.get_shard_name(shard)
+                lease = await self.lease_backend.acquire(
+                    name, self.node_id, self.lease_duration, current.get(name)
+                )
+                if lease is not None:
+                    self.leases[shard] = lease
+
+        # Forget nodes that have been gone for a while
+        for lease in current.values():
+            expired_for = now - lease.expires_at
+            if lease.name.startswith(NODE_LEASE_PREFIX):
+                if expired_for > DEAD_NODE_RETENTION * self.lease_duration:
+                    await self.lease_backend.release(lease)
+
+        gained, lost = set(self.leases) - before, before - set(self.leases)
+        if gained or lost:
+            self.logger.info(
+                f"Node {self.node_id} holds {len(self.leases)}/{self.shard_count} "
+                f"shard(s) with {len(live_nodes)} live node(s), "
+                f"gained {len(gained)}, lost {len(lost)}"
+            )
+        return gained, lost
+
+    # Extend a lease this node holds, or take it if it is missing or expired
+    async def renew(self, name: str, current: Optional[Lease]) -> Optional[Lease]:
+        if current is not None and current.owner != self.node_id:
+            if not current.is_expired():
+                return None
+        return await self.lease_backend.acquire(
+            name, self.node_id, self.lease_duration, current
+        )
+
+    @staticmethod
+    def get_default_node_id() -> str:
+        return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    @staticmethod
+    def is_free(lease: Optional[Lease], now: float) -> bool:
+        return lease is None or lease.is_expired(now)
+
+    @staticmethod
+    def get_shard_name(shard: int) -> str:
+        return f"{SHARD_LEASE_PREFIX}{shard}"
@@ -0,0 +1,68 @@
+import json
+import re
+import zlib
+from difflib import SequenceMatcher
+from typing import List, Optional, Tuple, Union
+
+# Stored encodings of a PatrolHistory snapshot
+RAW = "raw"
+KEYFRAME = "zlib"
+DELTA = "zlib-delta"
+
+# Split HTML after every tag so diffs line up on element boundaries even when the
+# whole fragment is serialised on one line
+TOKEN_PATTERN = re.compile(r"(?<=>)")
+
+
+def tokenize(html: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.split(html) if token]
+
+
+def encode_keyframe(html: str) -> bytes:
+    return zlib.compress(html.encode("utf-8"), 9)
+
+
+# Delta ops are [start, end] to copy base tokens, or a string to insert
+def encode_delta(base_html: str, html: str) -> bytes:
+    base_tokens = tokenize(base_html)
+    tokens = tokenize(html)
+
+    ops: List[Union[List[int], str]] = []
+    matcher = SequenceMatcher(None, base_tokens, tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(tokens[j1:j2]))
+
+    return zlib.compress(json.dumps(ops, separators=(",", ":")).encode("utf-8"), 9)
+
+
+# Smallest encoding of html: a delta against base_html if given and smaller than
+# a keyframe, else a keyframe. Returns (encoding, content).
+def encode(html: str, base_html: Optional[str] = None) -> Tuple[str, bytes]:
+    keyframe = encode_keyframe(html)
+    if base_html is not None:
+        delta = encode_delta(base_html, html)
+        if len(delta) < len(keyframe):
+            return DELTA, delta
+    return KEYFRAME, keyframe
+
+
+def decode(content: bytes, encoding: str, base_html: Optional[str] = None) -> str:
+    if encoding == KEYFRAME:
+        return zlib.decompress(content).decode("utf-8")
+
+    if encoding == DELTA:
+        if base_html is None:
+            raise ValueError("A delta snapshot needs its keyframe to be decoded")
+
+        base_tokens = tokenize(base_html)
+        parts = []
+        for op in json.loads(zlib.decompress(content)):
+            parts.append(
+                op if isinstance(op, str) else "".join(base_tokens[slice(*op)])
+            )
+        return "".join(parts)
+
+    raise ValueError(f"Unknown snapshot encoding: {encoding}")
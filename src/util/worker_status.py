@@ -0,0 +1,70 @@
+import os
+import socket
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from azure.data.tables import UpdateMode
+
+from src.auth_config import auth_config
+from src.storage_backend import StorageBackend
+
+WORKER_PARTITION_KEY = "worker"
+# A worker missing this many heartbeats is reported as not alive
+MISSED_HEARTBEATS = 3
+# Rows of workers silent for this long are deleted
+DEAD_WORKER_RETENTION = 24 * 60 * 60
+
+
+# Heartbeats of scrape workers, one row per worker, so the API can report their
+# health and throughput without sharing a process with them
+class WorkerRegistry:
+    def __init__(self, table_storage: StorageBackend):
+        self.table_storage = table_storage
+        self.table_client = table_storage.worker_status_table_client
+        self.heartbeat_interval = auth_config.WORKER_HEARTBEAT_INTERVAL
+
+    async def heartbeat(self, worker_id: str, status: Dict[str, Any]):
+        await self.table_storage.upsert_entity(
+            self.table_client,
+            mode=UpdateMode.REPLACE,
+            entity={
+                "PartitionKey": WORKER_PARTITION_KEY,
+                "RowKey": worker_id,
+                "hostname": socket.gethostname(),
+                "pid": os.getpid(),
+                "last_heartbeat": datetime.now(timezone.utc),
+                **status,
+            },
+        )
+
+    async def remove(self, worker_id: str):
+        await self.table_storage.delete_entity(
+            self.table_client, WORKER_PARTITION_KEY, worker_id
+        )
+
+    async def list_workers(self) -> List[Dict[str, Any]]:
+        entities = await self.table_storage.query_entities(
+            self.table_client,
+            query_filter=f"PartitionKey eq '{WORKER_PARTITION_KEY}'",
+        )
+
+        now = time.time()
+        workers = []
+        for entity in entities:
+            silent_for = now - entity["last_heartbeat"].timestamp()
+            worker = {
+                key: value for key, value in entity.items() if key != "PartitionKey"
+            }
+            worker["worker_id"] = worker.pop("RowKey")
+            worker["alive"] = silent_for < self.heartbeat_interval * MISSED_HEARTBEATS
+            workers.append(worker)
+        return workers
+
+    # Delete the rows of workers that stopped without removing themselves
+    async def prune(self):
+        now = time.time()
+        for worker in await self.list_workers():
+            silent_for = now - worker["last_heartbeat"].timestamp()
+            if silent_for > DEAD_WORKER_RETENTION:
+                await self.remove(worker["worker_id"])
@@ -0,0 +1,255 @@
+# Run the patrol scheduler and scrape pipeline outside the API process, in one or
+# more processes that split the patrols between them through shard leases. Run
+# the API with RUN_SCHEDULER=false alongside.
+# Usage: python -m src.worker [--processes 4]
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from prometheus_client import start_http_server
+
+from src.api.patrol_history_mgmt import PatrolHistoryManagement
+from src.api.patrol_mgmt import PatrolManagement
+from src.api.scraper import Scraper
+from src.auth_config import auth_config
+from src.logger_config import setup_logger
+from src.storage_backend import create_storage_backend
+from src.util.browser_pool import BrowserPool
+from src.util.domain_throttle import DomainThrottle
+from src.util.fetch_engine import FetchEngine
+from src.util.http_client import HttpClient
+from src.util.http_headers_manager import HttpHeadersManager
+from src.util.lease_backend import InMemoryLeaseBackend, TableLeaseBackend
+from src.util.parser_pool import ParserPool
+from src.util.patrol_schedule import PatrolSchedule
+from src.util.push_dispatcher import PushNotificationDispatcher
+from src.util.shard_coordinator import ShardCoordinator
+from src.util.worker_status import WorkerRegistry
+
+# Tick totals reported in every heartbeat
+HEARTBEAT_STATS = [
+    "due",
+    "completed",
+    "failed",
+    "timed_out",
+    "short_circuited",
+    "throttled",
+    "fetches",
+    "not_modified",
+    "rendered",
+]
+# Shortest time between restarts of a worker process that keeps exiting
+RESTART_DELAY = 5.0
+
+
+# One worker process: the scrape pipeline of the API without its routes. Patrols
+# are always leased by shard, so processes and hosts can come and go, and the
+# periodic poll picks up patrols added or changed through the API.
+class Worker:
+    def __init__(self, worker_id: Optional[str] = None, index: int = 0):
+        self.logger = setup_logger(__name__)
+        self.index = index
+        self.table_storage = create_storage_backend()
+        self.http_client = HttpClient()
+        if auth_config.LEASE_BACKEND == "table":
+            lease_backend = TableLeaseBackend(self.table_storage)
+        else:
+            lease_backend = InMemoryLeaseBackend()
+        self.shard_coordinator = ShardCoordinator(lease_backend, worker_id)
+        self.patrol_schedule = PatrolSchedule(self.shard_coordinator.owns)
+        patrol_management = PatrolManagement(self.table_storage)
+        self.push_dispatcher = PushNotificationDispatcher(
+            self.http_client, on_invalid_token=patrol_management.clear_push_token
+        )
+        self.browser_pool = BrowserPool()
+        self.parser_pool = ParserPool()
+        self.domain_throttle = DomainThrottle()
+        self.scraper = Scraper(
+            self.table_storage,
+            PatrolHistoryManagement(
+                self.table_storage, self.push_dispatcher, self.parser_pool
+            ),
+            HttpHeadersManager(self.browser_pool),
+            self.http_client,
+            self.patrol_schedule,
+            self.parser_pool,
+            self.domain_throttle,
+            FetchEngine(self.browser_pool),
+            self.shard_coordinator,
+        )
+        self.worker_registry = WorkerRegistry(self.table_storage)
+        self.started_at = datetime.now(timezone.utc)
+
+    @property
+    def worker_id(self) -> str:
+        return self.shard_coordinator.node_id
+
+    async def start(self):
+        await self.table_storage.start()
+        await self.http_client.start()
+        await self.browser_pool.start()
+        self.parser_pool.start()
+        await self.push_dispatcher.start()
+        await self.shard_coordinator.start()
+        await self.scraper.seed_schedule()
+        if auth_config.WORKER_METRICS_PORT is not None:
+            start_http_server(auth_config.WORKER_METRICS_PORT + self.index)
+        self.logger.info(f"Worker {self.worker_id} started")
+
+    async def close(self):
+        await self.shard_coordinator.close()
+        try:
+            await self.worker_registry.remove(self.worker_id)
+        except Exception as e:
+            self.logger.warning(f"Failed to remove worker status: {e}")
+        await self.push_dispatcher.close()
+        await self.http_client.close()
+        await self.browser_pool.close()
+        self.parser_pool.close()
+        await self.table_storage.close()
+        self.logger.info(f"Worker {self.worker_id} stopped")
+
+    # Run until SIGINT or SIGTERM, or until the scheduler fails
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stopped = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set)
+
+        await self.start()
+        scheduler = asyncio.create_task(self.scraper.run_scheduler())
+        heartbeat = asyncio.create_task(self.run_heartbeat())
+        stop = asyncio.create_task(stopped.wait())
+        try:
+            await asyncio.wait({scheduler, stop}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (scheduler, heartbeat, stop):
+                task.cancel()
+            await self.close()
+
+        if scheduler.done() and not scheduler.cancelled():
+            # Raise the scheduler's error so the process exits and is restarted
+            scheduler.result()
+
+    # Publish this worker's health and throughput for the API's admin view
+    async def run_heartbeat(self):
+        try:
+            await self.worker_registry.prune()
+        except Exception as e:
+            self.logger.warning(f"Failed to prune worker statuses: {e}")
+
+        last_completed, last_time = 0, time.monotonic()
+        while True:
+            totals = self.scraper.totals
+            now = time.monotonic()
+            elapsed = now - last_time
+            completed = totals.completed - last_completed
+            patrols_per_minute = completed / elapsed * 60 if elapsed > 0 else 0.0
+            last_completed, last_time = totals.completed, now
+
+            try:
+                await self.worker_registry.heartbeat(
+                    self.worker_id,
+                    {
+                        "started_at": self.started_at,
+                        "shards": len(self.shard_coordinator.leases),
+                        "live_nodes": self.shard_coordinator.live_nodes,
+                        "scheduled_patrols": len(self.patrol_schedule),
+                        "push_queue_size": self.push_dispatcher.get_queue_size(),
+                        "ticks": self.scraper.ticks,
+                        "last_tick_seconds": self.scraper.last_tick_duration,
+                        "patrols_per_minute": patrols_per_minute,
+                        **{name: getattr(totals, name) for name in HEARTBEAT_STATS},
+                        **self.domain_throttle.get_summary(),
+                    },
+                )
+            except Exception as e:
+                self.logger.error(f"Failed to report worker status: {e}")
+
+            await asyncio.sleep(auth_config.WORKER_HEARTBEAT_INTERVAL)
+
+
+def run_worker(worker_id: Optional[str] = None, index: int = 0):
+    asyncio.run(Worker(worker_id, index).run())
+
+
+# Keep a worker process per slot running, restarting any that exit, until
+# SIGINT or SIGTERM, then stop them gracefully
+def supervise(processes: int):
+    logger = setup_logger(__name__)
+    context = multiprocessing.get_context("spawn")
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    started_at: Dict[int, float] = {}
+
+    def start(index: int) -> multiprocessing.Process:
+        # Distinct ids so the processes hold separate shard leases
+        worker_id = f"{auth_config.NODE_ID}-{index}" if auth_config.NODE_ID else None
+        process = context.Process(
+            target=run_worker, args=(worker_id, index), name=f"worker-{index}"
+        )
+        process.start()
+        started_at[index] = time.monotonic()
+        return process
+
+    workers = {index: start(index) for index in range(processes)}
+    logger.info(f"Started {processes} worker process(es)")
+
+    while not stopping:
+        time.sleep(1)
+        for index, process in workers.items():
+            if stopping or process.is_alive():
+                continue
+            if time.monotonic() - started_at[index] < RESTART_DELAY:
+                continue
+            logger.warning(
+                f"Worker process {index} exited with code {process.exitcode}, restarting"
+            )
+            workers[index] = start(index)
+
+    logger.info("Stopping worker processes")
+    for process in workers.values():
+        if process.is_alive():
+            process.terminate()
+    for process in workers.values():
+        process.join(timeout=60)
+        if process.is_alive():
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=auth_config.WORKER_PROCESSES)
+    args = parser.parse_args()
+    if args.processes < 1:
+        parser.error("--processes must be at least 1")
+    # In-memory leases can't be shared, processes would all scrape every patrol
+    if args.processes > 1 and auth_config.LEASE_BACKEND == "memory":
+        parser.error("Several worker processes need LEASE_BACKEND=table")
+
+    # Share the cores between the processes' parser pools, spawned processes
+    # inherit the environment
+    if auth_config.PARSER_POOL_SIZE is None:
+        pool_size = max(1, (os.cpu_count() or 1) // args.processes)
+        os.environ["PARSER_POOL_SIZE"] = str(pool_size)
+
+    if args.processes == 1:
+        run_worker()
+    else:
+        supervise(args.processes)
+
+
+if __name__ == "__main__":
+    main()